@@ -0,0 +1,21 @@
+"""Composite (session_id, created_at) index for the chat history tail query
+
+Revision ID: 20261017_chat_history_idx
+Revises: 20250918_otp_and_chat
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '20261017_chat_history_idx'
+down_revision = '20250918_otp_and_chat'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_chat_messages_session_created', 'chat_messages', ['session_id', 'created_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_chat_messages_session_created', table_name='chat_messages')
@@ -0,0 +1,21 @@
+"""Composite (user_id, session_id, created_at) index for /chat/messages pagination
+
+Revision ID: 20261017_chat_keyset_idx
+Revises: 20261017_chat_sessions
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '20261017_chat_keyset_idx'
+down_revision = '20261017_chat_sessions'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_chat_messages_user_session_created', 'chat_messages', ['user_id', 'session_id', 'created_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_chat_messages_user_session_created', table_name='chat_messages')
@@ -0,0 +1,52 @@
+"""Add chat_sessions summary table and backfill it from chat_messages
+
+Revision ID: 20261017_chat_sessions
+Revises: 20261017_chat_history_idx
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_chat_sessions'
+down_revision = '20261017_chat_history_idx'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'chat_sessions',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), primary_key=True),
+        sa.Column('session_id', sa.String(), primary_key=True),
+        sa.Column('title', sa.String(), nullable=True),
+        sa.Column('last_message_preview', sa.String(), nullable=True),
+        sa.Column('message_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index('ix_chat_sessions_user_updated', 'chat_sessions', ['user_id', 'updated_at'])
+
+    # Backfill one summary per (user, session) using the same title/preview rules as the API
+    op.execute("""
+        INSERT INTO chat_sessions (user_id, session_id, title, last_message_preview, message_count, created_at, updated_at)
+        SELECT
+            m.user_id,
+            m.session_id,
+            (SELECT substr(f.message, 1, 40) || '…' FROM chat_messages f
+              WHERE f.user_id = m.user_id AND f.session_id = m.session_id AND f.sender = 'user'
+              ORDER BY f.created_at ASC, f.id ASC LIMIT 1),
+            (SELECT substr(l.message, 1, 80) || '…' FROM chat_messages l
+              WHERE l.user_id = m.user_id AND l.session_id = m.session_id
+              ORDER BY l.created_at DESC, l.id DESC LIMIT 1),
+            COUNT(*),
+            MIN(m.created_at),
+            MAX(m.created_at)
+        FROM chat_messages m
+        GROUP BY m.user_id, m.session_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_chat_sessions_user_updated', table_name='chat_sessions')
+    op.drop_table('chat_sessions')
@@ -0,0 +1,27 @@
+"""Drop users.otp_code / users.otp_expires_at (OTPs now live in the OTP store)
+
+Revision ID: 20261017_drop_user_otp
+Revises: 20261017_username_pattern_idx
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_drop_user_otp'
+down_revision = '20261017_username_pattern_idx'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Codes pending at deploy time are dropped; users can request a new one
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('otp_expires_at')
+        batch_op.drop_column('otp_code')
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('otp_code', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('otp_expires_at', sa.DateTime(), nullable=True))
@@ -0,0 +1,24 @@
+"""Add users.semantic_cache_opt_out
+
+Revision ID: 20261017_semantic_cache_opt_out
+Revises: 20261017_drop_user_otp
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_semantic_cache_opt_out'
+down_revision = '20261017_drop_user_otp'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('semantic_cache_opt_out', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('semantic_cache_opt_out')
@@ -0,0 +1,27 @@
+"""Prefix-search index on users.username for username allocation (Postgres)
+
+Revision ID: 20261017_username_pattern_idx
+Revises: 20261017_chat_keyset_idx
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '20261017_username_pattern_idx'
+down_revision = '20261017_chat_keyset_idx'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The existing unique index only serves LIKE 'prefix%' under the C collation
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_index(
+            'ix_users_username_pattern', 'users', ['username'],
+            postgresql_ops={'username': 'varchar_pattern_ops'},
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_users_username_pattern', table_name='users')
@@ -0,0 +1,230 @@
+# backend/bloom.py
+"""Bloom filters over registered emails and mobile numbers.
+
+/check-email and /check-mobile are called while the user types, and almost
+every value they see is not registered. ``registered_users.might_contain``
+answers "definitely not registered" from a Bloom filter; only probable hits
+(real ones plus ~BLOOM_ERROR_RATE false positives) go to the database.
+
+The filters are filled from the users table at startup and updated on
+signup. Users are never deleted and their email/mobile never change, so the
+filters only need adds. Until the first build finishes every value counts as
+a probable hit.
+
+When REDIS_URL is set the bitmaps live in Redis (BLOOM_BACKEND=redis, the
+default then) and are shared by all workers: they are built once (or rebuilt
+when the user count outgrows them) and every worker's signups set bits there.
+Otherwise each process keeps its own copy, which only sees its own signups
+directly; every BLOOM_REFRESH_SECONDS it adds the users whose id is above the
+last one it has seen minus BLOOM_REFRESH_LOOKBACK, which bounds how long a
+signup on another worker can be answered "not registered". The lookback is
+there because ids are allocated before commit: id 11 can become visible
+before id 10 does, and a plain "above the highest seen" watermark would
+skip 10 for good. Re-adding the overlap is harmless. Both backends run the refresh, so a failed add
+is repaired too.
+
+Signup itself is always checked against the database.
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+from typing import Iterable, List, Optional
+
+from sqlalchemy import func, select
+
+from . import database, metrics
+from .redis_client import get_redis
+
+BLOOM_CAPACITY = int(os.getenv("BLOOM_CAPACITY", "1000000"))
+BLOOM_ERROR_RATE = float(os.getenv("BLOOM_ERROR_RATE", "0.01"))
+BLOOM_REFRESH_SECONDS = float(os.getenv("BLOOM_REFRESH_SECONDS", "10"))
+BLOOM_REFRESH_LOOKBACK = int(os.getenv("BLOOM_REFRESH_LOOKBACK", "1000"))
+FIELDS = ("email", "mobile_no")
+
+BLOOM_LOOKUPS = metrics.counter("bloom_lookups_total", "Registration checks by field and outcome")
+
+
+def bloom_parameters(capacity: int, error_rate: float) -> tuple:
+    """Bit count and hash count for ``capacity`` items at ``error_rate``."""
+    bits = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+def _positions(value: str, bits: int, hashes: int) -> List[int]:
+    # Double hashing: k positions from two 64-bit halves of one digest
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+class BloomFilter:
+    """Bitmap in Redis bit order (bit 0 is the high bit of byte 0)."""
+
+    def __init__(self, bits: int, hashes: int):
+        self.bits = bits
+        self.hashes = hashes
+        self.bitmap = bytearray((bits + 7) // 8)
+        self._lock = threading.Lock()
+
+    def add(self, value: str) -> None:
+        # Signups and the refresh thread add concurrently; a lost bit would be a false negative
+        with self._lock:
+            for pos in _positions(value, self.bits, self.hashes):
+                self.bitmap[pos >> 3] |= 0x80 >> (pos & 7)
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bitmap[pos >> 3] & (0x80 >> (pos & 7)) for pos in _positions(value, self.bits, self.hashes))
+
+
+class RedisBloomFilter:
+    """The same filter stored as a Redis string, updated with SETBIT."""
+
+    def __init__(self, client, key: str, bits: int, hashes: int):
+        self.client = client
+        self.key = key
+        self.bits = bits
+        self.hashes = hashes
+
+    def add(self, value: str) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        for pos in _positions(value, self.bits, self.hashes):
+            pipe.setbit(self.key, pos, 1)
+        pipe.execute()
+
+    def __contains__(self, value: str) -> bool:
+        pipe = self.client.pipeline(transaction=False)
+        for pos in _positions(value, self.bits, self.hashes):
+            pipe.getbit(self.key, pos)
+        return all(pipe.execute())
+
+
+class RegisteredUsers:
+    def __init__(self, capacity: int = BLOOM_CAPACITY, error_rate: float = BLOOM_ERROR_RATE, redis_client=None,
+                 lookback: int = BLOOM_REFRESH_LOOKBACK):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.redis = redis_client
+        self.lookback = lookback  # ids below the highest seen that each refresh reads again
+        self._filters: Optional[dict] = None
+        self._last_id = 0  # highest user id read from the table
+
+    def might_contain(self, field: str, value: str) -> bool:
+        """False means definitely not registered; True means ask the database."""
+        filters = self._filters
+        if filters is None:
+            return True
+        try:
+            hit = value in filters[field]
+        except Exception as e:
+            print(f"Bloom filter lookup failed, using DB: {e}")
+            return True
+        if not hit:
+            BLOOM_LOOKUPS.inc(field=field, result="negative")
+        return hit
+
+    def record_db_result(self, field: str, exists: bool) -> None:
+        # Probable hits that were not in the DB are the filter's false positives
+        BLOOM_LOOKUPS.inc(field=field, result="hit" if exists else "false_positive")
+
+    def add(self, email: str, mobile_no: str) -> None:
+        """Call after a new user is committed."""
+        filters = self._filters
+        if filters is None:
+            # Not built yet; the build reads the user from the table instead
+            return
+        try:
+            filters["email"].add(email)
+            filters["mobile_no"].add(mobile_no)
+        except Exception as e:
+            print(f"Bloom filter update failed: {e}")
+
+    def rebuild(self, session_factory) -> None:
+        """Fills the filters from the users table (run once at startup)."""
+        with session_factory() as db:
+            count = db.scalar(select(func.count(database.User.id))) or 0
+            capacity = max(self.capacity, 2 * count)
+            if self.redis is not None:
+                filters = self._load_shared(count)
+                if filters is not None:
+                    self._last_id = db.scalar(select(func.max(database.User.id))) or 0
+                    self._filters = filters
+                    return
+            bits, hashes = bloom_parameters(capacity, self.error_rate)
+            local = {field: BloomFilter(bits, hashes) for field in FIELDS}
+            last_id = 0
+            for user_id, email, mobile_no in self._iter_users(db):
+                local["email"].add(email)
+                local["mobile_no"].add(mobile_no)
+                last_id = max(last_id, user_id)
+            filters = local if self.redis is None else self._store_shared(local, capacity)
+            self._last_id = last_id
+            self._filters = filters
+            # Signups committed while the bitmap was being built or uploaded
+            self._add_new_users(db)
+        print(f"Bloom filters ready for {count} users ({bits} bits, {hashes} hashes per field).")
+
+    def refresh(self, session_factory) -> None:
+        """Adds users created since the last build or refresh, e.g. by other workers."""
+        if self._filters is None:
+            self.rebuild(session_factory)
+            return
+        with session_factory() as db:
+            self._add_new_users(db)
+
+    def run_refresh_loop(self, session_factory, interval: float = BLOOM_REFRESH_SECONDS) -> None:
+        """Builds the filters, then refreshes them every ``interval`` seconds. Runs forever."""
+        while True:
+            try:
+                self.refresh(session_factory)
+            except Exception as e:
+                print(f"Could not refresh the registration Bloom filters: {e}")
+            time.sleep(interval)
+
+    def _add_new_users(self, db) -> None:
+        last_id = self._last_id
+        # Re-scan the last few ids too: a lower id may have committed after a higher one
+        for user_id, email, mobile_no in self._iter_users(db, after_id=max(0, last_id - self.lookback)):
+            self.add(email, mobile_no)
+            last_id = max(last_id, user_id)
+        self._last_id = last_id
+
+    def _iter_users(self, db, after_id: int = 0) -> Iterable[tuple]:
+        User = database.User
+        stmt = select(User.id, User.email, User.mobile_no).where(User.id > after_id).execution_options(yield_per=10000)
+        return db.execute(stmt)
+
+    # --- Shared (Redis) bitmaps ---
+
+    def _load_shared(self, count: int) -> Optional[dict]:
+        params = self.redis.hgetall("bloom:users:params")
+        if not params or count > int(params["capacity"]):
+            return None
+        if not all(self.redis.exists(f"bloom:users:{field}") for field in FIELDS):
+            return None
+        bits, hashes = int(params["bits"]), int(params["hashes"])
+        print(f"Using shared Bloom filters from Redis ({bits} bits, {hashes} hashes per field).")
+        return {field: RedisBloomFilter(self.redis, f"bloom:users:{field}", bits, hashes) for field in FIELDS}
+
+    def _store_shared(self, local: dict, capacity: int) -> dict:
+        bits, hashes = local["email"].bits, local["email"].hashes
+        pipe = self.redis.pipeline()
+        for field in FIELDS:
+            pipe.set(f"bloom:users:{field}", bytes(local[field].bitmap))
+        pipe.hset("bloom:users:params", mapping={"bits": bits, "hashes": hashes, "capacity": capacity})
+        pipe.execute()
+        return {field: RedisBloomFilter(self.redis, f"bloom:users:{field}", bits, hashes) for field in FIELDS}
+
+
+def _create_registered_users() -> RegisteredUsers:
+    backend = os.getenv("BLOOM_BACKEND", "redis" if os.getenv("REDIS_URL") else "memory").lower()
+    client = get_redis() if backend == "redis" else None
+    if backend == "redis" and client is None:
+        print(f"BLOOM_BACKEND=redis but Redis is unavailable; keeping per-process filters refreshed every {BLOOM_REFRESH_SECONDS:g}s.")
+    return RegisteredUsers(redis_client=client)
+
+
+registered_users = _create_registered_users()
@@ -0,0 +1,153 @@
+# backend/catalogue.py
+"""Preprocessed movie catalogue for ingestion.
+
+``build_catalogue`` turns the raw TMDB CSV into a typed, cleaned Parquet file
+once: nulls are filled, release dates parsed and limited to 1980-2025, and the
+retrieval text (``page_content``) and metadata columns are computed with
+Arrow compute kernels over whole columns rather than per row. Ingestion runs
+then read the Parquet file lazily, one record batch at a time, with
+``iter_documents``.
+
+The catalogue is rebuilt automatically when the CSV is newer than it.
+"""
+import os
+from typing import Collection, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+from langchain_core.documents import Document
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CSV_PATH = os.path.join(BACKEND_DIR, "TMDB_movie_dataset_v11.csv")
+DEFAULT_CATALOGUE_PATH = os.path.join(BACKEND_DIR, "movie_catalogue.parquet")
+ROW_GROUP_SIZE = 50000
+MIN_YEAR, MAX_YEAR = 1980, 2025
+
+# CSV column -> type it is read as
+CSV_COLUMNS = {
+    "id": pa.int64(),
+    "title": pa.string(),
+    "vote_average": pa.float64(),
+    "runtime": pa.float64(),
+    "adult": pa.bool_(),
+    "imdb_id": pa.string(),
+    "original_language": pa.string(),
+    "original_title": pa.string(),
+    "overview": pa.string(),
+    "popularity": pa.float64(),
+    "tagline": pa.string(),
+    "genres": pa.string(),
+    "production_countries": pa.string(),
+    "spoken_languages": pa.string(),
+    "keywords": pa.string(),
+    "release_date": pa.string(),
+}
+
+# Metadata stored with every vector, in this order
+METADATA_COLUMNS = [
+    "id", "title", "vote_average", "runtime", "adult", "imdb_id", "original_language", "original_title",
+    "popularity", "tagline", "genres", "production_countries", "spoken_languages", "keywords", "release_date",
+]
+
+
+def read_movies_csv(csv_path: str = DEFAULT_CSV_PATH) -> pa.Table:
+    return pv.read_csv(
+        csv_path,
+        parse_options=pv.ParseOptions(newlines_in_values=True),
+        convert_options=pv.ConvertOptions(
+            include_columns=list(CSV_COLUMNS),
+            column_types=CSV_COLUMNS,
+            strings_can_be_null=True,
+        ),
+    )
+
+
+def clean_movies(table: pa.Table) -> pa.Table:
+    """Cleans and filters the raw table and adds the ``page_content`` column."""
+    table = table.filter(pc.is_valid(table["overview"]))
+
+    released = pc.strptime(table["release_date"], format="%Y-%m-%d", unit="s", error_is_null=True)
+    year = pc.year(released)
+    keep = pc.and_(pc.is_valid(released), pc.and_(pc.greater_equal(year, MIN_YEAR), pc.less_equal(year, MAX_YEAR)))
+    table = table.filter(pc.fill_null(keep, False))
+    released = pc.strptime(table["release_date"], format="%Y-%m-%d", unit="s")
+
+    columns = {}
+    for name in METADATA_COLUMNS:
+        col = table[name]
+        if name == "id":
+            col = pc.cast(col, pa.string())
+        elif name == "release_date":
+            col = pc.strftime(released, format="%Y-%m-%d")
+        elif name == "adult":
+            # Same "True"/"False" strings the metadata always carried
+            col = pc.if_else(pc.fill_null(col, False), "True", "False")
+        elif pa.types.is_floating(col.type):
+            col = pc.fill_null(col, 0.0)
+        else:
+            col = pc.fill_null(col, "")
+        columns[name] = col
+
+    page_content = pc.binary_join_element_wise(
+        "Title: ", columns["title"],
+        "\nTagline: ", columns["tagline"],
+        "\nGenres: ", columns["genres"],
+        "\nKeywords: ", columns["keywords"],
+        "\nOverview: ", pc.fill_null(table["overview"], ""),
+        "",
+    )
+    return pa.table({"page_content": page_content, **columns})
+
+
+def build_catalogue(csv_path: str = DEFAULT_CSV_PATH, out_path: str = DEFAULT_CATALOGUE_PATH) -> int:
+    """Writes the cleaned catalogue to ``out_path`` and returns its row count."""
+    table = clean_movies(read_movies_csv(csv_path))
+    tmp_path = f"{out_path}.tmp"
+    pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE, compression="zstd")
+    os.replace(tmp_path, out_path)
+    return table.num_rows
+
+
+def ensure_catalogue(csv_path: str = DEFAULT_CSV_PATH, out_path: str = DEFAULT_CATALOGUE_PATH) -> str:
+    """Builds the catalogue if it is missing or older than the CSV; returns its path."""
+    if not os.path.exists(out_path) or (os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(out_path)):
+        print(f"Building movie catalogue from {csv_path}...")
+        rows = build_catalogue(csv_path, out_path)
+        print(f"Wrote {rows} movies to {out_path}.")
+    return out_path
+
+
+def catalogue_rows(path: str = DEFAULT_CATALOGUE_PATH) -> int:
+    return pq.ParquetFile(path).metadata.num_rows
+
+
+def documents_from_batch(batch: pa.RecordBatch) -> List[Document]:
+    texts = batch.column("page_content").to_pylist()
+    metadatas = batch.select(METADATA_COLUMNS).to_pylist()
+    return [Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas)]
+
+
+def iter_documents(path: str = DEFAULT_CATALOGUE_PATH, batch_size: int = 100,
+                   ids: Optional[Collection[str]] = None) -> Iterator[List[Document]]:
+    """Yields the catalogue as lists of up to ``batch_size`` Documents, reading lazily.
+
+    With ``ids``, only those movies are yielded (still in full batches).
+    """
+    parquet = pq.ParquetFile(path)
+    if ids is None:
+        for batch in parquet.iter_batches(batch_size=batch_size):
+            yield documents_from_batch(batch)
+        return
+    wanted = pa.array(list(ids), type=pa.string())
+    pending: List[Document] = []
+    for batch in parquet.iter_batches(batch_size=ROW_GROUP_SIZE):
+        batch = batch.filter(pc.is_in(batch.column("id"), value_set=wanted))
+        pending.extend(documents_from_batch(batch))
+        full = len(pending) - len(pending) % batch_size
+        for start in range(0, full, batch_size):
+            yield pending[start:start + batch_size]
+        pending = pending[full:]
+    if pending:
+        yield pending
@@ -0,0 +1,253 @@
+# backend/chat_history.py
+"""Recent chat history for the agent prompt.
+
+Each /chat turn only needs the last CHAT_HISTORY_LIMIT messages of its
+session. They are kept in a per-session ring buffer that is filled from the
+message writes:
+
+* ``RedisHistoryBuffer`` (when REDIS_URL is set) is shared by all workers,
+  and with it the common case never touches the database. Each list is
+  stored with the id of the newest message it holds (its version). Writes
+  record their id even when the list is not cached, and a seed read from
+  the database is dropped if a newer message was recorded meanwhile, so a
+  turn committed by another worker is never lost from the buffer.
+* ``MemoryHistoryBuffer`` is per process and holds a bounded number of
+  sessions. Its entries are keyed on the session's latest message id, which
+  is checked with a one-row index lookup before each use, so a turn saved by
+  another worker makes the entry reload instead of serving stale history.
+  That lookup runs on every turn: without a shared store it is the price of
+  correct history across workers, and it replaces the bounded tail query.
+
+On a buffer miss the tail is read with one bounded query on the
+(session_id, created_at) index and used to seed the buffer. Redis calls
+run in a worker thread, off the event loop.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import database
+from .redis_client import get_redis
+
+HISTORY_LIMIT = int(os.getenv("CHAT_HISTORY_LIMIT", "40"))
+HISTORY_TTL_SECONDS = int(os.getenv("CHAT_HISTORY_TTL_SECONDS", str(6 * 3600)))
+
+
+async def alatest_message_id(db: AsyncSession, session_id: str) -> Optional[int]:
+    """Id of the newest message of a session, from the (session_id, created_at) index."""
+    Msg = database.ChatMessage
+    stmt = (
+        select(Msg.id)
+        .where(Msg.session_id == session_id)
+        .order_by(Msg.created_at.desc(), Msg.id.desc())
+        .limit(1)
+    )
+    return await db.scalar(stmt)
+
+
+async def aload_recent_messages(db: AsyncSession, session_id: str,
+                                limit: int = HISTORY_LIMIT) -> Tuple[List[Dict[str, str]], Optional[int]]:
+    """Returns the latest ``limit`` messages of a session, oldest first, and the id of the newest one."""
+    Msg = database.ChatMessage
+    stmt = (
+        select(Msg.id, Msg.sender, Msg.message)
+        .where(Msg.session_id == session_id)
+        .order_by(Msg.created_at.desc(), Msg.id.desc())
+        .limit(limit)
+    )
+    rows = (await db.execute(stmt)).all()
+    version = rows[0][0] if rows else None
+    return [{"sender": sender, "message": message} for _, sender, message in reversed(rows)], version
+
+
+# --- Ring buffers ---
+
+class MemoryHistoryBuffer:
+    """Bounded in-process buffers: ``maxlen`` messages for up to ``max_sessions`` sessions (LRU).
+
+    Each entry carries the id of the session's newest message (``version``)
+    and is only served while that still matches the database.
+    """
+
+    shared = False
+
+    def __init__(self, maxlen: int = HISTORY_LIMIT, max_sessions: int = 10000, ttl_seconds: int = HISTORY_TTL_SECONDS):
+        self.maxlen = maxlen
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str, version: Optional[int] = None) -> Optional[List[Dict[str, str]]]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            expires_at, entry_version, messages = entry
+            if time.monotonic() > expires_at or entry_version != version:
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return list(messages)
+
+    def seed(self, session_id: str, messages: List[Dict[str, str]], version: Optional[int] = None) -> None:
+        with self._lock:
+            self._sessions[session_id] = (time.monotonic() + self.ttl_seconds, version, deque(messages, maxlen=self.maxlen))
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def append(self, session_id: str, messages: List[Dict[str, str]], version: Optional[int] = None) -> None:
+        # Only extend sessions we already hold; otherwise the next read seeds from the DB
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                entry[2].extend(messages)
+                self._sessions[session_id] = (time.monotonic() + self.ttl_seconds, version, entry[2])
+                self._sessions.move_to_end(session_id)
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class RedisHistoryBuffer:
+    """Redis lists trimmed to ``maxlen`` entries, shared across workers.
+
+    Next to each list is the id of the newest message written to the
+    session (``version``); every write records it, cached list or not.
+    """
+
+    shared = True  # every write records its version here, so reads need no DB check
+
+    # Only seeds a list nobody has created, from data no older than the last recorded write
+    _SEED_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[2]))
+if redis.call('EXISTS', KEYS[1]) == 1 or (current and current > tonumber(ARGV[1])) then
+    return 0
+end
+redis.call('RPUSH', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('SET', KEYS[2], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+    # Records the version, then extends the list only if it exists and this write is the newest
+    _APPEND_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[2]))
+local version = tonumber(ARGV[1])
+redis.call('SET', KEYS[2], math.max(version, current or 0), 'EX', ARGV[2])
+if current and version <= current then
+    -- Raced with another worker's write; the next read reloads from the DB
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('RPUSH', KEYS[1], unpack(ARGV, 4))
+redis.call('LTRIM', KEYS[1], -tonumber(ARGV[3]), -1)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+    def __init__(self, client, maxlen: int = HISTORY_LIMIT, ttl_seconds: int = HISTORY_TTL_SECONDS):
+        self.client = client
+        self.maxlen = maxlen
+        self.ttl_seconds = ttl_seconds
+        self._seed = client.register_script(self._SEED_SCRIPT)
+        self._append = client.register_script(self._APPEND_SCRIPT)
+
+    def _key(self, session_id: str) -> str:
+        return f"chat:history:{session_id}"
+
+    def _version_key(self, session_id: str) -> str:
+        return f"chat:history:{session_id}:version"
+
+    def get(self, session_id: str, version: Optional[int] = None) -> Optional[List[Dict[str, str]]]:
+        items = self.client.lrange(self._key(session_id), 0, -1)
+        if not items:
+            return None
+        return [json.loads(item) for item in items]
+
+    def seed(self, session_id: str, messages: List[Dict[str, str]], version: Optional[int] = None) -> None:
+        if not messages or version is None:
+            return
+        self._seed(keys=[self._key(session_id), self._version_key(session_id)],
+                   args=[version, self.ttl_seconds, *[json.dumps(m) for m in messages[-self.maxlen:]]])
+
+    def append(self, session_id: str, messages: List[Dict[str, str]], version: Optional[int] = None) -> None:
+        if version is None:
+            # Cannot be ordered against other writes; let the next read reload
+            self.clear(session_id)
+            return
+        # A session that is not cached is seeded from the DB on its next read instead
+        self._append(keys=[self._key(session_id), self._version_key(session_id)],
+                     args=[version, self.ttl_seconds, self.maxlen, *[json.dumps(m) for m in messages]])
+
+    def clear(self, session_id: str) -> None:
+        self.client.delete(self._key(session_id), self._version_key(session_id))
+
+
+# --- Public API ---
+
+class ChatHistory:
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    async def _call(self, fn, *args):
+        # Redis round trips go to a worker thread; the in-process buffer is just a dict
+        if self.buffer.shared:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def aget(self, db: AsyncSession, session_id: str) -> List[Dict[str, str]]:
+        """Recent messages for the prompt, from the buffer or (on a miss) the DB."""
+        version = None
+        if not self.buffer.shared:
+            # Another worker may have saved turns this process has not seen
+            version = await alatest_message_id(db, session_id)
+        try:
+            messages = await self._call(self.buffer.get, session_id, version)
+        except Exception as e:
+            print(f"History buffer read failed, using DB: {e}")
+            messages = None
+        if messages is None:
+            messages, version = await aload_recent_messages(db, session_id, self.buffer.maxlen)
+            await self._safe(self.buffer.seed, session_id, messages, version)
+        return messages
+
+    async def aappend(self, session_id: str, messages: List[Dict[str, str]], version: Optional[int] = None) -> None:
+        """Call after the messages are committed to the DB; ``version`` is the id of the last one."""
+        try:
+            await self._call(self.buffer.append, session_id, messages, version)
+        except Exception as e:
+            # Drop the entry rather than keep serving a buffer that missed a write
+            print(f"History buffer update failed: {e}")
+            await self._safe(self.buffer.clear, session_id)
+
+    async def aclear(self, session_id: str) -> None:
+        await self._safe(self.buffer.clear, session_id)
+
+    async def _safe(self, fn, *args) -> None:
+        # The buffer is only an accelerator; the DB stays the source of truth
+        try:
+            await self._call(fn, *args)
+        except Exception as e:
+            print(f"History buffer update failed: {e}")
+
+
+def _create_history() -> ChatHistory:
+    client = get_redis()
+    if client is not None:
+        return ChatHistory(RedisHistoryBuffer(client))
+    return ChatHistory(MemoryHistoryBuffer())
+
+
+chat_history = _create_history()
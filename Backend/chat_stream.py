@@ -0,0 +1,50 @@
+# backend/chat_stream.py
+"""Helpers for streaming /chat replies as Server-Sent Events."""
+import json
+
+FINAL_ANSWER_MARKER = "Final Answer:"
+
+# Friendly status lines sent while the agent is using a tool
+TOOL_STATUS = {
+    "movie_database_search": "Searching movies…",
+    "web_scraper_tool": "Checking the web for recent releases…",
+}
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Formats one SSE frame; data is JSON so newlines in tokens survive."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class FinalAnswerFilter:
+    """Extracts the user-facing part of a streamed ReAct completion.
+
+    The agent LLM writes ``Thought: ...`` / ``Action: ...`` text and, on its
+    last step, ``Final Answer: ...``. Only text after the marker should reach
+    the user, so chunks are buffered until the marker shows up (it may be split
+    across chunks) and passed through from then on. ``reset`` is called at the
+    start of every LLM call in the loop.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self._buffer = ""
+        self._active = False
+        self._at_start = False
+
+    def feed(self, chunk: str) -> str:
+        if not self._active:
+            self._buffer += chunk
+            idx = self._buffer.find(FINAL_ANSWER_MARKER)
+            if idx == -1:
+                return ""
+            self._active = self._at_start = True
+            chunk = self._buffer[idx + len(FINAL_ANSWER_MARKER):]
+            self._buffer = ""
+        if self._at_start:
+            # Drop the whitespace between the marker and the answer
+            chunk = chunk.lstrip()
+            self._at_start = not chunk
+        return chunk
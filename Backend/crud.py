@@ -1,4 +1,8 @@
 # backend/crud.py
+import base64
+from datetime import datetime
+from sqlalchemy import and_, delete, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 # Use explicit relative imports to match package layout and avoid path issues
 from . import database, schemas, security
@@ -52,6 +56,16 @@ def update_profile_pic_url(db: Session, user_id: int, url: str):
         db.refresh(db_user)
     return db_user
 
+def replace_profile_pic_url(db: Session, user_id: int, old_url: str, new_url: str) -> bool:
+    """Sets the profile picture URL only while it is still ``old_url``; True if it was changed."""
+    updated = (
+        db.query(database.User)
+        .filter(database.User.id == user_id, database.User.profile_pic_url == old_url)
+        .update({"profile_pic_url": new_url}, synchronize_session=False)
+    )
+    db.commit()
+    return bool(updated)
+
 def get_user_by_id(db: Session, user_id: int):
     return db.query(database.User).filter(database.User.id == user_id).first()
 
@@ -61,4 +75,231 @@ def update_username(db: Session, user_id: int, new_username: str):
         db_user.username = new_username
         db.commit()
         db.refresh(db_user)
-    return db_user
\ No newline at end of file
+    return db_user
+
+def update_semantic_cache_opt_out(db: Session, user_id: int, opt_out: bool):
+    db_user = get_user_by_id(db, user_id)
+    if db_user:
+        db_user.semantic_cache_opt_out = opt_out
+        db.commit()
+        db.refresh(db_user)
+    return db_user
+
+# --- Chat messages and session summaries ---
+
+def _session_title(message: str) -> str:
+    return message[:40] + '…'
+
+def _message_preview(message: str) -> str:
+    return message[:80] + '…'
+
+def _summary_values(session_id: str, user_id: int, messages: list[tuple[str, str]]) -> dict:
+    """Summary columns for appending ``messages`` ((sender, message) pairs) to a session."""
+    now = datetime.utcnow()
+    first_user = next((message for sender, message in messages if sender == 'user'), None)
+    return dict(
+        user_id=user_id,
+        session_id=session_id,
+        title=_session_title(first_user) if first_user is not None else None,
+        last_message_preview=_message_preview(messages[-1][1]),
+        message_count=len(messages),
+        created_at=now,
+        updated_at=now,
+    )
+
+def _summary_upsert(dialect: str, values: dict):
+    """INSERT .. ON CONFLICT for the session summary, or None if the dialect lacks it."""
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    summary = database.ChatSessionSummary.__table__
+    stmt = insert(summary).values(**values)
+    return stmt.on_conflict_do_update(
+        index_elements=[summary.c.user_id, summary.c.session_id],
+        set_={
+            "title": func.coalesce(summary.c.title, stmt.excluded.title),
+            "last_message_preview": stmt.excluded.last_message_preview,
+            "message_count": summary.c.message_count + stmt.excluded.message_count,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+
+def _update_summary_row(row: database.ChatSessionSummary, values: dict):
+    row.title = row.title or values["title"]
+    row.last_message_preview = values["last_message_preview"]
+    row.message_count += values["message_count"]
+    row.updated_at = values["updated_at"]
+
+def record_chat_exchange(db: Session, session_id: str, user_id: int, user_message: str, bot_message: str):
+    """Stores a user/bot message pair and updates the session summary in one transaction."""
+    db.add(database.ChatMessage(session_id=session_id, user_id=user_id, sender='user', message=user_message))
+    db.add(database.ChatMessage(session_id=session_id, user_id=user_id, sender='bot', message=bot_message))
+
+    values = _summary_values(session_id, user_id, [('user', user_message), ('bot', bot_message)])
+    stmt = _summary_upsert(db.get_bind().dialect.name, values)
+    if stmt is not None:
+        db.execute(stmt)
+    else:
+        row = db.get(database.ChatSessionSummary, (user_id, session_id))
+        if row is None:
+            db.add(database.ChatSessionSummary(**values))
+        else:
+            _update_summary_row(row, values)
+    db.commit()
+
+def encode_message_cursor(message: database.ChatMessage) -> str:
+    """Opaque keyset cursor for a message: its (created_at, id) position."""
+    raw = f"{message.created_at.isoformat()}|{message.id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_message_cursor(cursor: str) -> tuple[datetime, int]:
+    """Inverse of encode_message_cursor; raises ValueError on malformed input."""
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    created_at, message_id = raw.split("|", 1)
+    return datetime.fromisoformat(created_at), int(message_id)
+
+def _messages_page_query(user_id: int, session_id: str, limit: int, before: str | None, after: str | None):
+    """SELECT for a keyset page; returns (statement, walking_forward)."""
+    Msg = database.ChatMessage
+    stmt = select(Msg).where(Msg.user_id == user_id, Msg.session_id == session_id)
+    if after:
+        ts, mid = decode_message_cursor(after)
+        stmt = stmt.where(or_(Msg.created_at > ts, and_(Msg.created_at == ts, Msg.id > mid)))
+        return stmt.order_by(Msg.created_at.asc(), Msg.id.asc()).limit(limit + 1), True
+    if before:
+        ts, mid = decode_message_cursor(before)
+        stmt = stmt.where(or_(Msg.created_at < ts, and_(Msg.created_at == ts, Msg.id < mid)))
+    return stmt.order_by(Msg.created_at.desc(), Msg.id.desc()).limit(limit + 1), False
+
+def _messages_page_result(rows: list, limit: int, forward: bool):
+    page = rows[:limit] if forward else list(reversed(rows[:limit]))
+    return page, len(rows) > limit
+
+
+# --- Async equivalents (auth path) ---
+# Passwords arrive pre-hashed: hashing runs in security's dedicated worker pool.
+
+async def aget_user_by_email(db: AsyncSession, email: str):
+    return await db.scalar(select(database.User).where(database.User.email == email))
+
+async def aget_user_by_username(db: AsyncSession, username: str):
+    return await db.scalar(select(database.User).where(database.User.username == username))
+
+async def aget_signup_conflicts(db: AsyncSession, email: str, mobile_no: str) -> set[str]:
+    """Which of ``{"email", "mobile_no"}`` are already registered, in one query."""
+    User = database.User
+    rows = (await db.execute(
+        select(User.email, User.mobile_no).where(or_(User.email == email, User.mobile_no == mobile_no)).limit(2)
+    )).all()
+    conflicts = set()
+    for row_email, row_mobile in rows:
+        if row_email == email:
+            conflicts.add("email")
+        if row_mobile == mobile_no:
+            conflicts.add("mobile_no")
+    return conflicts
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+async def anext_free_username(db: AsyncSession, base: str) -> str:
+    """``base`` if free, else ``base`` + (highest numeric suffix in use + 1).
+
+    One prefix lookup on the username index. Concurrent signups can still pick
+    the same name, so callers retry when the unique constraint rejects it.
+    """
+    User = database.User
+    taken = (await db.scalars(
+        select(User.username).where(User.username.like(_escape_like(base) + "%", escape="\\"))
+    )).all()
+    if base not in taken:
+        return base
+    suffixes = [0]
+    for name in taken:
+        tail = name[len(base):]
+        if name.startswith(base) and tail.isascii() and tail.isdigit():
+            suffixes.append(int(tail))
+    return f"{base}{max(suffixes) + 1}"
+
+async def aget_user_by_id(db: AsyncSession, user_id: int):
+    return await db.get(database.User, user_id)
+
+async def acreate_user(db: AsyncSession, user: schemas.UserCreate, hashed_password: str, override_username: str | None = None):
+    db_user = database.User(
+        first_name=user.first_name,
+        last_name=user.last_name,
+        mobile_no=user.mobile_no,
+        email=user.email,
+        username=override_username or user.email.split('@')[0],
+        hashed_password=hashed_password
+    )
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+async def aupdate_user_password(db: AsyncSession, user: database.User, hashed_password: str):
+    user.hashed_password = hashed_password
+    db.add(user)
+    await db.commit()
+    await db.refresh(user)
+    return user
+
+
+# --- Async equivalents (chat path) ---
+
+async def arecord_chat_messages(db: AsyncSession, session_id: str, user_id: int, messages: list[tuple[str, str]]) -> int:
+    """Stores (sender, message) pairs and updates the session summary in one transaction.
+
+    Returns the id of the last message stored.
+    """
+    rows = [database.ChatMessage(session_id=session_id, user_id=user_id, sender=sender, message=message)
+            for sender, message in messages]
+    db.add_all(rows)
+
+    values = _summary_values(session_id, user_id, messages)
+    stmt = _summary_upsert(db.get_bind().dialect.name, values)
+    if stmt is not None:
+        await db.execute(stmt)
+    else:
+        row = await db.get(database.ChatSessionSummary, (user_id, session_id))
+        if row is None:
+            db.add(database.ChatSessionSummary(**values))
+        else:
+            _update_summary_row(row, values)
+    await db.commit()
+    return rows[-1].id
+
+async def alist_chat_sessions(db: AsyncSession, user_id: int, limit: int = 50, offset: int = 0):
+    """Newest-first page of a user's session summaries."""
+    Summary = database.ChatSessionSummary
+    stmt = (
+        select(Summary)
+        .where(Summary.user_id == user_id)
+        .order_by(Summary.updated_at.desc())
+        .offset(offset)
+        .limit(limit)
+    )
+    return (await db.scalars(stmt)).all()
+
+async def aget_chat_messages_page(db: AsyncSession, user_id: int, session_id: str, limit: int,
+                                  before: str | None = None, after: str | None = None):
+    """Keyset page of a session's messages on (user_id, session_id, created_at).
+
+    Without cursors this is the latest page. ``before`` walks back to older
+    messages, ``after`` forward to newer ones. Returns the rows oldest first
+    and whether more rows exist past the page in the direction walked.
+    """
+    stmt, forward = _messages_page_query(user_id, session_id, limit, before, after)
+    return _messages_page_result((await db.scalars(stmt)).all(), limit, forward)
+
+async def adelete_chat_session(db: AsyncSession, user_id: int, session_id: str) -> int:
+    """Deletes a session's messages and summary; returns the number of messages removed."""
+    Msg, Summary = database.ChatMessage, database.ChatSessionSummary
+    result = await db.execute(delete(Msg).where(Msg.user_id == user_id, Msg.session_id == session_id))
+    await db.execute(delete(Summary).where(Summary.user_id == user_id, Summary.session_id == session_id))
+    await db.commit()
+    return result.rowcount
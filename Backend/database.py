@@ -1,8 +1,17 @@
 import os
+import logging
+import time
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Text, DateTime, Boolean
+from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Text, DateTime, Boolean, Index, false
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from datetime import datetime
+try:
+    from . import metrics
+except ImportError:  # run directly as `python database.py`
+    import metrics
 
 # --- THIS IS THE UPDATED SECTION ---
 # Find the absolute path to the .env file and load it
@@ -17,12 +26,128 @@ SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 
 
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# --- Connection pool ---
+# Sized per worker process via env vars; pre-ping and recycle keep managed
+# Postgres (and its poolers) from handing us dead connections.
+#
+# DB_POOL_SIZE and DB_MAX_OVERFLOW are the budget for one worker process. It
+# is split between the sync engine (auth/account endpoints) and the async one
+# (chat), so a worker never opens more than DB_POOL_SIZE + DB_MAX_OVERFLOW
+# connections in total (each pool keeps at least one). DB_SYNC_POOL_SIZE, DB_SYNC_MAX_OVERFLOW,
+# DB_ASYNC_POOL_SIZE and DB_ASYNC_MAX_OVERFLOW override either share.
+logger = logging.getLogger(__name__)
+
+POOL_CHECKED_OUT = metrics.gauge("db_pool_checked_out", "Connections currently checked out of the pool")
+POOL_OVERFLOW = metrics.gauge("db_pool_overflow", "Connections open beyond pool_size")
+POOL_SIZE = metrics.gauge("db_pool_size", "Configured pool_size")
+POOL_CHECKOUT_WAIT = metrics.histogram("db_pool_checkout_wait_seconds", "Time spent queueing for a connection while the pool was exhausted")
+POOL_QUEUED = metrics.counter("db_pool_queued_checkouts_total", "Checkouts that had to wait because the pool was exhausted")
+
+
+class _InstrumentedPoolMixin:
+    """Times checkouts that queue on an exhausted pool and warns when they happen."""
+    metrics_name = "sync"
+    _last_warning = 0.0
+
+    def _do_get(self):
+        exhausted = self._max_overflow > -1 and self.checkedout() >= self.size() + self._max_overflow
+        if not exhausted:
+            # An idle connection, or a new one within max_overflow: no queueing to measure
+            return super()._do_get()
+        POOL_QUEUED.inc(pool=self.metrics_name)
+        now = time.monotonic()
+        if now - self._last_warning > 10:
+            type(self)._last_warning = now
+            logger.warning(
+                "DB pool '%s' exhausted (%d checked out, size=%d, max_overflow=%d); requests are queueing for a connection",
+                self.metrics_name, self.checkedout(), self.size(), self._max_overflow,
+            )
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start, pool=self.metrics_name)
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    metrics_name = "sync"
+
+
+class InstrumentedAsyncPool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    metrics_name = "async"
+
+
+def _pool_share(name: str, kind: str, budget: int, minimum: int) -> int:
+    """This engine's share of a per-worker budget: the async pool gets the larger half."""
+    override = os.getenv(f"DB_{kind.upper()}_{name}")
+    if override is not None:
+        return int(override)
+    share = (budget + 1) // 2 if kind == "async" else budget // 2
+    return max(share, minimum)
+
+
+def _pool_kwargs(url: str, kind: str) -> dict:
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": _pool_share("POOL_SIZE", kind, int(os.getenv("DB_POOL_SIZE", "5")), minimum=1),
+        "max_overflow": _pool_share("MAX_OVERFLOW", kind, int(os.getenv("DB_MAX_OVERFLOW", "10")), minimum=0),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+    }
+
+
+def _register_pool_gauges(pool, name: str) -> None:
+    if isinstance(pool, QueuePool):
+        POOL_CHECKED_OUT.set_function(pool.checkedout, pool=name)
+        POOL_OVERFLOW.set_function(lambda: max(pool.overflow(), 0), pool=name)
+        POOL_SIZE.set_function(pool.size, pool=name)
+
+
+_sync_pool_kwargs = _pool_kwargs(SQLALCHEMY_DATABASE_URL, "sync")
+if _sync_pool_kwargs:
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedQueuePool, **_sync_pool_kwargs)
+else:
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+_register_pool_gauges(engine.pool, "sync")
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
+# --- Async engine (used by the chat endpoints) ---
+
+def _async_database_url(url: str):
+    """Maps the sync DATABASE_URL to its async driver: asyncpg for Postgres, aiosqlite for SQLite."""
+    sa_url = make_url(url)
+    connect_args = {}
+    backend = sa_url.get_backend_name()
+    if backend == "postgresql":
+        # asyncpg takes `ssl` instead of libpq's `sslmode`
+        sslmode = sa_url.query.get("sslmode")
+        if sslmode:
+            sa_url = sa_url.difference_update_query(["sslmode"])
+            if sslmode != "disable":
+                connect_args["ssl"] = "require"
+        # Transaction-mode poolers (e.g. Supabase/PgBouncer) do not support prepared statements
+        connect_args["statement_cache_size"] = 0
+        sa_url = sa_url.set(drivername="postgresql+asyncpg")
+    elif backend == "sqlite":
+        sa_url = sa_url.set(drivername="sqlite+aiosqlite")
+    return sa_url, connect_args
+
+_async_url, _async_connect_args = _async_database_url(SQLALCHEMY_DATABASE_URL)
+_async_pool_kwargs = _pool_kwargs(SQLALCHEMY_DATABASE_URL, "async")
+if _async_pool_kwargs:
+    async_engine = create_async_engine(_async_url, connect_args=_async_connect_args, poolclass=InstrumentedAsyncPool, **_async_pool_kwargs)
+else:
+    async_engine = create_async_engine(_async_url, connect_args=_async_connect_args)
+_register_pool_gauges(async_engine.sync_engine.pool, "async")
+
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
 # --- Define Database Models (Tables) ---
 
 class User(Base):
@@ -37,11 +162,16 @@ class User(Base):
     hashed_password = Column(String, nullable=False)
     profile_pic_url = Column(String, nullable=True) 
     is_verified = Column(Boolean, default=False, nullable=False)
-    otp_code = Column(String, nullable=True)
-    otp_expires_at = Column(DateTime, nullable=True)
+    # Never serve or store this user's chat answers in the semantic cache
+    semantic_cache_opt_out = Column(Boolean, default=False, server_default=false(), nullable=False)
 
     suggested_movies = relationship("SuggestedMovie", back_populates="owner")
 
+    __table_args__ = (
+        # Lets "username LIKE 'prefix%'" use an index under any Postgres collation
+        Index("ix_users_username_pattern", "username", postgresql_ops={"username": "varchar_pattern_ops"}).ddl_if(dialect="postgresql"),
+    )
+
 class SuggestedMovie(Base):
     __tablename__ = "suggested_movies"
 
@@ -61,6 +191,31 @@ class ChatMessage(Base):
     message = Column(Text, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
+    __table_args__ = (
+        # Serves the bounded "latest N messages of a session" history query
+        Index("ix_chat_messages_session_created", "session_id", "created_at"),
+        # Serves keyset pagination of /chat/messages
+        Index("ix_chat_messages_user_session_created", "user_id", "session_id", "created_at"),
+    )
+
+
+class ChatSessionSummary(Base):
+    """One row per chat session, maintained alongside the message inserts."""
+    __tablename__ = "chat_sessions"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    session_id = Column(String, primary_key=True)
+    title = Column(String, nullable=True)  # first user message, truncated
+    last_message_preview = Column(String, nullable=True)
+    message_count = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # Serves the newest-first session list of a user
+        Index("ix_chat_sessions_user_updated", "user_id", "updated_at"),
+    )
+
 
 def create_db_and_tables():
     """A helper function to create the database file and all defined tables."""
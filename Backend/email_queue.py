@@ -0,0 +1,308 @@
+# backend/email_queue.py
+"""Background delivery of transactional email.
+
+Request handlers call ``email_queue.enqueue(kind, **kwargs)`` and return
+immediately; a dispatcher thread hands jobs to at most EMAIL_CONCURRENCY
+sender threads. A failed send is retried with exponential backoff (plus
+jitter) up to EMAIL_MAX_ATTEMPTS times, after which the job is marked
+``failed``; a ``PermanentDeliveryError`` (e.g. an invalid recipient) fails
+the job at once. ``status(job_id)`` reports ``queued`` / ``sending`` /
+``retrying`` / ``sent`` / ``failed`` with the attempt count and last error.
+
+Jobs live in one of two backends:
+
+* ``MemoryJobBackend`` (default) keeps them in process; queued jobs are lost
+  on restart.
+* ``RedisJobBackend`` (EMAIL_QUEUE_BACKEND=redis and REDIS_URL reachable)
+  keeps ready jobs in a list and retries in a sorted set, so they survive
+  restarts and any worker can deliver them. A job that is mid-send when its
+  process dies is not retried. The message arguments, which hold OTP codes
+  and reset tokens, are kept apart from the job under a key that expires
+  after EMAIL_PAYLOAD_TTL_SECONDS and is deleted once the job is sent or
+  has failed; a job whose arguments expired fails without sending.
+"""
+import heapq
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from . import metrics
+from .email_utils import PermanentDeliveryError, get_transport, render_email
+from .redis_client import get_redis
+
+EMAIL_CONCURRENCY = int(os.getenv("EMAIL_CONCURRENCY", "4"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+EMAIL_RETRY_BASE_SECONDS = float(os.getenv("EMAIL_RETRY_BASE_SECONDS", "2"))
+EMAIL_RETRY_MAX_SECONDS = float(os.getenv("EMAIL_RETRY_MAX_SECONDS", "300"))
+EMAIL_PAYLOAD_TTL_SECONDS = int(os.getenv("EMAIL_PAYLOAD_TTL_SECONDS", "3600"))
+STATUS_TTL_SECONDS = 24 * 3600
+
+EMAILS_TOTAL = metrics.counter("email_jobs_total", "Email jobs by kind and final outcome")
+EMAIL_ATTEMPTS = metrics.counter("email_send_attempts_total", "Email send attempts by kind and result")
+EMAIL_SEND_SECONDS = metrics.histogram("email_send_seconds", "Time spent in the email transport")
+
+
+# --- Backends ---
+
+class MemoryJobBackend:
+    """Ready deque plus a heap of delayed retries, guarded by one condition."""
+
+    def __init__(self, max_statuses: int = 10000):
+        self._ready: deque = deque()
+        self._delayed: List[tuple] = []
+        self._statuses: "OrderedDict[str, dict]" = OrderedDict()
+        self.max_statuses = max_statuses
+        self._cond = threading.Condition()
+
+    def push(self, job: dict, delay: float = 0.0) -> None:
+        with self._cond:
+            if delay > 0:
+                heapq.heappush(self._delayed, (time.monotonic() + delay, job["id"], job))
+            else:
+                self._ready.append(job)
+            self._cond.notify()
+
+    def pop(self, timeout: float) -> Optional[dict]:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    self._ready.append(heapq.heappop(self._delayed)[2])
+                if self._ready:
+                    return self._ready.popleft()
+                wait = deadline - now
+                if self._delayed:
+                    wait = min(wait, self._delayed[0][0] - now)
+                if wait <= 0:
+                    return None
+                self._cond.wait(wait)
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._ready) + len(self._delayed)
+
+    def set_status(self, job_id: str, status: dict) -> None:
+        with self._cond:
+            self._statuses[job_id] = status
+            self._statuses.move_to_end(job_id)
+            while len(self._statuses) > self.max_statuses:
+                self._statuses.popitem(last=False)
+
+    def get_status(self, job_id: str) -> Optional[dict]:
+        with self._cond:
+            status = self._statuses.get(job_id)
+            return dict(status) if status else None
+
+    def discard(self, job_id: str) -> None:
+        pass  # the arguments go away with the job
+
+
+class RedisJobBackend:
+    """Durable queue: a ready list, a delayed sorted set and per-job status hashes."""
+
+    READY_KEY = "email:queue"
+    DELAYED_KEY = "email:delayed"
+
+    def __init__(self, client, payload_ttl: int = EMAIL_PAYLOAD_TTL_SECONDS):
+        self.client = client
+        self.payload_ttl = payload_ttl
+
+    def _payload_key(self, job_id: str) -> str:
+        return f"email:payload:{job_id}"
+
+    def push(self, job: dict, delay: float = 0.0) -> None:
+        if job.get("kwargs") is not None:
+            # NX: a retry must not extend how long the secrets are kept
+            self.client.set(self._payload_key(job["id"]), json.dumps(job["kwargs"]), ex=self.payload_ttl, nx=True)
+        payload = json.dumps({k: v for k, v in job.items() if k != "kwargs"})
+        if delay > 0:
+            self.client.zadd(self.DELAYED_KEY, {payload: time.time() + delay})
+        else:
+            self.client.lpush(self.READY_KEY, payload)
+
+    def _promote_due(self) -> None:
+        # ZREM decides which worker owns a due job, so each one is promoted once
+        for payload in self.client.zrangebyscore(self.DELAYED_KEY, "-inf", time.time(), start=0, num=100):
+            if self.client.zrem(self.DELAYED_KEY, payload):
+                self.client.lpush(self.READY_KEY, payload)
+
+    def pop(self, timeout: float) -> Optional[dict]:
+        self._promote_due()
+        item = self.client.brpop(self.READY_KEY, timeout=max(1, int(timeout)))
+        if not item:
+            return None
+        job = json.loads(item[1])
+        kwargs = self.client.get(self._payload_key(job["id"]))
+        job["kwargs"] = json.loads(kwargs) if kwargs is not None else None
+        return job
+
+    def pending(self) -> int:
+        return self.client.llen(self.READY_KEY) + self.client.zcard(self.DELAYED_KEY)
+
+    def set_status(self, job_id: str, status: dict) -> None:
+        key = f"email:status:{job_id}"
+        pipe = self.client.pipeline()
+        pipe.hset(key, mapping={k: "" if v is None else v for k, v in status.items()})
+        pipe.expire(key, STATUS_TTL_SECONDS)
+        pipe.execute()
+
+    def get_status(self, job_id: str) -> Optional[dict]:
+        status = self.client.hgetall(f"email:status:{job_id}")
+        if not status:
+            return None
+        status["attempts"] = int(status.get("attempts") or 0)
+        status["last_error"] = status.get("last_error") or None
+        return status
+
+    def discard(self, job_id: str) -> None:
+        self.client.delete(self._payload_key(job_id))
+
+
+# --- Queue ---
+
+class EmailQueue:
+    def __init__(self, backend, transport, concurrency: int = EMAIL_CONCURRENCY,
+                 max_attempts: int = EMAIL_MAX_ATTEMPTS, retry_base: float = EMAIL_RETRY_BASE_SECONDS,
+                 retry_max: float = EMAIL_RETRY_MAX_SECONDS):
+        self.backend = backend
+        self.transport = transport
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._stop = threading.Event()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._dispatcher: Optional[threading.Thread] = None
+        metrics.gauge("email_queue_pending", "Email jobs waiting to be sent", fn=self._safe_pending)
+
+    def enqueue(self, kind: str, **kwargs) -> str:
+        """Queues one email and returns its job id. Never blocks on the transport."""
+        job = {"id": uuid.uuid4().hex, "kind": kind, "kwargs": kwargs, "attempts": 0}
+        self._record(job, "queued")
+        self.backend.push(job)
+        return job["id"]
+
+    def status(self, job_id: str) -> Optional[dict]:
+        return self.backend.get_status(job_id)
+
+    def start(self) -> None:
+        if self._dispatcher is not None:
+            return
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="email")
+        self._dispatcher = threading.Thread(target=self._dispatch, name="email-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stops taking new jobs and waits for in-flight sends to finish."""
+        if self._dispatcher is None:
+            return
+        self._stop.set()
+        self._dispatcher.join(timeout)
+        self._executor.shutdown(wait=True)
+        self._dispatcher = None
+        self._executor = None
+
+    def _dispatch(self) -> None:
+        while not self._stop.is_set():
+            # Only take a job once a sender is free, so queued jobs stay in the backend
+            if not self._slots.acquire(timeout=0.5):
+                continue
+            try:
+                job = self.backend.pop(timeout=1.0)
+            except Exception as e:
+                print(f"Email queue read failed: {e}")
+                job = None
+                self._stop.wait(1.0)
+            if job is None:
+                self._slots.release()
+                continue
+            self._executor.submit(self._deliver, job)
+
+    def _deliver(self, job: dict) -> None:
+        try:
+            if job.get("kwargs") is None:
+                print(f"Dropping {job['kind']} email {job['id']}: its arguments expired before it was sent")
+                EMAILS_TOTAL.inc(kind=job["kind"], status="failed")
+                self._record(job, "failed", PermanentDeliveryError("message arguments expired"))
+                return
+            job["attempts"] += 1
+            self._record(job, "sending")
+            started = time.perf_counter()
+            try:
+                self.transport.send(render_email(job["kind"], **job["kwargs"]))
+            except Exception as e:
+                EMAIL_SEND_SECONDS.observe(time.perf_counter() - started)
+                EMAIL_ATTEMPTS.inc(kind=job["kind"], result="error")
+                self._retry_or_fail(job, e)
+                return
+            EMAIL_SEND_SECONDS.observe(time.perf_counter() - started)
+            EMAIL_ATTEMPTS.inc(kind=job["kind"], result="ok")
+            EMAILS_TOTAL.inc(kind=job["kind"], status="sent")
+            self._record(job, "sent")
+            self._discard(job)
+        finally:
+            self._slots.release()
+
+    def _retry_or_fail(self, job: dict, error: Exception) -> None:
+        if job["attempts"] >= self.max_attempts or isinstance(error, PermanentDeliveryError):
+            print(f"Giving up on {job['kind']} email {job['id']} after {job['attempts']} attempts: {error}")
+            EMAILS_TOTAL.inc(kind=job["kind"], status="failed")
+            self._record(job, "failed", error)
+            self._discard(job)
+            return
+        delay = min(self.retry_max, self.retry_base * 2 ** (job["attempts"] - 1))
+        delay *= random.uniform(0.5, 1.0)
+        self._record(job, "retrying", error)
+        try:
+            self.backend.push(job, delay=delay)
+        except Exception as e:
+            print(f"Could not requeue {job['kind']} email {job['id']}: {e}")
+            EMAILS_TOTAL.inc(kind=job["kind"], status="failed")
+            self._record(job, "failed", e)
+            self._discard(job)
+
+    def _discard(self, job: dict) -> None:
+        # Drops the stored arguments (OTP codes, reset tokens) once they are no longer needed
+        try:
+            self.backend.discard(job["id"])
+        except Exception as e:
+            print(f"Could not delete the arguments of email {job['id']}: {e}")
+
+    def _record(self, job: dict, status: str, error: Optional[Exception] = None) -> None:
+        # Status is informational; never let it break delivery
+        try:
+            self.backend.set_status(job["id"], {
+                "kind": job["kind"],
+                "status": status,
+                "attempts": job["attempts"],
+                "last_error": str(error) if error else None,
+                "updated_at": time.time(),
+            })
+        except Exception as e:
+            print(f"Email status update failed: {e}")
+
+    def _safe_pending(self) -> float:
+        return float(self.backend.pending())
+
+
+def _create_queue() -> EmailQueue:
+    backend = MemoryJobBackend()
+    if os.getenv("EMAIL_QUEUE_BACKEND", "memory").lower() == "redis":
+        client = get_redis()
+        if client is not None:
+            backend = RedisJobBackend(client)
+        else:
+            print("EMAIL_QUEUE_BACKEND=redis but Redis is unavailable; using the in-process queue.")
+    return EmailQueue(backend, get_transport())
+
+
+email_queue = _create_queue()
@@ -1,4 +1,6 @@
 import os
+import threading
+from dataclasses import dataclass
 import sib_api_v3_sdk
 from sib_api_v3_sdk.rest import ApiException
 
@@ -9,13 +11,16 @@ configuration.api_key['api-key'] = os.getenv('BREVO_API_KEY')
 api_instance = sib_api_v3_sdk.TransactionalEmailsApi(sib_api_v3_sdk.ApiClient(configuration))
 # --------------------------------
 
-def send_welcome_email(to_email: str, first_name: str, username: str, otp_code: str | None = None):
-    """Sends a welcome email to a new user using Brevo. Optionally embeds an OTP code."""
-    sender_email = os.getenv("SENDER_EMAIL")
-    if not sender_email:
-        print("Error: SENDER_EMAIL not set in .env")
-        return
+@dataclass
+class EmailMessage:
+    to_email: str
+    to_name: str | None
+    subject: str
+    html_content: str
 
+
+def render_welcome_email(to_email: str, first_name: str, username: str, otp_code: str | None = None) -> EmailMessage:
+    """Welcome email for a new user. Optionally embeds an OTP code."""
     subject = "Welcome to CineVerse AI! Verify your account"
     html_content = f"""
     <div style="font-family: sans-serif; padding: 20px; color: #333;">
@@ -25,25 +30,9 @@ def send_welcome_email(to_email: str, first_name: str, username: str, otp_code:
         <p><em>The CineVerse AI Team</em></p>
     </div>
     """
-    
-    sender = {"name": "CineVerse AI", "email": sender_email}
-    to = [{"email": to_email, "name": first_name}]
-    
-    send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
-        to=to, 
-        sender=sender, 
-        subject=subject, 
-        html_content=html_content
-    )
-
-    try:
-        api_response = api_instance.send_transac_email(send_smtp_email)
-        print(f"Welcome email sent to {to_email} via Brevo. Response: {api_response}")
-    except ApiException as e:
-        print(f"Error sending welcome email to {to_email} via Brevo: {e}")
-
-def send_otp_email(to_email: str, first_name: str, otp_code: str):
-    sender_email = os.getenv("SENDER_EMAIL")
+    return EmailMessage(to_email=to_email, to_name=first_name, subject=subject, html_content=html_content)
+
+def render_otp_email(to_email: str, first_name: str, otp_code: str) -> EmailMessage:
     subject = "Your CineVerse AI verification code"
     html_content = f"""
     <div style="font-family: sans-serif; padding: 20px; color: #333;">
@@ -53,20 +42,10 @@ def send_otp_email(to_email: str, first_name: str, otp_code: str):
         <p>This code expires in 10 minutes.</p>
     </div>
     """
-    sender = {"name": "CineVerse AI", "email": sender_email}
-    to = [{"email": to_email, "name": first_name}]
-    send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
-        to=to, sender=sender, subject=subject, html_content=html_content
-    )
-    try:
-        api_response = api_instance.send_transac_email(send_smtp_email)
-        print(f"OTP email sent to {to_email} via Brevo. Response: {api_response}")
-    except ApiException as e:
-        print(f"Error sending OTP email to {to_email} via Brevo: {e}")
-
-def send_password_reset_email(to_email: str, token: str):
-    """Sends a password reset email to a user using Brevo."""
-    sender_email = os.getenv("SENDER_EMAIL")
+    return EmailMessage(to_email=to_email, to_name=first_name, subject=subject, html_content=html_content)
+
+def render_password_reset_email(to_email: str, token: str) -> EmailMessage:
+    """Password reset email with a link to the frontend reset page."""
     frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
     reset_url = f"{frontend_url}/reset-password?token={token}"
 
@@ -83,19 +62,76 @@ def send_password_reset_email(to_email: str, token: str):
         <p><em>The CineVerse AI Team</em></p>
     </div>
     """
+    return EmailMessage(to_email=to_email, to_name=None, subject=subject, html_content=html_content)
+
+
+# Email kinds accepted by render_email / the delivery queue
+RENDERERS = {
+    "welcome": render_welcome_email,
+    "otp": render_otp_email,
+    "password_reset": render_password_reset_email,
+}
+
+def render_email(kind: str, **kwargs) -> EmailMessage:
+    return RENDERERS[kind](**kwargs)
+
+
+# --- Transports ---
+class EmailDeliveryError(Exception):
+    """Raised by a transport when a message could not be delivered."""
+
+class PermanentDeliveryError(EmailDeliveryError):
+    """A delivery failure that retrying cannot fix (bad recipient or sender, rejected request)."""
+
+class BrevoTransport:
+    """Sends through Brevo's transactional email API."""
+
+    def send(self, message: EmailMessage) -> None:
+        sender_email = os.getenv("SENDER_EMAIL")
+        if not sender_email:
+            raise PermanentDeliveryError("SENDER_EMAIL not set in .env")
+        sender = {"name": "CineVerse AI", "email": sender_email}
+        to = {"email": message.to_email}
+        if message.to_name:
+            to["name"] = message.to_name
+        send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
+            to=[to],
+            sender=sender,
+            subject=message.subject,
+            html_content=message.html_content
+        )
+        try:
+            api_response = api_instance.send_transac_email(send_smtp_email)
+        except ApiException as e:
+            # 4xx other than rate limiting means Brevo rejected this message; it will again
+            if e.status is not None and 400 <= e.status < 500 and e.status != 429:
+                raise PermanentDeliveryError(str(e)) from e
+            raise EmailDeliveryError(str(e)) from e
+        print(f"Email '{message.subject}' sent to {message.to_email} via Brevo. Response: {api_response}")
+
+class LocalTransport:
+    """Stand-in for local development and tests: keeps messages in ``outbox``.
+
+    The first ``fail_first`` sends raise EmailDeliveryError, to exercise retries.
+    """
+
+    def __init__(self, fail_first: int = 0):
+        self.outbox: list[EmailMessage] = []
+        self.fail_first = fail_first
+        self.attempts = 0
+        self._lock = threading.Lock()
+
+    def send(self, message: EmailMessage) -> None:
+        with self._lock:
+            self.attempts += 1
+            attempt = self.attempts
+        if attempt <= self.fail_first:
+            raise EmailDeliveryError(f"simulated failure {attempt} of {self.fail_first}")
+        self.outbox.append(message)
+        print(f"[local email] to={message.to_email} subject={message.subject!r}")
 
-    sender = {"name": "CineVerse AI", "email": sender_email}
-    to = [{"email": to_email}]
-    
-    send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
-        to=to, 
-        sender=sender, 
-        subject=subject, 
-        html_content=html_content
-    )
-
-    try:
-        api_response = api_instance.send_transac_email(send_smtp_email)
-        print(f"Password reset email sent to {to_email} via Brevo. Response: {api_response}")
-    except ApiException as e:
-        print(f"Error sending password reset email to {to_email} via Brevo: {e}")
\ No newline at end of file
+def get_transport():
+    """Transport selected by EMAIL_TRANSPORT ('brevo' by default, or 'local')."""
+    if os.getenv("EMAIL_TRANSPORT", "brevo").lower() == "local":
+        return LocalTransport()
+    return BrevoTransport()
@@ -0,0 +1,363 @@
+# backend/embeddings.py
+"""Embedding clients shared by the API server and the ingestion script.
+
+``CachedEmbeddings`` wraps any LangChain ``Embeddings`` with two cache tiers:
+
+* an in-memory LRU of recently used vectors, and
+* an on-disk store per model: an append-only ``vectors.f32`` file plus a
+  memory-mapped hash table ``table.bin`` of ``(sha256 digest, row)`` slots,
+  so the index is never loaded into a worker's heap.
+
+Keys are ``sha256(model_name + "\\0" + text)`` and each model gets its own
+directory, so switching models never serves stale vectors. Several processes
+may share one cache directory; appends are serialized with a file lock.
+The API server embeds queries into its own directory (QUERY_EMBEDDING_CACHE_DIR)
+rather than the one ingestion fills with the whole catalogue.
+
+``CoalescingEmbeddings`` sits in front of that on the API server and merges
+concurrent ``aembed_query`` calls into one batched request.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from huggingface_hub import InferenceClient
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_DIR = os.path.join(BACKEND_DIR, ".embedding_cache")
+DEFAULT_QUERY_CACHE_DIR = os.path.join(BACKEND_DIR, ".query_embedding_cache")
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+_INDEX_RECORD = np.dtype([("digest", np.uint8, 32), ("row", "<i8")])
+_MIN_SLOTS = 1024
+
+
+# --- Custom Hugging Face Embeddings Class (using huggingface_hub) ---
+class CustomHuggingFaceHubEmbeddings(Embeddings):
+    def __init__(self, api_key: str, model_name: str):
+        self.client = InferenceClient(token=api_key)
+        self.model_name = model_name
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        response = self.client.feature_extraction(
+            texts,
+            model=self.model_name
+        )
+        # The API now returns a list of floats directly, ensure it's a list
+        if isinstance(response, list) and all(isinstance(r, list) for r in response):
+            return response
+        # Handle older versions or unexpected formats by converting
+        return response.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0]
+
+
+# --- Disk tier ---
+def _pow2_at_least(n: int) -> int:
+    return 1 << max(0, int(n) - 1).bit_length()
+
+
+class _DiskCache:
+    """Append-only vector file with an on-disk digest -> row hash table, one per model.
+
+    ``table.bin`` is an open-addressing table (linear probing, slot from the
+    first 8 digest bytes) that is memory mapped rather than loaded, so a
+    process only pages in the slots it probes. A slot holds the digest and
+    its row + 1; zero marks a free slot. Writers fill slots in place and,
+    past half full, rewrite the table at twice the size and swap it in.
+    """
+
+    def __init__(self, root: str, model_name: str):
+        self.path = os.path.join(root, hashlib.sha256(model_name.encode("utf-8")).hexdigest()[:16])
+        os.makedirs(self.path, exist_ok=True)
+        self.model_name = model_name
+        self.dim: Optional[int] = None
+        self._table = None
+        self._table_id = None  # (inode, size) of the mapped table.bin
+        self._vectors = None
+        self._refresh()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _read_meta(self) -> None:
+        if self.dim is not None:
+            return
+        try:
+            with open(self._file("meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return  # not written yet
+        if meta.get("model") == self.model_name:
+            self.dim = meta["dim"]
+
+    def _refresh(self) -> None:
+        """Maps the table and vectors again if another process has grown or replaced them."""
+        self._read_meta()
+        if self.dim is None:
+            return
+        try:
+            stat = os.stat(self._file("table.bin"))
+        except FileNotFoundError:
+            return
+        if (stat.st_ino, stat.st_size) != self._table_id:
+            self._table = np.memmap(self._file("table.bin"), dtype=_INDEX_RECORD, mode="r") if stat.st_size else None
+            self._table_id = (stat.st_ino, stat.st_size)
+        rows = os.path.getsize(self._file("vectors.f32")) // (4 * self.dim)
+        if self._vectors is None or self._vectors.shape[0] != rows:
+            self._vectors = np.memmap(self._file("vectors.f32"), dtype=np.float32, mode="r", shape=(rows, self.dim)) if rows else None
+
+    @staticmethod
+    def _probe(table: np.ndarray, digest: bytes) -> tuple:
+        """``(slot, row + 1)`` of ``digest``, or ``(free slot, 0)`` when it is not in ``table``."""
+        key = np.frombuffer(digest, dtype=np.uint8)
+        mask = table.shape[0] - 1
+        slot = int.from_bytes(digest[:8], "little") & mask
+        while True:
+            stored = int(table["row"][slot])
+            if stored == 0 or np.array_equal(table["digest"][slot], key):
+                return slot, stored
+            slot = (slot + 1) & mask
+
+    def get(self, digest: bytes) -> Optional[List[float]]:
+        for attempt in range(2):
+            if self._table is not None:
+                _, stored = self._probe(self._table, digest)
+                if stored and self._vectors is not None and stored <= self._vectors.shape[0]:
+                    return self._vectors[stored - 1].tolist()
+            if attempt == 0:
+                # Possibly written (or the table replaced) by another process since we mapped it
+                self._refresh()
+        return None
+
+    def put(self, digests: List[bytes], vectors: List[List[float]]) -> None:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        with open(self._file("vectors.f32"), "ab") as vec_f:
+            if fcntl is not None:
+                fcntl.flock(vec_f.fileno(), fcntl.LOCK_EX)
+            try:
+                self._read_meta()
+                if self.dim is None:
+                    self.dim = matrix.shape[1]
+                    with open(self._file("meta.json.tmp"), "w") as f:
+                        json.dump({"model": self.model_name, "dim": self.dim}, f)
+                    os.replace(self._file("meta.json.tmp"), self._file("meta.json"))
+                first_row = vec_f.seek(0, os.SEEK_END) // (4 * self.dim)
+                # Vectors first, so a slot never points past the end of the file
+                vec_f.write(matrix.tobytes())
+                vec_f.flush()
+                self._insert(digests, first_row)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(vec_f.fileno(), fcntl.LOCK_UN)
+
+    def _insert(self, digests: List[bytes], first_row: int) -> None:
+        """Adds slots for rows ``first_row``.. (caller holds the lock)."""
+        table_path = self._file("table.bin")
+        slots = os.path.getsize(table_path) // _INDEX_RECORD.itemsize if os.path.exists(table_path) else 0
+        if first_row + len(digests) > slots // 2:
+            self._grow(_pow2_at_least(max(_MIN_SLOTS, 4 * (first_row + len(digests)))))
+        table = np.memmap(table_path, dtype=_INDEX_RECORD, mode="r+")
+        for i, digest in enumerate(digests):
+            slot, _ = self._probe(table, digest)
+            # Row before digest: a reader that sees the digest also sees where it points
+            table["row"][slot] = first_row + i + 1
+            table["digest"][slot] = np.frombuffer(digest, dtype=np.uint8)
+        table.flush()
+        del table
+
+    def _existing(self) -> tuple:
+        """``(digests, row + 1)`` of every entry in the current table (or a pre-table ``index.bin`` log)."""
+        table_path, log_path = self._file("table.bin"), self._file("index.bin")
+        if os.path.exists(table_path) and os.path.getsize(table_path):
+            table = np.fromfile(table_path, dtype=_INDEX_RECORD)
+            table = table[table["row"] > 0]
+            return table["digest"], table["row"]
+        if os.path.exists(log_path):
+            size = os.path.getsize(log_path)
+            log = np.fromfile(log_path, dtype=_INDEX_RECORD, count=size // _INDEX_RECORD.itemsize)
+            return log["digest"], log["row"] + 1
+        return np.empty((0, 32), dtype=np.uint8), np.empty(0, dtype=np.int64)
+
+    def _grow(self, slots: int) -> None:
+        """Rewrites the table with ``slots`` slots and swaps it in atomically (caller holds the lock)."""
+        digests, rows = self._existing()
+        table = np.zeros(slots, dtype=_INDEX_RECORD)
+        mask = slots - 1
+        # Vectorized linear probing: each round, every pending entry claims its
+        # current slot if free; of several claimants one wins, the rest move on
+        pos = digests[:, :8].copy().view("<u8").ravel() & np.uint64(mask) if len(rows) else np.empty(0, np.uint64)
+        pending = np.arange(len(rows))
+        while pending.size:
+            slot = pos[pending].astype(np.int64)
+            free = table["row"][slot] == 0
+            claimed, first = np.unique(slot[free], return_index=True)
+            winners = pending[free][first]
+            table["digest"][claimed] = digests[winners]
+            table["row"][claimed] = rows[winners]
+            placed = np.zeros(len(rows), dtype=bool)
+            placed[winners] = True
+            pending = pending[~placed[pending]]
+            pos[pending] = (pos[pending] + np.uint64(1)) & np.uint64(mask)
+        tmp_path = self._file("table.bin.tmp")
+        table.tofile(tmp_path)
+        os.replace(tmp_path, self._file("table.bin"))
+        if os.path.exists(self._file("index.bin")):
+            os.remove(self._file("index.bin"))
+
+
+# --- Cached wrapper ---
+class CachedEmbeddings(Embeddings):
+    """Serves repeated texts from memory or disk and only embeds the misses.
+
+    Assumes the wrapped model embeds queries and documents the same way, which
+    holds for the sentence-transformers models used here.
+    """
+
+    def __init__(self, inner: Embeddings, model_name: str, cache_dir: Optional[str] = DEFAULT_CACHE_DIR, memory_size: int = 10000):
+        self.inner = inner
+        self.model_name = model_name
+        self.memory_size = memory_size
+        self._memory: "OrderedDict[bytes, List[float]]" = OrderedDict()
+        self._disk = _DiskCache(cache_dir, model_name) if cache_dir else None
+        self._lock = threading.Lock()
+
+    def _key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).digest()
+
+    def _remember(self, key: bytes, vector: List[float]) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, key: bytes) -> Optional[List[float]]:
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+            return vector
+        if self._disk is not None:
+            vector = self._disk.get(key)
+            if vector is not None:
+                self._remember(key, vector)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t) for t in texts]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        missing: Dict[bytes, str] = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                results[i] = self._lookup(key)
+                if results[i] is None:
+                    missing[key] = texts[i]
+        if missing:
+            vectors = self.inner.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            with self._lock:
+                for key, vector in fresh.items():
+                    self._remember(key, vector)
+                if self._disk is not None:
+                    self._disk.put(list(fresh.keys()), vectors)
+            for i, key in enumerate(keys):
+                if results[i] is None:
+                    results[i] = fresh[key]
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+# --- Async micro-batching ---
+class CoalescingEmbeddings(Embeddings):
+    """Batches concurrent ``aembed_query`` calls into one ``embed_documents`` call.
+
+    Queries are held for at most ``max_wait_ms`` or until ``max_batch`` texts are
+    waiting, then embedded together in a worker thread so the event loop never
+    blocks on the HTTP request. Each caller gets its own vector back. The
+    pending batch belongs to the running loop (one per uvicorn worker).
+    """
+
+    def __init__(self, inner: Embeddings, max_batch: int = 32, max_wait_ms: float = 5.0):
+        self.inner = inner
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.inner.embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.inner.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # Keep a reference so the task is not garbage collected mid-flight
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[tuple]) -> None:
+        try:
+            vectors = await asyncio.to_thread(self.inner.embed_documents, [text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+
+def build_embeddings(model_name: str = EMBEDDING_MODEL, cache_env: str = "EMBEDDING_CACHE_DIR",
+                     default_cache_dir: str = DEFAULT_CACHE_DIR) -> Embeddings:
+    """Creates the HF Inference client wrapped in the embedding cache.
+
+    The ``cache_env`` variable moves the disk tier (set it empty to disable
+    it) and EMBEDDING_CACHE_SIZE bounds the in-memory LRU.
+    """
+    client = CustomHuggingFaceHubEmbeddings(
+        api_key=os.getenv("HUGGINGFACEHUB_API_TOKEN"),
+        model_name=model_name,
+    )
+    return CachedEmbeddings(
+        client,
+        model_name=model_name,
+        cache_dir=os.getenv(cache_env, default_cache_dir) or None,
+        memory_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+    )
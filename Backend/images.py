@@ -0,0 +1,172 @@
+# backend/images.py
+"""Content-addressed profile images with precomputed thumbnails.
+
+An upload is stored once under the SHA-256 of its bytes
+(``img/ab/<digest>.<ext>``), so the same picture uploaded again (by anyone)
+reuses the stored copy. Square WebP variants of IMAGE_VARIANT_SIZES pixels
+(``img/ab/<digest>_<size>.webp``) are rendered in a process pool, off the
+request path. Until the PROFILE_PIC_SIZE variant exists, ``profile_pic_url``
+points at the original; ``ingest`` hands back a future that resolves once
+that variant is stored, and the caller then switches the URL over. The pool
+uses ``spawn`` workers: forking the multithreaded server process could copy
+a lock some other thread holds.
+
+Keys never change content, so ``ImageFiles`` serves them with a one-year
+immutable Cache-Control and a content-derived ETag (S3 objects get the same
+Cache-Control at upload). Until a background variant has been rendered, the
+local backend serves the original in its place without long-term caching;
+on S3 that variant URL returns 404 for that short window.
+"""
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from glob import glob
+from typing import Dict, Optional, Sequence, Tuple
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+
+from .uploads import IMMUTABLE_CACHE_CONTROL, CheckedUpload, iter_file
+
+IMAGE_VARIANT_SIZES = (64, 128, 256)
+PROFILE_PIC_SIZE = int(os.getenv("PROFILE_PIC_SIZE", "256"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+_CONTENT_PATH = re.compile(r"^img/[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})(?:_(?P<size>\d+))?\.[a-z]+$")
+
+
+def image_key(digest: str, extension: str) -> str:
+    return f"img/{digest[:2]}/{digest}.{extension}"
+
+
+def variant_key(digest: str, size: int) -> str:
+    return f"img/{digest[:2]}/{digest}_{size}.webp"
+
+
+def render_variants(src_path: str, sizes: Sequence[int]) -> Dict[int, bytes]:
+    """Square, centre-cropped WebP thumbnails. Runs in a worker process."""
+    from PIL import Image, ImageOps
+
+    variants = {}
+    with Image.open(src_path) as im:
+        im = ImageOps.exif_transpose(im)
+        has_alpha = im.mode in ("RGBA", "LA", "PA") or (im.mode == "P" and "transparency" in im.info)
+        im = im.convert("RGBA" if has_alpha else "RGB")
+        for size in sizes:
+            thumb = ImageOps.fit(im, (size, size), method=Image.LANCZOS)
+            buf = io.BytesIO()
+            thumb.save(buf, format="WEBP", quality=82, method=4)
+            variants[size] = buf.getvalue()
+    return variants
+
+
+class ImageStore:
+    def __init__(self, storage, sizes: Sequence[int] = IMAGE_VARIANT_SIZES, workers: int = IMAGE_WORKERS):
+        self.storage = storage
+        self.sizes = tuple(sizes)
+        self.workers = workers
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self._io = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-store")
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(max_workers=self.workers,
+                                                      mp_context=multiprocessing.get_context("spawn"))
+            return self._processes
+
+    def ingest(self, upload: CheckedUpload, size: int = PROFILE_PIC_SIZE) -> Tuple[str, Optional[Future]]:
+        """Stores the upload (once per content); returns ``(url, variant_ready)``.
+
+        ``url`` is the ``size`` variant if it already exists, otherwise the
+        original. In that case ``variant_ready`` is a future that resolves to
+        the variant's URL once it is stored (None if it could not be
+        rendered); its callbacks run on a worker thread.
+        """
+        fd, tmp_path = tempfile.mkstemp(prefix="upload-")
+        try:
+            hasher = hashlib.sha256()
+            with os.fdopen(fd, "wb") as f:
+                for chunk in upload.chunks():
+                    hasher.update(chunk)
+                    f.write(chunk)
+            digest = hasher.hexdigest()
+            key = image_key(digest, upload.extension)
+            if not self.storage.exists(key):
+                self.storage.put(key, iter_file(tmp_path), upload.content_type)
+            missing = [s for s in dict.fromkeys((size, *self.sizes)) if not self.storage.exists(variant_key(digest, s))]
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        if not missing:
+            os.remove(tmp_path)
+            return self.storage.url(variant_key(digest, size)), None
+        variant_ready = Future() if size in missing else None
+        # The temp file now belongs to the background job
+        future = self._pool().submit(render_variants, tmp_path, missing)
+        future.add_done_callback(lambda f: self._io.submit(self._store_variants, f, digest, tmp_path, size, variant_ready))
+        if variant_ready is None:
+            return self.storage.url(variant_key(digest, size)), None
+        return self.storage.url(key), variant_ready
+
+    def _store_variants(self, future: Future, digest: str, tmp_path: str, size: int,
+                        variant_ready: Optional[Future]) -> None:
+        url = None
+        try:
+            for variant_size, data in future.result().items():
+                self.storage.put(variant_key(digest, variant_size), [data], "image/webp")
+            url = self.storage.url(variant_key(digest, size))
+        except Exception as e:
+            print(f"Could not create thumbnails for image {digest}: {e}")
+        finally:
+            os.remove(tmp_path)
+            if variant_ready is not None:
+                variant_ready.set_result(url)
+
+    def shutdown(self) -> None:
+        if self._processes is not None:
+            self._processes.shutdown(wait=True)
+        self._io.shutdown(wait=True)
+
+
+class ImageFiles(StaticFiles):
+    """StaticFiles with immutable caching for content-addressed images."""
+
+    async def get_response(self, path: str, scope) -> Response:
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as e:
+            match = _CONTENT_PATH.match(path.replace(os.sep, "/"))
+            original = self._original_for(match) if match is not None and e.status_code == 404 else None
+            if original is None:
+                raise
+            # Variant not rendered yet: serve the original, but do not let it be cached
+            return FileResponse(original, headers={"Cache-Control": "no-cache"})
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        # Called once the path has resolved to an existing file
+        relative = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+        if _CONTENT_PATH.match(relative) is None:
+            return super().file_response(full_path, stat_result, scope, status_code)
+        headers = {"ETag": f'"{os.path.basename(relative)}"', "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+        # Exact match against each If-None-Match entry (or "*")
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def _original_for(self, match: re.Match) -> Optional[str]:
+        if match.group("size") is None:
+            return None
+        digest = match.group("digest")
+        candidates = glob(os.path.join(self.directory, "img", digest[:2], f"{digest}.*"))
+        return candidates[0] if candidates else None
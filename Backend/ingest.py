@@ -0,0 +1,404 @@
+# backend/ingest.py
+"""Pipelined, resumable ingestion of movie documents into a vector store.
+
+Batches flow through two stages connected by bounded queues::
+
+    producer -> [embed queue] -> embed workers -> [upsert queue] -> upsert workers
+
+Embed workers call the embedding provider through a shared token bucket, so
+adding workers never exceeds INGEST_EMBED_RATE requests per second. Upsert
+workers write to the sink (Pinecone, or the local numpy index through a
+single writer). The bounded queues keep at most a few batches in memory and
+make a slow stage throttle the one before it.
+
+Every batch written by the sink is recorded in a checkpoint file. A re-run
+over the same input skips those batches, so a crash loses at most the batches
+that were in flight. Pinecone upserts use the movie id as the vector id,
+which makes replaying a batch harmless; the local index is truncated back to
+its last checkpointed size before appending.
+
+Sinks also take deletes, and with ``append=True`` the local sink updates an
+existing index in place (see reindex.py): a replaced movie's old row is
+marked deleted and the new one appended. Without it, a fresh (not resumed)
+run starts from an empty local directory.
+
+The Pinecone namespace is served while it is rebuilt, so it is never
+cleared: a full rebuild overwrites every movie under its id and only then
+``prune``s the ids that are not in the catalogue. That also migrates
+namespaces written by the old loader, which stored vectors under random
+UUIDs: the first run of this pipeline has no manifest, so it is a full
+rebuild, and its prune deletes the UUIDs once every movie exists under its
+id. Until then retrieval may return a movie twice, but never nothing.
+"""
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from typing import Callable, Iterable, List, Optional
+
+from huggingface_hub.errors import HfHubHTTPError
+from langchain_core.documents import Document
+
+from . import metrics
+from .vector_store import FlatIndexWriter, live_row_ids
+
+INGEST_DOCUMENTS = metrics.counter("ingest_documents_total", "Documents processed by ingestion stage")
+INGEST_BATCH_SECONDS = metrics.histogram("ingest_batch_seconds", "Time per batch by ingestion stage",
+                                         buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+
+_STOP = object()
+
+
+# --- Retries and rate limiting ---
+
+def is_transient_hf_error(e: Exception) -> bool:
+    """Server errors and rate limiting from the Hugging Face Inference API."""
+    if isinstance(e, HfHubHTTPError) and e.response is not None:
+        return e.response.status_code >= 500 or e.response.status_code == 429
+    return False
+
+
+def with_retries(fn: Callable, should_retry: Callable[[Exception], bool] = is_transient_hf_error,
+                 max_retries: int = 8, base_delay: float = 2.0, label: str = "request"):
+    """Calls ``fn`` and retries transient failures with exponential backoff."""
+    for attempt in range(max_retries):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_retries - 1 or not should_retry(e):
+                raise
+            wait_time = min(60.0, base_delay * 2 ** attempt)
+            print(f"  > {label} failed ({e}). Retrying in {wait_time:.0f}s ({attempt + 2}/{max_retries})...")
+            time.sleep(wait_time)
+
+
+class TokenBucket:
+    """Allows ``rate`` acquisitions per second with bursts of up to ``burst``."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# --- Checkpoint ---
+
+class Checkpoint:
+    """Committed batch numbers (plus sink state) for one input, saved atomically as JSON."""
+
+    def __init__(self, path: str, fingerprint: str):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.done: set = set()
+        self.state: dict = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get("fingerprint") == fingerprint:
+                self.done = set(saved.get("done", []))
+                self.state = saved.get("state", {})
+            else:
+                print(f"Ignoring checkpoint at {path}: it was written for a different input.")
+
+    @property
+    def resuming(self) -> bool:
+        return bool(self.done)
+
+    def commit(self, batch_no: int, state: Optional[dict] = None) -> None:
+        with self._lock:
+            self.done.add(batch_no)
+            if state is not None:
+                self.state = state
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"fingerprint": self.fingerprint, "done": sorted(self.done), "state": self.state}, f)
+            os.replace(tmp_path, self.path)
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def file_fingerprint(path: str, *parts) -> str:
+    """Identifies an input file (by size and mtime) plus the settings that split it into batches."""
+    stat = os.stat(path)
+    key = json.dumps([os.path.abspath(path), stat.st_size, stat.st_mtime_ns] + [str(p) for p in parts])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+# --- Progress ---
+
+class ProgressReporter:
+    """Prints documents embedded/written, throughput and ETA every ``interval`` seconds."""
+
+    def __init__(self, total_docs: int, already_done: int = 0, interval: float = 10.0):
+        self.total = total_docs
+        self.already_done = already_done
+        self.interval = interval
+        self.embedded = 0
+        self.written = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="ingest-progress", daemon=True)
+
+    def start(self) -> None:
+        self._started = time.monotonic()
+        self._thread.start()
+
+    def skip(self, docs: int) -> None:
+        """Counts documents from batches a previous run already wrote."""
+        with self._lock:
+            self.already_done += docs
+
+    def record(self, stage: str, docs: int, seconds: float) -> None:
+        INGEST_DOCUMENTS.inc(docs, stage=stage)
+        INGEST_BATCH_SECONDS.observe(seconds, stage=stage)
+        with self._lock:
+            if stage == "embed":
+                self.embedded += docs
+            else:
+                self.written += docs
+
+    def line(self) -> str:
+        elapsed = max(time.monotonic() - self._started, 1e-6)
+        rate = self.written / elapsed
+        done = self.already_done + self.written
+        remaining = self.total - done
+        eta = f"{remaining / rate / 60:.1f} min" if rate > 0 else "?"
+        return (f"[ingest] {done}/{self.total} written ({100 * done / max(self.total, 1):.1f}%), "
+                f"{self.embedded} embedded this run, {rate:.1f} docs/s, ETA {eta}")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            print(self.line())
+
+    def stop(self) -> None:
+        self._stop.set()
+        print(self.line())
+
+
+# --- Sinks ---
+
+class LocalIndexSink:
+    """Appends to a FlatIndexWriter index. Single writer, so use one upsert worker."""
+
+    max_workers = 1
+
+    def __init__(self, path: str, checkpoint: Checkpoint, append: bool = False):
+        self.path = path
+        self.checkpoint = checkpoint
+        self._writer: Optional[FlatIndexWriter] = None
+        if checkpoint.resuming and checkpoint.state.get("sizes"):
+            FlatIndexWriter.truncate(path, checkpoint.state["sizes"])
+        elif not append:
+            # Fresh full run: start from an empty directory
+            os.makedirs(path, exist_ok=True)
+            for name in os.listdir(path):
+                os.remove(os.path.join(path, name))
+        # Rows of documents already in the index, to tombstone when they are replaced
+        self._rows = live_row_ids(path) if append else {}
+
+    def upsert(self, documents: List[Document], vectors: List[List[float]]) -> dict:
+        if self._writer is None:
+            self._writer = FlatIndexWriter(self.path, dim=len(vectors[0]))
+        ids = [doc.metadata["id"] for doc in documents]
+        replaced = [self._rows[doc_id] for doc_id in ids if doc_id in self._rows]
+        if replaced:
+            self._writer.delete_rows(replaced)
+        first_row = self._writer.count
+        self._writer.add(vectors, documents, ids=ids)
+        self._rows.update((doc_id, first_row + i) for i, doc_id in enumerate(ids))
+        return {"sizes": self._writer.sync()}
+
+    def delete(self, ids: List[str]) -> None:
+        rows = [self._rows.pop(doc_id) for doc_id in ids if doc_id in self._rows]
+        if not rows:
+            return
+        if self._writer is None:
+            self._writer = FlatIndexWriter(self.path)
+        self._writer.delete_rows(rows)
+        self._writer.sync()
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+
+class PineconeSink:
+    """Upserts precomputed vectors; ids are movie ids, so replays overwrite instead of duplicating."""
+
+    max_workers = None
+
+    def __init__(self, index_name: str, namespace: str, text_key: str = "text"):
+        from pinecone import Pinecone
+        self.index = Pinecone(api_key=os.getenv("PINECONE_API_KEY")).Index(index_name)
+        self.namespace = namespace
+        self.text_key = text_key  # where PineconeVectorStore looks for the page content
+
+    def upsert(self, documents: List[Document], vectors: List[List[float]]) -> None:
+        self.index.upsert(
+            vectors=[
+                {"id": doc.metadata["id"], "values": vector, "metadata": {**doc.metadata, self.text_key: doc.page_content}}
+                for doc, vector in zip(documents, vectors)
+            ],
+            namespace=self.namespace,
+        )
+
+    def delete(self, ids: List[str], chunk_size: int = 1000) -> None:
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            with_retries(lambda: self.index.delete(ids=chunk, namespace=self.namespace),
+                         should_retry=lambda e: not isinstance(e, (ValueError, TypeError)),
+                         max_retries=5, label="Deleting vectors")
+
+    def prune(self, keep: Iterable[str]) -> int:
+        """Deletes every vector whose id is not in ``keep``; returns how many were deleted."""
+        keep = set(keep)
+        stale = []
+        try:
+            for page in self.index.list(namespace=self.namespace):
+                stale.extend(vector_id for vector_id in page if vector_id not in keep)
+        except Exception as e:
+            # Listing ids is only supported on serverless indexes
+            print(f"Could not list vector ids in namespace '{self.namespace}' ({e}); stale vectors were not pruned.")
+            return 0
+        self.delete(stale)
+        return len(stale)
+
+    def close(self) -> None:
+        pass
+
+
+# --- Pipeline ---
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.2)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while True:
+        try:
+            return q.get(timeout=0.2)
+        except queue.Empty:
+            if stop.is_set():
+                return _STOP
+
+
+def run_pipeline(batches: Iterable[List[Document]], total_docs: int, embeddings, sink, checkpoint: Checkpoint, *,
+                 embed_workers: int = 4, upsert_workers: int = 2, queue_size: int = 8,
+                 embed_rate: float = 5.0, progress_interval: float = 10.0) -> None:
+    """Embeds and writes every batch not yet in ``checkpoint``; raises the first worker error."""
+    if sink.max_workers is not None:
+        upsert_workers = min(upsert_workers, sink.max_workers)
+    limiter = TokenBucket(embed_rate, burst=embed_workers)
+    embed_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    upsert_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    embedders_left = [embed_workers]
+    counter_lock = threading.Lock()
+
+    progress = ProgressReporter(total_docs, interval=progress_interval)
+    if checkpoint.resuming:
+        print(f"Resuming: {len(checkpoint.done)} batches already written.")
+
+    def fail(e: BaseException) -> None:
+        with counter_lock:
+            errors.append(e)
+        stop.set()
+
+    def embed_worker() -> None:
+        try:
+            while True:
+                item = _get(embed_q, stop)
+                if item is _STOP:
+                    return
+                batch_no, documents = item
+                limiter.acquire()
+                started = time.monotonic()
+                vectors = with_retries(
+                    lambda: embeddings.embed_documents([doc.page_content for doc in documents]),
+                    label=f"Embedding batch {batch_no}",
+                )
+                progress.record("embed", len(documents), time.monotonic() - started)
+                if not _put(upsert_q, (batch_no, documents, vectors), stop):
+                    return
+        except BaseException as e:
+            fail(e)
+        finally:
+            with counter_lock:
+                embedders_left[0] -= 1
+                last = embedders_left[0] == 0
+            if last:
+                for _ in range(upsert_workers):
+                    _put(upsert_q, _STOP, stop)
+
+    def upsert_worker() -> None:
+        try:
+            while True:
+                item = _get(upsert_q, stop)
+                if item is _STOP:
+                    return
+                batch_no, documents, vectors = item
+                started = time.monotonic()
+                state = with_retries(
+                    lambda: sink.upsert(documents, vectors),
+                    should_retry=lambda e: not isinstance(e, (ValueError, TypeError)),
+                    max_retries=5,
+                    label=f"Writing batch {batch_no}",
+                )
+                checkpoint.commit(batch_no, state)
+                progress.record("upsert", len(documents), time.monotonic() - started)
+        except BaseException as e:
+            fail(e)
+
+    threads = [threading.Thread(target=embed_worker, name=f"embed-{i}", daemon=True) for i in range(embed_workers)]
+    threads += [threading.Thread(target=upsert_worker, name=f"upsert-{i}", daemon=True) for i in range(upsert_workers)]
+    progress.start()
+    for t in threads:
+        t.start()
+    try:
+        for batch_no, documents in enumerate(batches):
+            if batch_no in checkpoint.done:
+                progress.skip(len(documents))
+                continue
+            if not _put(embed_q, (batch_no, documents), stop):
+                break
+        for _ in range(embed_workers):
+            _put(embed_q, _STOP, stop)
+        for t in threads:
+            t.join()
+    except KeyboardInterrupt:
+        stop.set()
+        for t in threads:
+            t.join()
+        raise
+    finally:
+        progress.stop()
+        sink.close()
+    if errors:
+        raise errors[0]
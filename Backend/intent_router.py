@@ -0,0 +1,195 @@
+# backend/intent_router.py
+"""Routes chat turns around the ReAct agent when it is not needed.
+
+``classify`` is a rule-based check (no LLM call) that puts each turn in one
+of three routes:
+
+* ``small_talk`` - greetings, thanks and acknowledgements with nothing
+  about movies in them. Answered by a single LLM call with the persona and
+  the conversation so far.
+* ``recommend`` - a self-contained request for recommendations ("suggest a
+  feel-good comedy"). One retrieval from the movie index, then one LLM call
+  that picks from the retrieved movies.
+* ``agent`` - everything else: questions about recent releases, specific
+  facts or streaming links, follow-ups that refer back to earlier answers,
+  and anything ambiguous. These keep the full ReAct agent and its tools.
+
+When in doubt the rules fall through to ``agent``, so a misrouted turn costs
+a slower answer rather than a worse one. That is why "yes", "no" and mood
+statements ("I'm feeling sad tonight") are never small talk, and why any
+reply to a question or offer from the assistant goes to the agent: what
+they mean depends on what was asked.
+"""
+import re
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from . import metrics
+
+ROUTE_SMALL_TALK = "small_talk"
+ROUTE_RECOMMEND = "recommend"
+ROUTE_AGENT = "agent"
+
+SMALL_TALK_MAX_WORDS = 8
+
+CHAT_ROUTES = metrics.counter("chat_route_total", "Chat turns by route")
+CHAT_ROUTE_SECONDS = metrics.histogram("chat_route_seconds", "Time to answer a chat turn, by route",
+                                       buckets=(0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0, 30.0, 60.0))
+CHAT_LLM_CALLS = metrics.counter("chat_llm_calls_total", "LLM calls made while answering chat turns, by route")
+
+_SMALL_TALK = re.compile(
+    r"^(hi+|hello+|hey+|yo|hiya|howdy|sup|good (morning|afternoon|evening|night)|"
+    r"thanks?( you)?( so much| a lot)?|thank u|thx|ty|cheers|appreciate it|"
+    r"bye+|goodbye|see (you|ya)( later)?|later|"
+    r"cool|great|nice|awesome|perfect|lol|haha+|"
+    r"how are (you|u)( doing)?|how('?s| is) it going|what'?s up|who are you|what can you do)"
+    r"(\s+(there|cineverse|buddy|friend|again|too|man|mate))*$",
+    re.I,
+)
+_MOVIE_TERMS = re.compile(
+    r"\b(movies?|films?|watch|watching|shows?|series|cinema|recommend\w*|suggest\w*|actors?|actress|directors?|"
+    r"genres?|comed(y|ies)|horror|thriller|drama|romance|romantic|action|sci-?fi|fantasy|animated|animation|anime|"
+    r"documentar(y|ies)|mystery|crime|adventure|musical|netflix|prime|disney|hulu|imdb)\b",
+    re.I,
+)
+_RECOMMEND = re.compile(
+    r"\b(recommend\w*|suggest\w*|something (to watch|light|fun|funny|scary|sad|romantic|new)|"
+    r"what (should|can|could) (i|we) watch|(looking|searching) for (a |an |some )?(good )?(movie|film)|"
+    r"in the mood for|(i )?(feel like|want to|wanna) watch(ing)?|(movies?|films?) (like|similar to|about|with|for)|"
+    r"give me (a|some|any)|"
+    r"any good (movies?|films?)|(good|great|best) (movies?|films?) (to|for))\b",
+    re.I,
+)
+# Needs the web tool, exact facts or links: leave these to the agent
+_NEEDS_AGENT = re.compile(
+    r"\b(latest|newest|new releases?|just released|upcoming|coming soon|this (week|weekend|month|year)|"
+    r"now (playing|showing)|in theaters?|box office|trailer|20(2[4-9]|3\d)|"
+    r"who (directed|starred|plays|played|stars)|when (was|is|did)|cast of|how long is|rating of|"
+    r"where (can|do|to) (i )?(watch|stream)|streaming on|link|ott)\b",
+    re.I,
+)
+# The assistant's last sentence asks something or offers more
+_OFFER = re.compile(
+    r"\b(want|would you like|shall i|should i|do you|are you|let me know|i can|happy to|feel free)\b",
+    re.I,
+)
+# Refers back to earlier answers, so the conversation matters
+_FOLLOW_UP = re.compile(
+    r"\b(that|those|it|them|these|another|more|else|instead|other|others|the (first|second|third|last) one|"
+    r"same|similar|again|one more)\b",
+    re.I,
+)
+
+
+def _awaits_reply(chat_history: Optional[List[BaseMessage]]) -> bool:
+    """Whether the assistant's last message ended with a question or an offer."""
+    last = next((m for m in reversed(chat_history or []) if isinstance(m, AIMessage)), None)
+    if last is None or not isinstance(last.content, str):
+        return False
+    content = last.content.strip()
+    if content.endswith("?"):
+        return True
+    last_sentence = re.split(r"(?<=[.!])\s+", content)[-1]
+    return _OFFER.search(last_sentence) is not None
+
+
+def classify(message: str, chat_history: Optional[List[BaseMessage]] = None) -> str:
+    """Picks the route for one user message."""
+    text = " ".join(message.strip().split())
+    if not text:
+        return ROUTE_SMALL_TALK
+    if _MOVIE_TERMS.search(text) is None:
+        if (len(text.split()) <= SMALL_TALK_MAX_WORDS and _SMALL_TALK.match(text.rstrip("!.?~ "))
+                and not _awaits_reply(chat_history)):
+            return ROUTE_SMALL_TALK
+        return ROUTE_AGENT
+    if _NEEDS_AGENT.search(text):
+        return ROUTE_AGENT
+    if chat_history and _FOLLOW_UP.search(text):
+        return ROUTE_AGENT
+    if _RECOMMEND.search(text):
+        return ROUTE_RECOMMEND
+    return ROUTE_AGENT
+
+
+class LLMCallCounter(AsyncCallbackHandler):
+    """Counts the LLM calls made for one chat turn."""
+
+    def __init__(self, route: str):
+        self.route = route
+        self.calls = 0
+
+    async def on_chat_model_start(self, serialized, messages, **kwargs) -> None:
+        self.calls += 1
+        CHAT_LLM_CALLS.inc(route=self.route)
+
+    async def on_llm_start(self, serialized, prompts, **kwargs) -> None:
+        self.calls += 1
+        CHAT_LLM_CALLS.inc(route=self.route)
+
+
+@contextmanager
+def track_route(route: str):
+    """Records a routed turn and its duration; yields the callback that counts its LLM calls."""
+    CHAT_ROUTES.inc(route=route)
+    started = time.monotonic()
+    try:
+        yield LLMCallCounter(route)
+    finally:
+        CHAT_ROUTE_SECONDS.observe(time.monotonic() - started, route=route)
+
+
+def _format_movie(doc: Document) -> str:
+    meta = doc.metadata or {}
+    lines = [doc.page_content.strip()]
+    details = []
+    if meta.get("release_date"):
+        details.append(f"Released: {str(meta['release_date'])[:4]}")
+    if meta.get("vote_average"):
+        details.append(f"Rating: {meta['vote_average']}")
+    if meta.get("imdb_id"):
+        details.append(f"IMDb: https://www.imdb.com/title/{meta['imdb_id']}/")
+    if details:
+        lines.append(" | ".join(details))
+    return "\n".join(lines)
+
+
+class IntentRouter:
+    """Answers ``small_talk`` and ``recommend`` turns without the agent."""
+
+    def __init__(self, llm, retriever, persona: str, small_talk_llm=None):
+        self.llm = llm
+        self.small_talk_llm = small_talk_llm or llm
+        self.retriever = retriever
+        self.persona = persona.strip()
+
+    async def _messages(self, route: str, agent_input: dict, query: str, callbacks) -> List[BaseMessage]:
+        if route == ROUTE_SMALL_TALK:
+            system = (f"{self.persona}\n\nThis turn is small talk. Reply in one or two short, warm sentences "
+                      "and do not recommend specific movies unless the user asks for them.")
+        else:
+            docs = await self.retriever.ainvoke(query, config={"callbacks": callbacks})
+            movies = "\n\n".join(_format_movie(doc) for doc in docs) or "(no matches found)"
+            system = (f"{self.persona}\n\nRecommend movies for the user's request from this list, retrieved from the "
+                      "CineVerse movie database. Pick the best few matches for their request and mood, say briefly why "
+                      f"each fits, and do not invent titles that are not listed.\n\n{movies}")
+        return [SystemMessage(content=system), *agent_input["chat_history"], HumanMessage(content=agent_input["input"])]
+
+    def _llm_for(self, route: str):
+        return self.small_talk_llm if route == ROUTE_SMALL_TALK else self.llm
+
+    async def ainvoke(self, route: str, agent_input: dict, query: str, callbacks: Optional[list] = None) -> str:
+        messages = await self._messages(route, agent_input, query, callbacks)
+        response = await self._llm_for(route).ainvoke(messages, config={"callbacks": callbacks})
+        return response.content if isinstance(response.content, str) else str(response.content)
+
+    async def astream(self, route: str, agent_input: dict, query: str, callbacks: Optional[list] = None) -> AsyncIterator[str]:
+        messages = await self._messages(route, agent_input, query, callbacks)
+        async for chunk in self._llm_for(route).astream(messages, config={"callbacks": callbacks}):
+            if isinstance(chunk.content, str) and chunk.content:
+                yield chunk.content
@@ -1,6 +1,9 @@
+import asyncio
+import logging
 import os
-import boto3
 import sys
+import threading
+import time
 
 # --- THIS IS THE CRUCIAL PATHING FIX FOR DEPLOYMENT ---
 # This block makes your application's imports work reliably on any server.
@@ -10,23 +13,20 @@ sys.path.insert(0, project_root)
 # ----------------------------------------------------
 
 import uvicorn
-from fastapi import FastAPI, Depends, HTTPException, Header, Request, UploadFile, File
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Depends, HTTPException, Header, Query, Request, UploadFile, File
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
-from typing import List
-from huggingface_hub import InferenceClient
 
 # LangChain Imports
-from langchain_core.embeddings import Embeddings
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_pinecone import PineconeVectorStore
 from langchain.agents import AgentExecutor, create_react_agent
 from langchain.tools.retriever import create_retriever_tool
 from langchain.tools import Tool
-from langchain_community.document_loaders import WebBaseLoader
 from langchain_core.prompts import PromptTemplate
 from langchain_core.messages import AIMessage, HumanMessage
 
@@ -35,27 +35,23 @@ dotenv_path = os.path.join(current_dir, '.env')
 load_dotenv(dotenv_path=dotenv_path)
 
 # --- Local Imports (now absolute from the project root) ---
-from Backend import crud, schemas, security, database, email_utils
-from Backend.database import SessionLocal
-
-# --- Custom Hugging Face Embeddings Class (using huggingface_hub) ---
-class CustomHuggingFaceHubEmbeddings(Embeddings):
-    def __init__(self, api_key: str, model_name: str):
-        self.client = InferenceClient(token=api_key)
-        self.model_name = model_name
-
-    def _embed(self, texts: List[str]) -> List[List[float]]:
-        response = self.client.feature_extraction(
-            texts,
-            model=self.model_name
-        )
-        return response.tolist()
-
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        return self._embed(texts)
-
-    def embed_query(self, text: str) -> List[float]:
-        return self._embed([text])[0]
+from Backend import crud, schemas, security, database, metrics
+from Backend.embeddings import DEFAULT_QUERY_CACHE_DIR, CoalescingEmbeddings, build_embeddings
+from Backend.vector_store import load_vector_store
+from Backend.chat_stream import FinalAnswerFilter, TOOL_STATUS, sse_event
+from Backend.web_scraper import web_scraper
+from Backend.semantic_cache import SEMANTIC_CACHE_ENABLED, SemanticCache, context_bucket, record_bypass
+from Backend.intent_router import ROUTE_AGENT, ROUTE_RECOMMEND, IntentRouter, classify, track_route
+from Backend.chat_history import chat_history as history_store
+from Backend.database import SessionLocal, AsyncSessionLocal
+from Backend.email_queue import email_queue
+from Backend.bloom import registered_users
+from Backend.uploads import CheckedUpload, UploadRejected, build_storage
+from Backend.images import ImageFiles, ImageStore
+from Backend.otp_store import OTP_EXPIRED, OTP_LOCKED, OTP_VERIFIED, otp_store
+from Backend.rate_limit import RateLimiter, RateLimitExceeded, rate_limit_headers
+
+logger = logging.getLogger(__name__)
 
 # --- Create Database Tables ---
 database.Base.metadata.create_all(bind=database.engine)
@@ -73,7 +69,42 @@ app.add_middleware(
 # Static uploads dir
 UPLOAD_DIR = os.path.join(current_dir, "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+app.mount("/uploads", ImageFiles(directory=UPLOAD_DIR), name="uploads")
+image_store = ImageStore(build_storage(UPLOAD_DIR))
+
+@app.on_event("startup")
+def start_email_queue():
+    email_queue.start()
+
+@app.on_event("startup")
+def build_registration_filters():
+    # Built in the background (every check goes to the DB until it is ready), then kept up to date
+    threading.Thread(target=registered_users.run_refresh_loop, args=(SessionLocal,), name="bloom-refresh", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_email_queue():
+    email_queue.stop()
+
+@app.on_event("shutdown")
+def stop_image_workers():
+    image_store.shutdown()
+
+@app.on_event("shutdown")
+async def close_web_scraper():
+    await web_scraper.aclose()
+
+@app.exception_handler(security.PasswordPoolSaturated)
+async def password_pool_saturated_handler(request: Request, exc: security.PasswordPoolSaturated):
+    # Shed load instead of letting a login storm queue up behind bcrypt
+    return JSONResponse(status_code=503, content={"detail": "Server is busy. Please try again shortly."}, headers={"Retry-After": "1"})
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    return JSONResponse(status_code=429, content={"detail": exc.detail}, headers=rate_limit_headers(exc.result))
+
+# --- Rate limits ---
+chat_limiter = RateLimiter("chat", limit=30, period_seconds=60)
+otp_resend_limiter = RateLimiter("otp-resend", limit=5, period_seconds=3600, detail="Too many OTP requests. Please wait before trying again.")
 
 # --- Database Dependency ---
 def get_db():
@@ -83,11 +114,17 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # --- Auth dependency ---
-def get_current_user(authorization: str = Header(default="")):
+def get_bearer_token(authorization: str = Header(default="")):
     if not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
-    token = authorization.split(" ", 1)[1]
+    return authorization.split(" ", 1)[1]
+
+def get_current_user(token: str = Depends(get_bearer_token)):
     payload = security.verify_access_token(token)
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
@@ -95,43 +132,45 @@ def get_current_user(authorization: str = Header(default="")):
 
 # --- Authentication and User Endpoints ---
 
+SIGNUP_USERNAME_ATTEMPTS = 5
+
 @app.post("/signup", response_model=schemas.User)
-def signup_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def signup_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     # Basic password policy
     msg = security.validate_password_policy(user.password)
     if msg:
         raise HTTPException(status_code=400, detail=msg)
-    db_user_by_email = crud.get_user_by_email(db, email=user.email)
-    if db_user_by_email:
+    conflicts = await crud.aget_signup_conflicts(db, email=user.email, mobile_no=user.mobile_no)
+    if "email" in conflicts:
         raise HTTPException(status_code=400, detail="Email already registered")
-    
-    db_user_by_mobile = crud.get_user_by_mobile(db, mobile_no=user.mobile_no)
-    if db_user_by_mobile:
+    if "mobile_no" in conflicts:
         raise HTTPException(status_code=400, detail="Mobile number already registered")
 
-    # Unique username generator derived from email local-part
+    hashed_password = await security.hash_password_async(user.password)
+
+    # Unique username derived from the email local-part; a concurrent signup
+    # may claim the same name first, in which case the insert is retried
     base_username = user.email.split('@')[0]
-    username = base_username
-    suffix = 0
-    while crud.get_user_by_username(db, username=username):
-        suffix += 1
-        username = f"{base_username}{suffix}"
-
-    # Generate OTP
-    import random, datetime
-    otp_code = f"{random.randint(0, 999999):06d}"
-    expires = datetime.datetime.utcnow() + datetime.timedelta(minutes=10)
-    new_user = crud.create_user(db=db, user=user, override_username=username)
-    # Save OTP fields
-    new_user.otp_code = otp_code
-    new_user.otp_expires_at = expires
-    new_user.is_verified = False
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    for attempt in range(SIGNUP_USERNAME_ATTEMPTS):
+        username = await crud.anext_free_username(db, base_username)
+        try:
+            new_user = await crud.acreate_user(db=db, user=user, hashed_password=hashed_password, override_username=username)
+            break
+        except IntegrityError:
+            await db.rollback()
+            conflicts = await crud.aget_signup_conflicts(db, email=user.email, mobile_no=user.mobile_no)
+            if "email" in conflicts:
+                raise HTTPException(status_code=400, detail="Email already registered")
+            if "mobile_no" in conflicts:
+                raise HTTPException(status_code=400, detail="Mobile number already registered")
+    else:
+        raise HTTPException(status_code=409, detail="Could not allocate a username. Please try again.")
+    registered_users.add(new_user.email, new_user.mobile_no)
+    otp_code = otp_store.issue(new_user.id)
 
-    # send welcome + otp
-    email_utils.send_welcome_email(
+    # send welcome + otp in the background
+    email_queue.enqueue(
+        "welcome",
         to_email=new_user.email,
         first_name=new_user.first_name,
         username=new_user.username,
@@ -140,14 +179,14 @@ def signup_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     return new_user
 
 @app.post("/login")
-def login_user(user_login: schemas.UserLogin, db: Session = Depends(get_db)):
+async def login_user(user_login: schemas.UserLogin, db: AsyncSession = Depends(get_async_db)):
     db_user = None
     if "@" in user_login.identifier:
-        db_user = crud.get_user_by_email(db, email=user_login.identifier)
+        db_user = await crud.aget_user_by_email(db, email=user_login.identifier)
     else:
-        db_user = crud.get_user_by_username(db, username=user_login.identifier)
+        db_user = await crud.aget_user_by_username(db, username=user_login.identifier)
     
-    if not db_user or not security.verify_password(user_login.password, db_user.hashed_password):
+    if not db_user or not await security.verify_password_async(user_login.password, db_user.hashed_password):
         raise HTTPException(status_code=401, detail="Incorrect username/email or password")
     
     # Require verification
@@ -164,80 +203,80 @@ def login_user(user_login: schemas.UserLogin, db: Session = Depends(get_db)):
         "access_token": access_token,
     }
 
+@app.post("/logout")
+def logout_user(token: str = Depends(get_bearer_token), current=Depends(get_current_user)):
+    security.revoke_access_token(token)
+    return {"message": "Logged out."}
+
 @app.post("/verify-otp")
 def verify_otp(body: schemas.VerifyOtpRequest, db: Session = Depends(get_db)):
     # Allow using email or username as identifier
     user = crud.get_user_by_email(db, email=body.identifier) or crud.get_user_by_username(db, username=body.identifier)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    import datetime
-    if not user.otp_code or user.otp_code != body.otp_code:
-        raise HTTPException(status_code=400, detail="Invalid OTP code")
-    if not user.otp_expires_at or datetime.datetime.utcnow() > user.otp_expires_at:
+    result = otp_store.verify(user.id, body.otp_code)
+    if result == OTP_LOCKED:
+        raise HTTPException(status_code=429, detail="Too many incorrect attempts. Please request a new code.")
+    if result == OTP_EXPIRED:
         raise HTTPException(status_code=400, detail="OTP expired")
+    if result != OTP_VERIFIED:
+        raise HTTPException(status_code=400, detail="Invalid OTP code")
     user.is_verified = True
-    user.otp_code = None
-    user.otp_expires_at = None
     db.add(user)
     db.commit()
-    db.refresh(user)
     return {"message": "Account verified successfully."}
 
 @app.post("/resend-otp")
 def resend_otp(body: schemas.ResendOtpRequest, db: Session = Depends(get_db)):
-    # Redis-based throttle: max 5 per hour per identifier
-    from Backend import security
-    throttle_key = f"otp:resend:{body.identifier}"
-    if not security.rate_limit_ok(throttle_key, max_requests=5, window_seconds=3600):
-        raise HTTPException(status_code=429, detail="Too many OTP requests. Please wait before trying again.")
+    # Max 5 per hour per identifier
+    otp_resend_limiter.enforce(body.identifier)
     user = crud.get_user_by_email(db, email=body.identifier) or crud.get_user_by_username(db, username=body.identifier)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    import random, datetime
-    otp_code = f"{random.randint(0, 999999):06d}"
-    expires = datetime.datetime.utcnow() + datetime.timedelta(minutes=10)
-    user.otp_code = otp_code
-    user.otp_expires_at = expires
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    email_utils.send_otp_email(user.email, user.first_name, otp_code)
+    otp_code = otp_store.issue(user.id)
+    email_queue.enqueue("otp", to_email=user.email, first_name=user.first_name, otp_code=otp_code)
     return {"message": "OTP resent."}
 
 @app.post("/account/profile-pic/upload", response_model=schemas.User)
 def upload_profile_pic(file: UploadFile = File(...), db: Session = Depends(get_db), current=Depends(get_current_user)):
     user_id = int(current.get('sub'))
-    filename = f"user_{user_id}_{int(__import__('time').time())}_{file.filename}"
-    # S3 config
-    bucket = os.getenv("AWS_S3_BUCKET")
-    region = os.getenv("AWS_S3_REGION")
-    if bucket and region:
-        s3 = boto3.client(
-            "s3",
-            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-            region_name=region,
-        )
-        s3.upload_fileobj(file.file, bucket, filename, ExtraArgs={"ACL": "public-read", "ContentType": file.content_type})
-        public_url = f"https://{bucket}.s3.{region}.amazonaws.com/{filename}"
-        # Optionally: presigned = s3.generate_presigned_url(...)
-    else:
-        dest_path = os.path.join(UPLOAD_DIR, filename)
-        with open(dest_path, 'wb') as f:
-            f.write(file.file.read())
-        public_url = f"/uploads/{filename}"
-    return crud.update_profile_pic_url(db=db, user_id=user_id, url=public_url)
+    try:
+        public_url, variant_ready = image_store.ingest(CheckedUpload(file.file))
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    user = crud.update_profile_pic_url(db=db, user_id=user_id, url=public_url)
+    if variant_ready is not None:
+        # Registered after the commit above, so the swap can never run before it
+        variant_ready.add_done_callback(lambda f: _use_profile_pic_variant(user_id, public_url, f.result()))
+    return user
+
+def _use_profile_pic_variant(user_id: int, original_url: str, variant_url: str | None) -> None:
+    """Points the profile picture at its rendered thumbnail, unless the user has picked another one since."""
+    if variant_url is None:
+        return
+    try:
+        with SessionLocal() as db:
+            crud.replace_profile_pic_url(db, user_id=user_id, old_url=original_url, new_url=variant_url)
+    except Exception as e:
+        print(f"Could not switch user {user_id} to the profile picture thumbnail: {e}")
 
 @app.post("/check-email")
 def check_user_email(request: schemas.EmailCheck, db: Session = Depends(get_db)):
+    # Most typed values are new; the Bloom filter rules them out without a query
+    if not registered_users.might_contain("email", request.email):
+        return {"exists": False}
     db_user = crud.get_user_by_email(db, email=request.email)
+    registered_users.record_db_result("email", db_user is not None)
     if db_user:
         return {"exists": True}
     return {"exists": False}
 
 @app.post("/check-mobile")
 def check_user_mobile(request: schemas.MobileCheck, db: Session = Depends(get_db)):
+    if not registered_users.might_contain("mobile_no", request.mobile_no):
+        return {"exists": False}
     db_user = crud.get_user_by_mobile(db, mobile_no=request.mobile_no)
+    registered_users.record_db_result("mobile_no", db_user is not None)
     if db_user:
         return {"exists": True}
     return {"exists": False}
@@ -247,18 +286,20 @@ def forgot_password(request: schemas.ForgotPasswordRequest, db: Session = Depend
     user = crud.get_user_by_email(db, email=request.email)
     if user:
         token = security.generate_reset_token(email=user.email)
-        email_utils.send_password_reset_email(to_email=user.email, token=token)
+        email_queue.enqueue("password_reset", to_email=user.email, token=token)
     return {"message": "If an account with that email exists, a password reset link has been sent."}
 
 @app.post("/reset-password")
-def reset_password(request: schemas.ResetPasswordRequest, db: Session = Depends(get_db)):
+async def reset_password(request: schemas.ResetPasswordRequest, db: AsyncSession = Depends(get_async_db)):
     email = security.verify_reset_token(token=request.token)
     if not email:
         raise HTTPException(status_code=400, detail="Invalid or expired token")
-    user = crud.get_user_by_email(db, email=email)
+    user = await crud.aget_user_by_email(db, email=email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    crud.update_user_password(db=db, user=user, new_password=request.new_password)
+    hashed_password = await security.hash_password_async(request.new_password)
+    await crud.aupdate_user_password(db=db, user=user, hashed_password=hashed_password)
+    security.revoke_user_tokens(user.id)
     return {"message": "Password updated successfully."}
 
 @app.put("/account/username", response_model=schemas.User)
@@ -271,20 +312,24 @@ def update_user_username(request: schemas.UsernameUpdate, db: Session = Depends(
     return crud.update_username(db=db, user_id=request.user_id, new_username=request.new_username)
 
 @app.put("/account/password")
-def update_user_password_route(request: schemas.PasswordUpdate, db: Session = Depends(get_db), current=Depends(get_current_user)):
+async def update_user_password_route(request: schemas.PasswordUpdate, db: AsyncSession = Depends(get_async_db), current=Depends(get_current_user)):
     if request.user_id != int(current.get("sub")):
         raise HTTPException(status_code=403, detail="Not allowed")
     # Policy check
     msg = security.validate_password_policy(request.new_password)
     if msg:
         raise HTTPException(status_code=400, detail=msg)
-    user = crud.get_user_by_id(db, user_id=request.user_id)
+    user = await crud.aget_user_by_id(db, user_id=request.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    if not security.verify_password(request.old_password, user.hashed_password):
+    if not await security.verify_password_async(request.old_password, user.hashed_password):
         raise HTTPException(status_code=400, detail="Incorrect old password.")
-    crud.update_user_password(db=db, user=user, new_password=request.new_password)
-    return {"message": "Password updated successfully."}
+    hashed_password = await security.hash_password_async(request.new_password)
+    await crud.aupdate_user_password(db=db, user=user, hashed_password=hashed_password)
+    # Sign out other sessions; this one continues with a fresh token
+    security.revoke_user_tokens(user.id)
+    access_token = security.create_access_token(user_id=user.id, username=user.username, email=user.email)
+    return {"message": "Password updated successfully.", "access_token": access_token}
 
 @app.put("/account/profile-pic", response_model=schemas.User)
 def update_user_profile_pic(request: schemas.ProfilePicUpdate, db: Session = Depends(get_db), current=Depends(get_current_user)):
@@ -292,6 +337,12 @@ def update_user_profile_pic(request: schemas.ProfilePicUpdate, db: Session = Dep
         raise HTTPException(status_code=403, detail="Not allowed")
     return crud.update_profile_pic_url(db=db, user_id=request.user_id, url=request.url)
 
+@app.put("/account/semantic-cache", response_model=schemas.User)
+def update_semantic_cache_preference(request: schemas.SemanticCacheUpdate, db: Session = Depends(get_db), current=Depends(get_current_user)):
+    if request.user_id != int(current.get("sub")):
+        raise HTTPException(status_code=403, detail="Not allowed")
+    return crud.update_semantic_cache_opt_out(db=db, user_id=request.user_id, opt_out=request.opt_out)
+
 
 # --- LangChain Agent Setup ---
 INDEX_NAME = "cineverse-ai"
@@ -301,21 +352,21 @@ chat_histories = {}
 # Initialize Models
 llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.4)
 
-# Initialize Custom Embedding Model
-embeddings = CustomHuggingFaceHubEmbeddings(
-    api_key=os.getenv("HUGGINGFACEHUB_API_TOKEN"),
-    model_name="sentence-transformers/all-MiniLM-L6-v2"
+# Initialize Custom Embedding Model (cached in memory and on disk, see Backend/embeddings.py).
+# Queries get their own disk cache, apart from the catalogue vectors ingestion caches.
+# Concurrent /chat queries are coalesced into one batched Inference API request.
+embeddings = CoalescingEmbeddings(
+    build_embeddings(cache_env="QUERY_EMBEDDING_CACHE_DIR", default_cache_dir=DEFAULT_QUERY_CACHE_DIR),
+    max_batch=int(os.getenv("EMBED_BATCH_MAX", "32")),
+    max_wait_ms=float(os.getenv("EMBED_BATCH_WAIT_MS", "5")),
 )
 
-# Connect to the existing Pinecone index
-print(f"Connecting to Pinecone index '{INDEX_NAME}'...")
-vector_store = PineconeVectorStore.from_existing_index(
-    index_name=INDEX_NAME,
-    embedding=embeddings,
-    namespace=NAMESPACE
-)
+# Near-duplicate first questions are answered from here instead of the agent (see Backend/semantic_cache.py)
+semantic_cache = SemanticCache(embeddings)
+
+# Connect to the configured vector store (Pinecone by default, see VECTOR_STORE_BACKEND)
+vector_store = load_vector_store(embeddings, index_name=INDEX_NAME, namespace=NAMESPACE)
 retriever = vector_store.as_retriever()
-print(f"Successfully connected to Pinecone, using namespace '{NAMESPACE}'.")
 
 # Define Agent Tools
 retriever_tool = create_retriever_tool(
@@ -324,25 +375,18 @@ retriever_tool = create_retriever_tool(
     "Searches and returns information about movies from a database."
 )
 
-def scrape_webpage(url: str) -> str:
-    try:
-        headers = { "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36" }
-        loader = WebBaseLoader(url, requests_kwargs={"headers": headers})
-        docs = loader.load()
-        return "".join(doc.page_content for doc in docs)
-    except Exception as e:
-        return f"Error scraping website: {e}"
-
+# Async, pooled and cached; returns only the page's main text (see Backend/web_scraper.py)
 web_scraper_tool = Tool(
     name="web_scraper_tool",
-    func=scrape_webpage,
+    func=web_scraper.scrape_sync,
+    coroutine=web_scraper.scrape,
     description="A tool to scrape a single webpage for very recent movies."
 )
 
 tools = [retriever_tool, web_scraper_tool]
 
 # Create Agent Prompt
-prompt_template = """
+agent_persona = """
 You are CineVerse AI, a friendly, empathetic, and highly conversational movie chatbot.
 Your top priority is to make the user feel heard and understood. Start each conversation by gently asking about their day or mood, and use their responses to guide your tone and recommendations. Do not immediately ask for movie names or preferences—focus on building rapport and understanding how they're feeling first.
 
@@ -351,7 +395,9 @@ Always reply in a concise, back-and-forth style, as if chatting with a friend. A
 If the user shares their mood or something about their day, acknowledge it and adapt your suggestions accordingly. For example, if they're tired, suggest relaxing movies; if they're excited, suggest something fun or adventurous. If they seem sad, be extra supportive and offer uplifting or comforting recommendations.
 
 **When you recommend a movie, always try to provide a direct link to watch it on an OTT streaming platform (like Netflix, Prime Video, Disney+, etc.) if available. If you can't find an OTT link, provide the IMDb link for the movie instead. Format these links clearly in your markdown reply.**
+"""
 
+prompt_template = agent_persona + """
 You have access to the following tools:
 {tools}
 
@@ -382,6 +428,16 @@ agent_executor = AgentExecutor(
     handle_parsing_errors=True
 )
 
+# Small talk and self-contained recommendation requests skip the ReAct loop (see Backend/intent_router.py)
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+small_talk_model = os.getenv("SMALL_TALK_MODEL")
+intent_router = IntentRouter(
+    llm,
+    retriever,
+    persona=agent_persona,
+    small_talk_llm=ChatGoogleGenerativeAI(model=small_talk_model, temperature=0.6) if small_talk_model else None,
+)
+
 
 # --- API Endpoints ---
 class ChatRequest(BaseModel):
@@ -401,27 +457,20 @@ def read_root():
 def health():
     return {"status": "ok"}
 
-@app.post("/chat")
-async def handle_chat(request: ChatRequest, db: Session = Depends(get_db), current=Depends(get_current_user), x_forwarded_for: str | None = Header(default=None)):
-    # Rate limiting per user
-    rl_key = f"chat:{current.get('sub')}"
-    if not security.rate_limit_ok(rl_key, max_requests=30, window_seconds=60):
-        raise HTTPException(status_code=429, detail="Too many requests. Please slow down.")
-
-    # Load recent chat history from DB (last 20 messages)
-    from Backend.database import ChatMessage
-    history_rows = (
-        db.query(ChatMessage)
-        .filter(ChatMessage.session_id == request.session_id)
-        .order_by(ChatMessage.created_at.asc())
-        .all()
-    )
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    # Prometheus text format; values are per worker process
+    return metrics.render_prometheus()
+
+async def _build_agent_input(request: ChatRequest, db: AsyncSession) -> dict:
+    """Loads the session history and prepends the optional device context."""
+    # Recent chat history (ring buffer, falling back to a bounded DB query)
     chat_history = []
-    for row in history_rows[-40:]:
-        if row.sender == 'user':
-            chat_history.append(HumanMessage(content=row.message))
+    for row in await history_store.aget(db, request.session_id):
+        if row["sender"] == 'user':
+            chat_history.append(HumanMessage(content=row["message"]))
         else:
-            chat_history.append(AIMessage(content=row.message))
+            chat_history.append(AIMessage(content=row["message"]))
 
     # Inject optional user context to inform recommendations
     context_bits = []
@@ -435,22 +484,156 @@ async def handle_chat(request: ChatRequest, db: Session = Depends(get_db), curre
         context_bits.append(f"gender={request.gender}")
     preface = f"Context (from user/device): {', '.join(context_bits)}\n" if context_bits else ""
 
-    response = await agent_executor.ainvoke({
+    return {
         "input": preface + request.message,
         "chat_history": chat_history,
-    })
-    output = response.get('output', "I'm sorry, I encountered an issue.")
+    }
 
-    # Persist both user and bot messages
-    db.add(ChatMessage(session_id=request.session_id, user_id=int(current.get('sub')), sender='user', message=request.message))
-    db.add(ChatMessage(session_id=request.session_id, user_id=int(current.get('sub')), sender='bot', message=output))
-    db.commit()
+async def _semantic_cache_probe(request: ChatRequest, agent_input: dict, db: AsyncSession, user_id: int):
+    """Looks the question up in the semantic cache; None when the cache must not be used."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    if agent_input["chat_history"]:
+        # Follow-ups depend on the conversation so far
+        record_bypass("history")
+        return None
+    user = await crud.aget_user_by_id(db, user_id)
+    if user is None or user.semantic_cache_opt_out:
+        record_bypass("opt_out")
+        return None
+    return await semantic_cache.lookup(request.message, context_bucket(request.mood, request.expression, request.age, request.gender))
+
+def _route_for(request: ChatRequest, agent_input: dict) -> str:
+    if not INTENT_ROUTER_ENABLED:
+        return ROUTE_AGENT
+    return classify(request.message, agent_input["chat_history"])
+
+async def _persist_messages(db: AsyncSession, session_id: str, user_id: int, messages: list[tuple[str, str]]):
+    """Persist (sender, message) pairs (and the session summary)."""
+    last_id = await crud.arecord_chat_messages(db, session_id=session_id, user_id=user_id, messages=messages)
+    await history_store.aappend(session_id, [{"sender": sender, "message": message} for sender, message in messages], last_id)
+
+async def _persist_exchange(db: AsyncSession, session_id: str, user_id: int, user_message: str, bot_message: str):
+    """Persist both user and bot messages (and the session summary)."""
+    await _persist_messages(db, session_id, user_id, [("user", user_message), ("bot", bot_message)])
+
+@app.post("/chat")
+async def handle_chat(request: ChatRequest, db: AsyncSession = Depends(get_async_db), current=Depends(get_current_user), x_forwarded_for: str | None = Header(default=None)):
+    # Rate limiting per user
+    chat_limiter.enforce(current.get('sub'))
+    user_id = int(current.get('sub'))
+
+    agent_input = await _build_agent_input(request, db)
+    probe = await _semantic_cache_probe(request, agent_input, db, user_id)
+    if probe is not None and probe.answer is not None:
+        output = probe.answer
+    else:
+        route = _route_for(request, agent_input)
+        started = time.monotonic()
+        with track_route(route) as llm_calls:
+            if route == ROUTE_AGENT:
+                response = await agent_executor.ainvoke(agent_input, config={"callbacks": [llm_calls]})
+                answer = response.get('output')
+            else:
+                answer = await intent_router.ainvoke(route, agent_input, request.message, callbacks=[llm_calls])
+        output = answer or "I'm sorry, I encountered an issue."
+        if probe is not None and answer:
+            semantic_cache.store(probe, output, time.monotonic() - started)
+
+    await _persist_exchange(db, request.session_id, user_id, request.message, output)
 
     return {"sender": "bot", "message": output}
 
+@app.post("/chat/stream")
+async def handle_chat_stream(request: ChatRequest, status_events: bool = True, db: AsyncSession = Depends(get_async_db), current=Depends(get_current_user)):
+    """Same as /chat, but streams the final answer as Server-Sent Events.
+
+    Events: ``status`` (tool in use, when status_events is on), ``token``
+    (a piece of the final answer) and ``done`` (the complete message, sent
+    after both messages are saved). ``error`` replaces ``done`` on failure.
+    The user message is saved before streaming starts; on failure or a
+    dropped connection the partial answer is saved instead.
+    """
+    chat_limiter.enforce(current.get('sub'))
+
+    agent_input = await _build_agent_input(request, db)
+    user_id = int(current.get('sub'))
+
+    probe = await _semantic_cache_probe(request, agent_input, db, user_id)
+    # Saved before streaming, so the question survives a dropped connection like it does on /chat
+    await _persist_messages(db, request.session_id, user_id, [("user", request.message)])
+
+    async def save_answer(message: str):
+        # The request-scoped session is closed once the response starts, so use a fresh one
+        async with AsyncSessionLocal() as stream_db:
+            await _persist_messages(stream_db, request.session_id, user_id, [("bot", message)])
+
+    async def event_stream():
+        streamed = []
+        saving = None
+        try:
+            if probe is not None and probe.answer is not None:
+                output = probe.answer
+                streamed.append(output)
+                yield sse_event("token", {"text": output})
+            else:
+                route = _route_for(request, agent_input)
+                output = None
+                started = time.monotonic()
+                with track_route(route) as llm_calls:
+                    try:
+                        if route == ROUTE_AGENT:
+                            answer_filter = FinalAnswerFilter()
+                            async for event in agent_executor.astream_events(agent_input, version="v2", config={"callbacks": [llm_calls]}):
+                                kind = event["event"]
+                                if kind == "on_chat_model_start":
+                                    answer_filter.reset()
+                                elif kind == "on_chat_model_stream":
+                                    token = answer_filter.feed(event["data"]["chunk"].content or "")
+                                    if token:
+                                        streamed.append(token)
+                                        yield sse_event("token", {"text": token})
+                                elif kind == "on_tool_start" and status_events:
+                                    yield sse_event("status", {"tool": event["name"], "message": TOOL_STATUS.get(event["name"], "Working on it…")})
+                                elif kind == "on_chain_end" and event["name"] == "AgentExecutor":
+                                    output = (event["data"].get("output") or {}).get("output")
+                        else:
+                            if route == ROUTE_RECOMMEND and status_events:
+                                yield sse_event("status", {"tool": "movie_database_search", "message": TOOL_STATUS["movie_database_search"]})
+                            # A direct answer has no ReAct scaffolding; every token is for the user
+                            async for token in intent_router.astream(route, agent_input, request.message, callbacks=[llm_calls]):
+                                streamed.append(token)
+                                yield sse_event("token", {"text": token})
+                            output = "".join(streamed)
+                    except Exception:
+                        logger.exception("Streaming chat failed")
+                        yield sse_event("error", {"message": "I'm sorry, I encountered an issue."})
+                        return
+
+                if probe is not None and output:
+                    semantic_cache.store(probe, output, time.monotonic() - started)
+                output = output or "".join(streamed) or "I'm sorry, I encountered an issue."
+                if not streamed:
+                    # e.g. a parsing-error fallback that never produced a Final Answer line
+                    yield sse_event("token", {"text": output})
+
+            # Shielded: a disconnect while saving must not lose the answer
+            saving = asyncio.ensure_future(save_answer(output))
+            await asyncio.shield(saving)
+            yield sse_event("done", {"sender": "bot", "message": output})
+        finally:
+            if saving is None:
+                # Failed, or the client went away mid-stream: keep what was sent so far, as /chat keeps its fallback
+                await asyncio.shield(asyncio.ensure_future(save_answer("".join(streamed) or "I'm sorry, I encountered an issue.")))
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
 # --- Chat Sessions Management ---
-from Backend.database import ChatMessage as ChatMessageModel
 from uuid import uuid4
 
 class ChatSession(BaseModel):
@@ -458,35 +641,23 @@ class ChatSession(BaseModel):
     last_message_preview: str | None = None
     updated_at: str | None = None
     title: str | None = None
+    message_count: int = 0
 
 @app.get("/chat/sessions", response_model=list[ChatSession])
-def list_chat_sessions(db: Session = Depends(get_db), current=Depends(get_current_user)):
+async def list_chat_sessions(limit: int = Query(default=50, ge=1, le=200), offset: int = Query(default=0, ge=0), db: AsyncSession = Depends(get_async_db), current=Depends(get_current_user)):
     user_id = int(current.get('sub'))
-    # Get distinct session ids for this user
-    session_ids = [row[0] for row in db.query(ChatMessageModel.session_id).filter(ChatMessageModel.user_id==user_id).distinct().all()]
-    sessions: list[ChatSession] = []
-    for sid in session_ids:
-        last = (
-            db.query(ChatMessageModel)
-            .filter(ChatMessageModel.user_id==user_id, ChatMessageModel.session_id==sid)
-            .order_by(ChatMessageModel.created_at.desc())
-            .first()
-        )
-        first_user_msg = (
-            db.query(ChatMessageModel)
-            .filter(ChatMessageModel.user_id==user_id, ChatMessageModel.session_id==sid, ChatMessageModel.sender=='user')
-            .order_by(ChatMessageModel.created_at.asc())
-            .first()
+    # One indexed query on the chat_sessions summary table, newest first
+    rows = await crud.alist_chat_sessions(db, user_id=user_id, limit=limit, offset=offset)
+    return [
+        ChatSession(
+            session_id=row.session_id,
+            last_message_preview=row.last_message_preview,
+            updated_at=row.updated_at.isoformat(),
+            title=row.title or 'New Chat',
+            message_count=row.message_count,
         )
-        sessions.append(ChatSession(
-            session_id=sid,
-            last_message_preview=(last.message[:80] + '…') if last else None,
-            updated_at=last.created_at.isoformat() if last else None,
-            title=(first_user_msg.message[:40] + '…') if first_user_msg else 'New Chat'
-        ))
-    # Sort newest first
-    sessions.sort(key=lambda s: s.updated_at or '', reverse=True)
-    return sessions
+        for row in rows
+    ]
 
 class ChatMessageOut(BaseModel):
     id: int
@@ -494,16 +665,37 @@ class ChatMessageOut(BaseModel):
     message: str
     created_at: str
 
-@app.get("/chat/messages", response_model=list[ChatMessageOut])
-def get_chat_messages(session_id: str, db: Session = Depends(get_db), current=Depends(get_current_user)):
+class ChatMessagesPage(BaseModel):
+    messages: list[ChatMessageOut]
+    # Pass as `before` to load older messages; None once the start of the session is reached
+    before: str | None = None
+    # Pass as `after` to fetch messages newer than this page
+    after: str | None = None
+
+@app.get("/chat/messages", response_model=ChatMessagesPage)
+async def get_chat_messages(
+    session_id: str,
+    limit: int = Query(default=50, ge=1, le=200),
+    before: str | None = None,
+    after: str | None = None,
+    db: AsyncSession = Depends(get_async_db),
+    current=Depends(get_current_user),
+):
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'after', not both")
     user_id = int(current.get('sub'))
-    rows = (
-        db.query(ChatMessageModel)
-        .filter(ChatMessageModel.user_id==user_id, ChatMessageModel.session_id==session_id)
-        .order_by(ChatMessageModel.created_at.asc())
-        .all()
+    try:
+        rows, has_more = await crud.aget_chat_messages_page(db, user_id=user_id, session_id=session_id, limit=limit, before=before, after=after)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not rows:
+        return ChatMessagesPage(messages=[], after=after)
+    older_exist = has_more if not after else True
+    return ChatMessagesPage(
+        messages=[ChatMessageOut(id=r.id, sender=r.sender, message=r.message, created_at=r.created_at.isoformat()) for r in rows],
+        before=crud.encode_message_cursor(rows[0]) if older_exist else None,
+        after=crud.encode_message_cursor(rows[-1]),
     )
-    return [ChatMessageOut(id=r.id, sender=r.sender, message=r.message, created_at=r.created_at.isoformat()) for r in rows]
 
 class NewSessionResponse(BaseModel):
     session_id: str
@@ -514,11 +706,10 @@ def create_chat_session(current=Depends(get_current_user)):
     return NewSessionResponse(session_id=str(uuid4()))
 
 @app.delete("/chat/session/{session_id}")
-def delete_chat_session(session_id: str, db: Session = Depends(get_db), current=Depends(get_current_user)):
+async def delete_chat_session(session_id: str, db: AsyncSession = Depends(get_async_db), current=Depends(get_current_user)):
     user_id = int(current.get('sub'))
-    q = db.query(ChatMessageModel).filter(ChatMessageModel.user_id==user_id, ChatMessageModel.session_id==session_id)
-    deleted = q.delete(synchronize_session=False)
-    db.commit()
+    deleted = await crud.adelete_chat_session(db, user_id=user_id, session_id=session_id)
+    await history_store.aclear(session_id)
     return {"deleted": deleted}
 
 
@@ -0,0 +1,145 @@
+# backend/metrics.py
+"""Minimal in-process metrics registry with Prometheus text output.
+
+Metrics are per process; with several uvicorn workers each worker reports
+its own values on /metrics.
+"""
+import bisect
+import threading
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+_lock = threading.Lock()
+_registry: Dict[str, "_Metric"] = {}
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+
+    def render(self) -> str:
+        return f"# HELP {self.name} {self.help}\n# TYPE {self.name} {self.kind}\n" + "".join(self._samples())
+
+    def _samples(self):
+        return []
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _label_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def _samples(self):
+        for key, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(key)} {value}\n"
+
+
+class Gauge(_Metric):
+    """A settable gauge, or a callback gauge evaluated at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help)
+        self._values: Dict[LabelKey, float] = {}
+        self._callbacks: Dict[LabelKey, Callable[[], float]] = {}
+        if fn is not None:
+            self._callbacks[()] = fn
+
+    def set(self, value: float, **labels) -> None:
+        with _lock:
+            self._values[_label_key(labels)] = value
+
+    def set_function(self, fn: Callable[[], float], **labels) -> None:
+        self._callbacks[_label_key(labels)] = fn
+
+    def _samples(self):
+        values = dict(self._values)
+        for key, fn in list(self._callbacks.items()):
+            try:
+                values[key] = fn()
+            except Exception:
+                continue
+        for key, value in values.items():
+            yield f"{self.name}{_format_labels(key)} {value}\n"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelKey, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with _lock:
+            series = self._series.get(key)
+            if series is None:
+                # per-bucket counts (+Inf last), sum, count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _samples(self):
+        for key, (counts, total, count) in list(self._series.items()):
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{_format_labels(key, ('le', le))} {cumulative}\n"
+            yield f"{self.name}_sum{_format_labels(key)} {total}\n"
+            yield f"{self.name}_count{_format_labels(key)} {count}\n"
+
+
+def _register(cls, name: str, *args, **kwargs):
+    with _lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, *args, **kwargs)
+    return metric
+
+
+def counter(name: str, help: str) -> Counter:
+    return _register(Counter, name, help)
+
+
+def gauge(name: str, help: str, fn: Optional[Callable[[], float]] = None) -> Gauge:
+    return _register(Gauge, name, help, fn)
+
+
+def histogram(name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram, name, help, buckets)
+
+
+def render_prometheus() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    return "".join(metric.render() for metric in list(_registry.values()))
@@ -0,0 +1,135 @@
+# backend/otp_store.py
+"""Short-lived signup OTPs, kept out of the users table.
+
+Each user has at most one live code, stored as an HMAC digest with an
+attempt counter and a TTL of OTP_TTL_SECONDS. Issuing a new code replaces the
+old one and resets the counter. A code stops working after
+OTP_MAX_ATTEMPTS wrong guesses; the user has to request a new one.
+
+``RedisOtpStore`` relies on native key expiry and is shared by all workers.
+It is required: without REDIS_URL the server refuses to start, because a
+code issued by one worker could not be verified by another and a restart
+would lose every pending code. ``MemoryOtpStore`` is per process and only
+used when OTP_STORE=memory is set, for tests and single-process dev runs.
+"""
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from typing import Dict, Optional
+
+from .redis_client import get_redis
+from .security import SECRET_KEY
+
+OTP_TTL_SECONDS = int(os.getenv("OTP_TTL_SECONDS", "600"))
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))
+OTP_STORE = os.getenv("OTP_STORE", "redis").lower()
+
+# verify() results
+OTP_VERIFIED = "verified"
+OTP_INVALID = "invalid"
+OTP_EXPIRED = "expired"  # never issued, expired or already used
+OTP_LOCKED = "locked"  # too many wrong attempts
+
+
+def generate_otp() -> str:
+    return f"{secrets.randbelow(1000000):06d}"
+
+
+def _digest(user_id: int, code: str) -> str:
+    return hmac.new(SECRET_KEY.encode("utf-8"), f"otp:{user_id}:{code}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def _check(user_id: int, code: str, digest: str, attempts: int, max_attempts: int) -> str:
+    # ``attempts`` already includes this one
+    if attempts > max_attempts:
+        return OTP_LOCKED
+    if hmac.compare_digest(_digest(user_id, code), digest):
+        return OTP_VERIFIED
+    return OTP_INVALID
+
+
+class MemoryOtpStore:
+    def __init__(self, ttl_seconds: int = OTP_TTL_SECONDS, max_attempts: int = OTP_MAX_ATTEMPTS):
+        self.ttl_seconds = ttl_seconds
+        self.max_attempts = max_attempts
+        self._codes: Dict[int, list] = {}  # user id -> [digest, attempts, expires_at]
+        self._lock = threading.Lock()
+
+    def issue(self, user_id: int) -> str:
+        code = generate_otp()
+        now = time.monotonic()
+        with self._lock:
+            for uid in [u for u, entry in self._codes.items() if entry[2] <= now]:
+                del self._codes[uid]
+            self._codes[user_id] = [_digest(user_id, code), 0, now + self.ttl_seconds]
+        return code
+
+    def verify(self, user_id: int, code: str) -> str:
+        with self._lock:
+            entry = self._codes.get(user_id)
+            if entry is None or entry[2] <= time.monotonic():
+                self._codes.pop(user_id, None)
+                return OTP_EXPIRED
+            entry[1] += 1
+            result = _check(user_id, code, entry[0], entry[1], self.max_attempts)
+            if result == OTP_VERIFIED:
+                del self._codes[user_id]
+            return result
+
+
+class RedisOtpStore:
+    # Counts the attempt only if a code exists, so a stray verify never creates a key
+    _ATTEMPT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local attempts = redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+return {attempts, redis.call('HGET', KEYS[1], 'digest')}
+"""
+
+    def __init__(self, client, ttl_seconds: int = OTP_TTL_SECONDS, max_attempts: int = OTP_MAX_ATTEMPTS):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.max_attempts = max_attempts
+        self._attempt = client.register_script(self._ATTEMPT_SCRIPT)
+
+    def _key(self, user_id: int) -> str:
+        return f"otp:{user_id}"
+
+    def issue(self, user_id: int) -> str:
+        code = generate_otp()
+        key = self._key(user_id)
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping={"digest": _digest(user_id, code), "attempts": 0})
+        pipe.expire(key, self.ttl_seconds)
+        pipe.execute()
+        return code
+
+    def verify(self, user_id: int, code: str) -> str:
+        found: Optional[list] = self._attempt(keys=[self._key(user_id)])
+        if not found:
+            return OTP_EXPIRED
+        attempts, digest = int(found[0]), found[1]
+        result = _check(user_id, code, digest, attempts, self.max_attempts)
+        if result == OTP_VERIFIED:
+            self.client.delete(self._key(user_id))
+        return result
+
+
+def _create_store():
+    if OTP_STORE == "memory":
+        print("OTP store: per-process memory (OTP_STORE=memory); do not run more than one worker.")
+        return MemoryOtpStore()
+    client = get_redis()
+    if client is None:
+        raise RuntimeError("OTP codes are kept in Redis, but REDIS_URL is unset or unreachable. "
+                           "Set OTP_STORE=memory to use a per-process store for a single-process dev run.")
+    print("OTP store: Redis.")
+    return RedisOtpStore(client)
+
+
+otp_store = _create_store()
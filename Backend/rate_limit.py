@@ -0,0 +1,140 @@
+# backend/rate_limit.py
+"""Request rate limits using GCRA (generic cell rate algorithm).
+
+A limit of ``limit`` requests per ``period`` seconds allows one request every
+``period / limit`` seconds with bursts of up to ``limit``. The only state per
+key is its theoretical arrival time (TAT), so checks are O(1) in time and
+memory, and the window slides smoothly instead of resetting.
+
+With Redis the check-and-update is one Lua script, atomic across workers and
+timed with the Redis clock. Without Redis (or if a call fails) a per-process
+table holds up to ``max_keys`` keys and evicts the least recently used.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from . import metrics
+from .redis_client import get_redis
+
+RATE_LIMIT_DECISIONS = metrics.counter("rate_limit_decisions_total", "Rate limit checks by limiter and result")
+
+# KEYS[1] = TAT key; ARGV[1] = emission interval (ms), ARGV[2] = limit
+# Returns {allowed, remaining, retry_after_ms}
+_GCRA_SCRIPT = """
+local interval = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then tat = now end
+local new_tat = tat + interval
+local allow_at = new_tat - interval * limit
+if now < allow_at then
+    return {0, 0, allow_at - now}
+end
+redis.call('SET', KEYS[1], new_tat, 'PX', math.ceil(new_tat - now))
+return {1, math.floor((now - allow_at) / interval), 0}
+"""
+
+
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float  # seconds until the next request would be allowed
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, result: RateLimitResult, detail: str):
+        super().__init__(detail)
+        self.result = result
+        self.detail = detail
+
+
+class MemoryGcraStore:
+    """Per-process TATs for at most ``max_keys`` keys (LRU eviction)."""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._tats: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, interval: float, limit: int) -> RateLimitResult:
+        now = time.monotonic()
+        with self._lock:
+            tat = max(self._tats.get(key, now), now)
+            new_tat = tat + interval
+            allow_at = new_tat - interval * limit
+            if now < allow_at:
+                return RateLimitResult(False, limit, 0, allow_at - now)
+            self._tats[key] = new_tat
+            self._tats.move_to_end(key)
+            # An evicted key has a TAT in the past at worst, i.e. a fresh budget
+            while len(self._tats) > self.max_keys:
+                self._tats.popitem(last=False)
+        return RateLimitResult(True, limit, int((now - allow_at) // interval), 0.0)
+
+
+class RedisGcraStore:
+    def __init__(self, client):
+        self._script = client.register_script(_GCRA_SCRIPT)
+
+    def hit(self, key: str, interval: float, limit: int) -> RateLimitResult:
+        allowed, remaining, retry_ms = self._script(keys=[key], args=[max(1, round(interval * 1000)), limit])
+        return RateLimitResult(bool(allowed), limit, int(remaining), int(retry_ms) / 1000.0)
+
+
+_memory_store = MemoryGcraStore()
+_redis_store: Optional[RedisGcraStore] = None
+
+
+def _store():
+    global _redis_store
+    client = get_redis()
+    if client is None:
+        return _memory_store
+    if _redis_store is None:
+        _redis_store = RedisGcraStore(client)
+    return _redis_store
+
+
+class RateLimiter:
+    """``limit`` requests per ``period_seconds`` for each key, e.g. a user id."""
+
+    def __init__(self, name: str, limit: int, period_seconds: float, detail: str = "Too many requests. Please slow down."):
+        self.name = name
+        self.limit = limit
+        self.interval = period_seconds / limit
+        self.detail = detail
+
+    def hit(self, key: str) -> RateLimitResult:
+        full_key = f"ratelimit:{self.name}:{key}"
+        store = _store()
+        try:
+            result = store.hit(full_key, self.interval, self.limit)
+        except Exception as e:
+            if store is _memory_store:
+                raise
+            print(f"Redis rate limit failed, using in-process limiter: {e}")
+            result = _memory_store.hit(full_key, self.interval, self.limit)
+        RATE_LIMIT_DECISIONS.inc(limiter=self.name, result="allowed" if result.allowed else "denied")
+        return result
+
+    def enforce(self, key: str) -> RateLimitResult:
+        """Like hit, but raises RateLimitExceeded when the request is denied."""
+        result = self.hit(key)
+        if not result.allowed:
+            raise RateLimitExceeded(result, self.detail)
+        return result
+
+
+def rate_limit_headers(result: RateLimitResult) -> dict:
+    headers = {"X-RateLimit-Limit": str(result.limit), "X-RateLimit-Remaining": str(result.remaining)}
+    if not result.allowed:
+        headers["Retry-After"] = str(max(1, math.ceil(result.retry_after)))
+    return headers
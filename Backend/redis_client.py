@@ -0,0 +1,24 @@
+# backend/redis_client.py
+import os
+from typing import Optional
+
+import redis
+
+_REDIS_URL = os.getenv("REDIS_URL")
+_redis_client: Optional[redis.Redis] = None
+_initialized = False
+
+
+def get_redis() -> Optional[redis.Redis]:
+    """Returns the shared Redis client, or None when REDIS_URL is unset or unreachable."""
+    global _redis_client, _initialized
+    if not _initialized:
+        _initialized = True
+        if _REDIS_URL:
+            try:
+                client = redis.Redis.from_url(_REDIS_URL, decode_responses=True)
+                client.ping()
+                _redis_client = client
+            except Exception:
+                _redis_client = None
+    return _redis_client
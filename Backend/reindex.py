@@ -0,0 +1,102 @@
+# backend/reindex.py
+"""Delta re-indexing driven by per-movie content hashes.
+
+The index manifest records, for every movie in a vector store, a hash of
+the exact text and metadata that was embedded and the embedding model that
+embedded it. ``plan_reindex`` compares it with the current catalogue:
+
+* new movies, and movies whose hash changed, are embedded and upserted,
+* movies that left the catalogue are deleted from the store,
+* everything else is left alone.
+
+The manifest is only replaced after a run has succeeded, so a failed run is
+planned the same way again and resumes from its checkpoint. With no
+manifest, or once the embedding model changes, the plan is a full rebuild.
+"""
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Set
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .catalogue import METADATA_COLUMNS, ROW_GROUP_SIZE
+
+
+def content_hash(row: dict) -> str:
+    """Hash of a catalogue row: its page_content plus every metadata column."""
+    payload = json.dumps(row, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def catalogue_hashes(catalogue_path: str) -> Dict[str, str]:
+    """Movie id -> content hash for the whole catalogue."""
+    hashes = {}
+    parquet = pq.ParquetFile(catalogue_path)
+    for batch in parquet.iter_batches(batch_size=ROW_GROUP_SIZE, columns=["page_content"] + METADATA_COLUMNS):
+        for row in batch.to_pylist():
+            hashes[row["id"]] = content_hash(row)
+    return hashes
+
+
+class IndexManifest:
+    """(movie id, content hash, embedding model) for every movie in one vector store, stored as Parquet."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, tuple] = {}  # movie id -> (content hash, model)
+        if os.path.exists(path):
+            table = pq.read_table(path)
+            self.entries = dict(zip(
+                table.column("id").to_pylist(),
+                zip(table.column("content_hash").to_pylist(), table.column("model").to_pylist()),
+            ))
+
+    def fingerprint(self) -> str:
+        """Changes whenever the manifest is saved, so checkpoints from an older plan are ignored."""
+        if not os.path.exists(self.path):
+            return ""
+        with open(self.path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def save(self, hashes: Dict[str, str], model: str) -> None:
+        table = pa.table({
+            "id": pa.array(list(hashes), type=pa.string()),
+            "content_hash": pa.array(list(hashes.values()), type=pa.string()),
+            "model": pa.array([model] * len(hashes), type=pa.string()).dictionary_encode(),
+        })
+        tmp_path = f"{self.path}.tmp"
+        pq.write_table(table, tmp_path, compression="zstd")
+        os.replace(tmp_path, self.path)
+        self.entries = {movie_id: (h, model) for movie_id, h in hashes.items()}
+
+
+@dataclass
+class ReindexPlan:
+    hashes: Dict[str, str]  # the current catalogue; becomes the next manifest
+    changed: Set[str]  # ids to embed and upsert
+    removed: List[str]  # ids to delete from the store
+    full: bool  # rebuild from scratch
+
+    @property
+    def unchanged(self) -> int:
+        return len(self.hashes) - len(self.changed)
+
+    @property
+    def empty(self) -> bool:
+        return not self.changed and not self.removed
+
+
+def plan_reindex(catalogue_path: str, manifest: IndexManifest, model: str, full: bool = False) -> ReindexPlan:
+    """Diffs the catalogue against the manifest."""
+    hashes = catalogue_hashes(catalogue_path)
+    old = manifest.entries
+    full = full or not old or any(entry_model != model for _, entry_model in old.values())
+    if full:
+        changed = set(hashes)
+    else:
+        changed = {movie_id for movie_id, h in hashes.items() if old.get(movie_id, (None,))[0] != h}
+    removed = [movie_id for movie_id in old if movie_id not in hashes]
+    return ReindexPlan(hashes=hashes, changed=changed, removed=removed, full=full)
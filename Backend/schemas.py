@@ -20,6 +20,7 @@ class User(BaseModel):
     email: EmailStr
     profile_pic_url: Optional[str] = None  # New field for profile picture URL
     is_verified: bool
+    semantic_cache_opt_out: bool = False
     class Config:
         from_attributes = True
 
@@ -56,6 +57,10 @@ class ProfilePicUpdate(BaseModel):
     user_id: int
     url: str
 
+class SemanticCacheUpdate(BaseModel):
+    user_id: int
+    opt_out: bool
+
 class VerifyOtpRequest(BaseModel):
     identifier: str
     otp_code: str
@@ -1,9 +1,15 @@
 import os
 import time
+import hashlib
+import secrets
 import re
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Dict
-import os
-import redis
+from . import metrics
+from .redis_client import get_redis
 from passlib.context import CryptContext
 from itsdangerous import URLSafeTimedSerializer
 import jwt
@@ -17,8 +23,9 @@ if not SECRET_KEY:
 JWT_ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_SECONDS = 60 * 60  # 1 hour
 
-# Setup for password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Setup for password hashing (work factor is tunable per deployment)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 # Setup for token generation (for password reset)
 serializer = URLSafeTimedSerializer(SECRET_KEY)
@@ -30,6 +37,48 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
+# ---------------- Password worker pool --------------
+# bcrypt releases the GIL while hashing, so a small dedicated thread pool
+# gives real parallelism without competing with FastAPI's default threadpool.
+# At most PASSWORD_POOL_WORKERS jobs run and PASSWORD_POOL_QUEUE more may
+# wait; anything beyond that fails fast with PasswordPoolSaturated (-> 503).
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_POOL_QUEUE = int(os.getenv("PASSWORD_POOL_QUEUE", "32"))
+
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_POOL_WORKERS, thread_name_prefix="bcrypt")
+_password_slots = threading.BoundedSemaphore(PASSWORD_POOL_WORKERS + PASSWORD_POOL_QUEUE)
+
+PASSWORD_HASH_SECONDS = metrics.histogram("password_hash_seconds", "bcrypt hash/verify run time")
+PASSWORD_QUEUE_SECONDS = metrics.histogram("password_queue_wait_seconds", "Time password jobs waited for a worker")
+PASSWORD_REJECTED = metrics.counter("password_pool_rejected_total", "Password jobs rejected because the pool was saturated")
+
+class PasswordPoolSaturated(Exception):
+    """Raised when the password worker pool and its queue are full."""
+
+def _submit_password_job(op: str, fn, *args) -> asyncio.Future:
+    if not _password_slots.acquire(blocking=False):
+        PASSWORD_REJECTED.inc(op=op)
+        raise PasswordPoolSaturated(op)
+    enqueued = time.perf_counter()
+
+    def run():
+        started = time.perf_counter()
+        PASSWORD_QUEUE_SECONDS.observe(started - enqueued, op=op)
+        try:
+            return fn(*args)
+        finally:
+            PASSWORD_HASH_SECONDS.observe(time.perf_counter() - started, op=op)
+
+    future = _password_executor.submit(run)
+    future.add_done_callback(lambda _: _password_slots.release())
+    return asyncio.wrap_future(future)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _submit_password_job("verify", pwd_context.verify, plain_password, hashed_password)
+
+async def hash_password_async(password: str) -> str:
+    return await _submit_password_job("hash", pwd_context.hash, password)
+
 # ---------------- Password policy ------------------
 PASSWORD_POLICY_RE = re.compile(r"^(?=.*[A-Za-z])(?=.*\d)[A-Za-z\d!@#$%^&*()_+\-=]{8,64}$")
 
@@ -62,50 +111,135 @@ def verify_reset_token(token: str, max_age_seconds: int = 3600) -> Optional[str]
 def create_access_token(*, user_id: int, username: str, email: str) -> str:
     if SECRET_KEY == "__MISSING_SECRET_KEY__":
         raise RuntimeError("SECRET_KEY is not configured")
-    now = int(time.time())
+    now = time.time()
     payload = {
         "sub": str(user_id),
         "username": username,
         "email": email,
+        # Fractional seconds, so revoking a user's tokens catches one minted earlier in the same second
         "iat": now,
-        "exp": now + ACCESS_TOKEN_EXPIRE_SECONDS,
+        "exp": int(now) + ACCESS_TOKEN_EXPIRE_SECONDS,
+        # Unique per login, so logging out one session never revokes another
+        "jti": secrets.token_hex(8),
     }
     return jwt.encode(payload, SECRET_KEY, algorithm=JWT_ALGORITHM)
 
-def verify_access_token(token: str) -> Optional[Dict]:
+def _decode_access_token(token: str) -> Optional[Dict]:
     try:
         return jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
     except Exception:
         return None
 
-# ---------------- Simple in-memory rate limit -------
-_RATE_BUCKET: Dict[str, list] = {}
-_REDIS_URL = os.getenv("REDIS_URL")
-_redis_client = None
-if _REDIS_URL:
+# ---------------- Verified-token cache --------------
+# Verified claims are kept per process, keyed by sha256(token), until the
+# token's exp. Revocations made in this process take effect immediately.
+# Revocations are also written to Redis (when available) and checked on every
+# cache miss and, for cached tokens, at most every TOKEN_REVALIDATE_SECONDS,
+# which bounds how long another worker keeps accepting a revoked token.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_REVALIDATE_SECONDS = float(os.getenv("TOKEN_REVALIDATE_SECONDS", "30"))
+
+TOKEN_CACHE_LOOKUPS = metrics.counter("auth_token_cache_total", "Access token verifications by cache result")
+
+_token_lock = threading.Lock()
+_token_cache: "OrderedDict[bytes, list]" = OrderedDict()  # digest -> [exp, checked_at, claims]
+_revoked_tokens: Dict[bytes, float] = {}  # digest -> exp
+_revoked_before: Dict[str, tuple] = {}  # user id -> (revoked at, forget after)
+
+def _token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+def _is_revoked(digest: bytes, claims: Dict) -> bool:
+    sub = str(claims.get("sub"))
+    iat = claims.get("iat", 0)
+    with _token_lock:
+        if digest in _revoked_tokens:
+            return True
+        local = _revoked_before.get(sub)
+        if local and iat <= local[0]:
+            return True
+    client = get_redis()
+    if client is None:
+        return False
     try:
-        _redis_client = redis.Redis.from_url(_REDIS_URL, decode_responses=True)
-        _redis_client.ping()
+        pipe = client.pipeline()
+        pipe.exists(f"auth:revoked:{digest.hex()}")
+        pipe.get(f"auth:revoked_before:{sub}")
+        revoked, before = pipe.execute()
     except Exception:
-        _redis_client = None
+        return False
+    return bool(revoked) or (before is not None and iat <= float(before))
+
+def verify_access_token(token: str) -> Optional[Dict]:
+    """Returns the token's claims, or None if it is invalid, expired or revoked."""
+    digest = _token_digest(token)
+    now = time.time()
+    with _token_lock:
+        entry = _token_cache.get(digest)
+        if entry is not None:
+            if now >= entry[0]:
+                del _token_cache[digest]
+                entry = None
+            else:
+                _token_cache.move_to_end(digest)
+    if entry is not None:
+        TOKEN_CACHE_LOOKUPS.inc(result="hit")
+        if now - entry[1] < TOKEN_REVALIDATE_SECONDS:
+            return entry[2]
+        if _is_revoked(digest, entry[2]):
+            with _token_lock:
+                _token_cache.pop(digest, None)
+            return None
+        entry[1] = now
+        return entry[2]
 
-def rate_limit_ok(key: str, max_requests: int, window_seconds: int) -> bool:
-    """Use Redis token bucket when available; fallback to in-memory."""
-    if _redis_client is not None:
-        pipeline = _redis_client.pipeline()
+    TOKEN_CACHE_LOOKUPS.inc(result="miss")
+    claims = _decode_access_token(token)
+    if claims is None or _is_revoked(digest, claims):
+        return None
+    with _token_lock:
+        _token_cache[digest] = [claims.get("exp", now + ACCESS_TOKEN_EXPIRE_SECONDS), now, claims]
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return claims
+
+def _prune_revocations(now: float) -> None:
+    for digest in [d for d, exp in _revoked_tokens.items() if exp <= now]:
+        del _revoked_tokens[digest]
+    for sub in [u for u, (_, forget) in _revoked_before.items() if forget <= now]:
+        del _revoked_before[sub]
+
+def revoke_access_token(token: str) -> None:
+    """Invalidates one token (logout) until it would have expired anyway."""
+    claims = _decode_access_token(token)
+    if claims is None:
+        return
+    digest = _token_digest(token)
+    now = time.time()
+    exp = claims.get("exp", now + ACCESS_TOKEN_EXPIRE_SECONDS)
+    with _token_lock:
+        _prune_revocations(now)
+        _revoked_tokens[digest] = exp
+        _token_cache.pop(digest, None)
+    client = get_redis()
+    if client is not None:
         try:
-            pipeline.incr(key)
-            pipeline.expire(key, window_seconds)
-            count, _ = pipeline.execute()
-            return int(count) <= max_requests
-        except Exception:
-            # fall back to memory
-            pass
-    # In-memory fallback
+            client.set(f"auth:revoked:{digest.hex()}", 1, ex=max(1, int(exp - now) + 1))
+        except Exception as e:
+            print(f"Could not record token revocation in Redis: {e}")
+
+def revoke_user_tokens(user_id: int) -> None:
+    """Invalidates every token issued to a user up to now (password change)."""
     now = time.time()
-    bucket = _RATE_BUCKET.setdefault(key, [])
-    _RATE_BUCKET[key] = [ts for ts in bucket if ts > now - window_seconds]
-    if len(_RATE_BUCKET[key]) >= max_requests:
-        return False
-    _RATE_BUCKET[key].append(now)
-    return True
\ No newline at end of file
+    sub = str(user_id)
+    with _token_lock:
+        _prune_revocations(now)
+        _revoked_before[sub] = (now, now + ACCESS_TOKEN_EXPIRE_SECONDS)
+        for digest in [d for d, entry in _token_cache.items() if str(entry[2].get("sub")) == sub]:
+            del _token_cache[digest]
+    client = get_redis()
+    if client is not None:
+        try:
+            client.set(f"auth:revoked_before:{sub}", repr(now), ex=ACCESS_TOKEN_EXPIRE_SECONDS)
+        except Exception as e:
+            print(f"Could not record token revocation in Redis: {e}")
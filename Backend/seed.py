@@ -2,6 +2,7 @@ import os
 from dotenv import load_dotenv
 from Backend.database import SessionLocal, Base, engine, User, ChatMessage
 from Backend.security import hash_password
+from Backend.crud import record_chat_exchange
 
 
 def main():
@@ -31,9 +32,7 @@ def main():
     # Seed some chat messages
     sid = str(user.id)
     if not db.query(ChatMessage).filter(ChatMessage.user_id == user.id).first():
-        db.add(ChatMessage(session_id=sid, user_id=user.id, sender='user', message='Hi'))
-        db.add(ChatMessage(session_id=sid, user_id=user.id, sender='bot', message='Hello!'))
-        db.commit()
+        record_chat_exchange(db, session_id=sid, user_id=user.id, user_message='Hi', bot_message='Hello!')
         print("Seeded chat messages")
     else:
         print("Chat messages already present for test user")
@@ -0,0 +1,151 @@
+# backend/semantic_cache.py
+"""Semantic cache of chat answers, in front of the agent.
+
+A question is embedded (through the shared, cached embeddings) and compared
+with the questions already answered in the same context bucket; if the best
+cosine similarity reaches SEMANTIC_CACHE_THRESHOLD, the stored answer is
+returned instead of running the agent. The bucket is built from every piece
+of device context the agent sees (mood, expression, gender and a coarse age
+bracket), so an answer given for "sad" is never served for "excited", and
+never crosses the adult/minor line.
+
+Only the first message of a session is looked up or stored: later messages
+depend on the conversation so far. Entries expire after
+SEMANTIC_CACHE_TTL_SECONDS and the least recently used ones are evicted
+past SEMANTIC_CACHE_MAX_ENTRIES. The cache lives in each worker process.
+"""
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from . import metrics
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+
+CACHE_REQUESTS = metrics.counter("semantic_cache_requests_total", "Semantic cache lookups by result")
+CACHE_SECONDS_SAVED = metrics.counter("semantic_cache_seconds_saved_total", "Agent run time avoided by semantic cache hits")
+CACHE_BYPASSED = metrics.counter("semantic_cache_bypassed_total", "Chat requests that skipped the semantic cache, by reason")
+CACHE_ENTRIES = metrics.gauge("semantic_cache_entries", "Answers held in this worker's semantic cache")
+CACHE_SIMILARITY = metrics.histogram("semantic_cache_best_similarity", "Best similarity found per semantic cache lookup",
+                                     buckets=(0.5, 0.7, 0.8, 0.85, 0.9, 0.92, 0.95, 0.98, 1.0))
+
+logger = logging.getLogger(__name__)
+
+
+def context_bucket(mood: Optional[str], expression: Optional[str], age: Optional[int],
+                   gender: Optional[str]) -> str:
+    """Cache partition for the optional device context of a request."""
+    if age is None:
+        bracket = "unknown"
+    elif age < 13:
+        bracket = "child"
+    elif age < 18:
+        bracket = "teen"
+    else:
+        bracket = "adult"
+    return "|".join(((mood or "").strip().lower(), (expression or "").strip().lower(), bracket,
+                     (gender or "").strip().lower()))
+
+
+@dataclass
+class _Entry:
+    bucket: str
+    vector: np.ndarray
+    answer: str
+    created_at: float
+    cost_seconds: float  # how long the agent took to produce the answer
+
+
+@dataclass
+class CacheProbe:
+    """Result of a lookup; pass it back to ``store`` on a miss."""
+    bucket: str
+    vector: Optional[np.ndarray]
+    answer: Optional[str] = None
+    similarity: float = 0.0
+
+
+class SemanticCache:
+    def __init__(self, embeddings: Embeddings, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 ttl_seconds: int = SEMANTIC_CACHE_TTL_SECONDS, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lru: "OrderedDict[int, str]" = OrderedDict()  # entry id -> bucket, least recently used first
+        self._buckets: Dict[str, Dict[int, _Entry]] = {}
+        self._next_id = 0
+        CACHE_ENTRIES.set_function(lambda: len(self))
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def _remove(self, entry_id: int) -> None:
+        bucket = self._lru.pop(entry_id)
+        entries = self._buckets[bucket]
+        del entries[entry_id]
+        if not entries:
+            del self._buckets[bucket]
+
+    async def lookup(self, query: str, bucket: str) -> CacheProbe:
+        try:
+            vector = np.asarray(await self.embeddings.aembed_query(query), dtype=np.float32)
+        except Exception as e:
+            # The agent will embed the query again anyway; just skip the cache
+            logger.warning("Semantic cache lookup failed: %s", e)
+            CACHE_REQUESTS.inc(result="error")
+            return CacheProbe(bucket=bucket, vector=None)
+        norm = np.linalg.norm(vector)
+        vector = vector / norm if norm else vector
+
+        now = time.time()
+        entries = self._buckets.get(bucket, {})
+        for entry_id in [i for i, e in entries.items() if now - e.created_at > self.ttl_seconds]:
+            self._remove(entry_id)
+        entries = self._buckets.get(bucket, {})
+        if not entries:
+            CACHE_REQUESTS.inc(result="miss")
+            return CacheProbe(bucket=bucket, vector=vector)
+
+        ids = list(entries)
+        scores = np.stack([entries[i].vector for i in ids]) @ vector
+        best = int(np.argmax(scores))
+        similarity = float(scores[best])
+        CACHE_SIMILARITY.observe(similarity)
+        if similarity < self.threshold:
+            CACHE_REQUESTS.inc(result="miss")
+            return CacheProbe(bucket=bucket, vector=vector, similarity=similarity)
+
+        entry = entries[ids[best]]
+        self._lru.move_to_end(ids[best])
+        CACHE_REQUESTS.inc(result="hit")
+        CACHE_SECONDS_SAVED.inc(entry.cost_seconds)
+        return CacheProbe(bucket=bucket, vector=vector, answer=entry.answer, similarity=similarity)
+
+    def store(self, probe: CacheProbe, answer: str, cost_seconds: float) -> None:
+        if probe.vector is None or probe.answer is not None:
+            return
+        entry_id = self._next_id
+        self._next_id += 1
+        self._buckets.setdefault(probe.bucket, {})[entry_id] = _Entry(
+            bucket=probe.bucket, vector=probe.vector, answer=answer, created_at=time.time(), cost_seconds=cost_seconds)
+        self._lru[entry_id] = probe.bucket
+        while len(self._lru) > self.max_entries:
+            self._remove(next(iter(self._lru)))
+
+    def clear(self) -> None:
+        self._lru.clear()
+        self._buckets.clear()
+
+
+def record_bypass(reason: str) -> None:
+    CACHE_BYPASSED.inc(reason=reason)
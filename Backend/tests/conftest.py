@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# Backend.database builds its engines at import time; give it a throwaway SQLite file
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
+# No Redis in the test run; the per-process OTP store has to be asked for explicitly
+os.environ.setdefault("OTP_STORE", "memory")
+# Access tokens need a signing key
+os.environ.setdefault("SECRET_KEY", "test-secret-key-that-is-long-enough-for-hs256")
@@ -0,0 +1,99 @@
+import fakeredis
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from Backend import bloom, database
+from Backend.bloom import RegisteredUsers
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'users.db'}")
+    database.Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def sign_up(session_factory, worker: RegisteredUsers, n: int) -> database.User:
+    """What /signup does on one worker: commit the user, then add it to that worker's filters."""
+    with session_factory() as db:
+        user = database.User(first_name=f"User{n}", mobile_no=f"90000000{n:02d}", username=f"user{n}",
+                             email=f"user{n}@example.com", hashed_password="x")
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+    worker.add(user.email, user.mobile_no)
+    return user
+
+
+def test_memory_filters_learn_other_workers_signups_on_refresh(session_factory):
+    existing = sign_up(session_factory, RegisteredUsers(capacity=1000), 1)
+    worker_a, worker_b = RegisteredUsers(capacity=1000), RegisteredUsers(capacity=1000)
+    worker_a.rebuild(session_factory)
+    worker_b.rebuild(session_factory)
+    assert worker_b.might_contain("email", existing.email)
+
+    user = sign_up(session_factory, worker_a, 2)
+    assert worker_a.might_contain("email", user.email)
+    assert not worker_b.might_contain("email", user.email)  # not seen by this process yet
+
+    worker_b.refresh(session_factory)
+    assert worker_b.might_contain("email", user.email)
+    assert worker_b.might_contain("mobile_no", user.mobile_no)
+
+
+def test_refresh_picks_up_ids_that_commit_out_of_order(session_factory):
+    worker = RegisteredUsers(capacity=1000)
+    worker.rebuild(session_factory)
+
+    def insert(user_id: int) -> database.User:
+        with session_factory() as db:
+            user = database.User(id=user_id, first_name="U", mobile_no=f"91000000{user_id:02d}",
+                                 username=f"late{user_id}", email=f"late{user_id}@example.com", hashed_password="x")
+            db.add(user)
+            db.commit()
+            db.refresh(user)
+            return user
+
+    later = insert(11)  # id 11 commits and is seen first
+    worker.refresh(session_factory)
+    earlier = insert(10)  # then the transaction holding id 10 commits
+    worker.refresh(session_factory)
+
+    assert worker.might_contain("email", later.email)
+    assert worker.might_contain("email", earlier.email)
+
+
+def test_refresh_builds_filters_that_are_not_ready(session_factory):
+    user = sign_up(session_factory, RegisteredUsers(capacity=1000), 1)
+    worker = RegisteredUsers(capacity=1000)
+    assert worker.might_contain("email", "anyone@example.com")  # not built: everything goes to the DB
+
+    worker.refresh(session_factory)
+    assert worker.might_contain("email", user.email)
+    assert not worker.might_contain("email", "anyone@example.com")
+
+
+def test_redis_filters_are_shared_between_workers(session_factory):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    worker_a = RegisteredUsers(capacity=1000, redis_client=client)
+    worker_b = RegisteredUsers(capacity=1000, redis_client=client)
+    worker_a.rebuild(session_factory)
+    worker_b.rebuild(session_factory)  # loads the bitmaps worker_a stored
+
+    user = sign_up(session_factory, worker_a, 1)
+    assert worker_b.might_contain("email", user.email)
+    assert worker_b.might_contain("mobile_no", user.mobile_no)
+
+
+def test_redis_is_the_default_backend_when_configured(monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(bloom, "get_redis", lambda: client)
+    monkeypatch.delenv("BLOOM_BACKEND", raising=False)
+
+    monkeypatch.setenv("REDIS_URL", "redis://localhost:6379/0")
+    assert bloom._create_registered_users().redis is client
+
+    monkeypatch.delenv("REDIS_URL")
+    assert bloom._create_registered_users().redis is None
@@ -0,0 +1,61 @@
+import fakeredis
+import pytest
+
+from Backend.chat_history import MemoryHistoryBuffer, RedisHistoryBuffer
+
+
+def turn(n: int) -> list:
+    return [{"sender": "user", "message": f"question {n}"}, {"sender": "bot", "message": f"answer {n}"}]
+
+
+@pytest.fixture
+def buffer():
+    return RedisHistoryBuffer(fakeredis.FakeRedis(decode_responses=True), maxlen=6)
+
+
+def test_append_extends_a_seeded_list_and_trims_it(buffer):
+    buffer.seed("s", turn(1), version=2)
+    buffer.append("s", turn(2), version=4)
+    buffer.append("s", turn(3), version=6)
+    buffer.append("s", turn(4), version=8)
+
+    assert buffer.get("s") == turn(2) + turn(3) + turn(4)
+
+
+def test_seed_read_before_another_workers_commit_is_dropped(buffer):
+    # Worker A reads the DB tail (up to message 2), then worker B commits messages 3-4
+    # while the list is not cached, and only then does A seed what it read
+    buffer.append("s", turn(2), version=4)
+    buffer.seed("s", turn(1), version=2)
+
+    assert buffer.get("s") is None  # the next read reloads from the DB
+    buffer.seed("s", turn(1) + turn(2), version=4)
+    assert buffer.get("s") == turn(1) + turn(2)
+
+
+def test_seed_never_replaces_a_cached_list(buffer):
+    buffer.seed("s", turn(1), version=2)
+    buffer.append("s", turn(2), version=4)
+    buffer.seed("s", turn(1), version=2)
+
+    assert buffer.get("s") == turn(1) + turn(2)
+
+
+def test_out_of_order_append_drops_the_list(buffer):
+    buffer.seed("s", turn(1), version=2)
+    buffer.append("s", turn(3), version=6)
+    buffer.append("s", turn(2), version=4)
+
+    assert buffer.get("s") is None
+    buffer.seed("s", turn(1) + turn(2) + turn(3), version=6)
+    assert buffer.get("s") == turn(1) + turn(2) + turn(3)
+
+
+def test_memory_entry_is_dropped_when_the_version_moves_on():
+    buffer = MemoryHistoryBuffer(maxlen=6)
+    buffer.seed("s", turn(1), version=2)
+    buffer.append("s", turn(2), version=4)
+    assert buffer.get("s", version=4) == turn(1) + turn(2)
+
+    # Another worker saved message 6
+    assert buffer.get("s", version=6) is None
@@ -0,0 +1,170 @@
+import threading
+import time
+
+import fakeredis
+import pytest
+
+from Backend import email_queue as email_queue_module
+from Backend.email_queue import EmailQueue, MemoryJobBackend, RedisJobBackend
+from Backend.email_utils import LocalTransport, PermanentDeliveryError
+
+
+def wait_for(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out waiting for the email queue")
+        time.sleep(0.01)
+
+
+class RecordingBackend(MemoryJobBackend):
+    """Remembers the delay of every push, so the backoff schedule can be checked."""
+
+    def __init__(self):
+        super().__init__()
+        self.delays = []
+
+    def push(self, job, delay=0.0):
+        self.delays.append(delay)
+        super().push(job, delay)
+
+
+class SlowTransport(LocalTransport):
+    """Holds each send open for a while and tracks how many overlap."""
+
+    def __init__(self, seconds: float):
+        super().__init__()
+        self.seconds = seconds
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._count_lock = threading.Lock()
+
+    def send(self, message):
+        with self._count_lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.seconds)
+            super().send(message)
+        finally:
+            with self._count_lock:
+                self.in_flight -= 1
+
+
+@pytest.fixture
+def make_queue():
+    queues = []
+
+    def make(transport, backend=None, **kwargs):
+        queue = EmailQueue(backend or MemoryJobBackend(), transport, **kwargs)
+        queues.append(queue)
+        queue.start()
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.stop()
+
+
+def otp_job(queue) -> str:
+    return queue.enqueue("otp", to_email="a@example.com", first_name="A", otp_code="123456")
+
+
+def test_retries_with_exponential_backoff_until_sent(make_queue, monkeypatch):
+    monkeypatch.setattr(email_queue_module.random, "uniform", lambda low, high: high)  # no jitter
+    backend = RecordingBackend()
+    transport = LocalTransport(fail_first=3)
+    queue = make_queue(transport, backend, max_attempts=5, retry_base=0.02, retry_max=0.05)
+
+    job_id = otp_job(queue)
+    wait_for(lambda: queue.status(job_id)["status"] == "sent")
+
+    status = queue.status(job_id)
+    assert status["attempts"] == 4
+    assert len(transport.outbox) == 1
+    # The enqueue, then one push per retry: base * 2**(attempt - 1), capped at retry_max
+    assert backend.delays == [0.0, 0.02, 0.04, 0.05]
+
+
+def test_gives_up_after_max_attempts(make_queue):
+    transport = LocalTransport(fail_first=100)
+    queue = make_queue(transport, max_attempts=3, retry_base=0.01, retry_max=0.01)
+
+    job_id = otp_job(queue)
+    wait_for(lambda: queue.status(job_id)["status"] == "failed")
+
+    status = queue.status(job_id)
+    assert status["attempts"] == 3
+    assert "simulated failure 3" in status["last_error"]
+    assert transport.attempts == 3
+    assert transport.outbox == []
+
+
+def test_concurrency_cap_limits_parallel_sends(make_queue):
+    transport = SlowTransport(seconds=0.1)
+    backend = MemoryJobBackend()
+    queue = make_queue(transport, backend, concurrency=2)
+
+    job_ids = [otp_job(queue) for _ in range(6)]
+    # Jobs beyond the cap wait in the backend rather than in the executor
+    wait_for(lambda: transport.in_flight == 2)
+    assert backend.pending() >= 3
+    wait_for(lambda: all(queue.status(job_id)["status"] == "sent" for job_id in job_ids))
+
+    assert transport.max_in_flight == 2
+    assert len(transport.outbox) == 6
+
+
+class RejectingTransport(LocalTransport):
+    """Rejects every message the way Brevo answers an invalid recipient."""
+
+    def send(self, message):
+        with self._lock:
+            self.attempts += 1
+        raise PermanentDeliveryError("(400) invalid recipient")
+
+
+def test_permanent_errors_are_not_retried(make_queue):
+    transport = RejectingTransport()
+    queue = make_queue(transport, max_attempts=5, retry_base=0.01, retry_max=0.01)
+
+    job_id = otp_job(queue)
+    wait_for(lambda: queue.status(job_id)["status"] == "failed")
+
+    assert queue.status(job_id)["attempts"] == 1
+    assert transport.attempts == 1
+
+
+def test_redis_keeps_arguments_apart_and_deletes_them_once_sent():
+    client = fakeredis.FakeRedis(decode_responses=True)
+    backend = RedisJobBackend(client, payload_ttl=60)
+    transport = LocalTransport(fail_first=1)
+
+    queue = EmailQueue(backend, transport, retry_base=0.01, retry_max=0.01)
+    job_id = otp_job(queue)
+    assert "123456" not in client.lindex(RedisJobBackend.READY_KEY, 0)
+    assert 0 < client.ttl(f"email:payload:{job_id}") <= 60
+
+    queue.start()
+    try:
+        wait_for(lambda: queue.status(job_id)["status"] == "sent")
+    finally:
+        queue.stop()
+    assert "123456" in transport.outbox[0].html_content
+    assert not client.exists(f"email:payload:{job_id}")
+
+
+def test_jobs_whose_arguments_expired_fail_without_sending():
+    client = fakeredis.FakeRedis(decode_responses=True)
+    transport = LocalTransport()
+    queue = EmailQueue(RedisJobBackend(client), transport)
+    job_id = otp_job(queue)
+    client.delete(f"email:payload:{job_id}")  # as if the TTL ran out
+
+    queue.start()
+    try:
+        wait_for(lambda: queue.status(job_id)["status"] == "failed")
+    finally:
+        queue.stop()
+    assert queue.status(job_id)["last_error"] == "message arguments expired"
+    assert transport.attempts == 0
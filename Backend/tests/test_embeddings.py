@@ -0,0 +1,42 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from Backend.embeddings import _INDEX_RECORD, _DiskCache
+
+
+def digests(n: int) -> list:
+    return [hashlib.sha256(f"text {i}".encode()).digest() for i in range(n)]
+
+
+def test_reader_opened_before_any_write_sees_later_writes(tmp_path):
+    reader = _DiskCache(str(tmp_path), "model")
+    writer = _DiskCache(str(tmp_path), "model")
+    keys = digests(3000)
+    vectors = np.random.rand(3000, 4).astype(np.float32)
+    for start in range(0, 3000, 100):  # grows the table several times
+        writer.put(keys[start:start + 100], vectors[start:start + 100].tolist())
+
+    assert all(np.allclose(reader.get(key), vector) for key, vector in zip(keys, vectors))
+    assert reader.get(hashlib.sha256(b"never embedded").digest()) is None
+
+
+def test_entries_from_the_old_index_log_are_kept(tmp_path):
+    cache = _DiskCache(str(tmp_path), "model")
+    keys = digests(11)
+    vectors = np.random.rand(11, 4).astype(np.float32)
+    with open(os.path.join(cache.path, "meta.json"), "w") as f:
+        json.dump({"model": "model", "dim": 4}, f)
+    vectors[:10].tofile(os.path.join(cache.path, "vectors.f32"))
+    log = np.empty(10, dtype=_INDEX_RECORD)
+    log["digest"] = np.frombuffer(b"".join(keys[:10]), dtype=np.uint8).reshape(-1, 32)
+    log["row"] = np.arange(10)
+    log.tofile(os.path.join(cache.path, "index.bin"))
+
+    cache = _DiskCache(str(tmp_path), "model")
+    cache.put(keys[10:], vectors[10:].tolist())
+
+    assert all(np.allclose(cache.get(key), vector) for key, vector in zip(keys, vectors))
+    assert not os.path.exists(os.path.join(cache.path, "index.bin"))
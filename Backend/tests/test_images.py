@@ -0,0 +1,33 @@
+import io
+
+import pytest
+from PIL import Image
+
+from Backend.images import ImageStore
+from Backend.uploads import CheckedUpload, LocalStorage
+
+
+def png_upload() -> CheckedUpload:
+    buffer = io.BytesIO()
+    Image.new("RGB", (300, 200), "teal").save(buffer, format="PNG")
+    buffer.seek(0)
+    return CheckedUpload(buffer)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ImageStore(LocalStorage(str(tmp_path), url_prefix="/uploads"), sizes=(64, 256), workers=1)
+    yield store
+    store.shutdown()
+
+
+def test_returns_the_original_and_renders_the_variant_in_the_background(store, tmp_path):
+    url, variant_ready = store.ingest(png_upload(), size=256)
+
+    assert url.endswith(".png")
+    variant_url = variant_ready.result(timeout=60)
+    assert variant_url.endswith("_256.webp")
+    assert (tmp_path / variant_url.removeprefix("/uploads/")).exists()
+
+    # The same picture again is served from the stored variant straight away
+    assert store.ingest(png_upload(), size=256) == (variant_url, None)
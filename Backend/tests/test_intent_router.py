@@ -0,0 +1,45 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from Backend.intent_router import ROUTE_AGENT, ROUTE_RECOMMEND, ROUTE_SMALL_TALK, classify
+
+
+def history(ai_reply: str) -> list:
+    return [HumanMessage(content="hi"), AIMessage(content=ai_reply)]
+
+
+CLOSED = history("Hello! Enjoy your evening.")
+QUESTION = history("Here are three comedies. Want some more recommendations?")
+OFFER = history("Those are my picks. Let me know if you'd like something darker.")
+
+
+@pytest.mark.parametrize("message, chat_history, route", [
+    # Greetings, thanks and acknowledgements
+    ("hi", None, ROUTE_SMALL_TALK),
+    ("Hey there!", None, ROUTE_SMALL_TALK),
+    ("thanks so much", CLOSED, ROUTE_SMALL_TALK),
+    ("cool", CLOSED, ROUTE_SMALL_TALK),
+    ("how are you doing?", None, ROUTE_SMALL_TALK),
+    ("", None, ROUTE_SMALL_TALK),
+    # Answers whose meaning depends on what was asked
+    ("yes", None, ROUTE_AGENT),
+    ("yes", QUESTION, ROUTE_AGENT),
+    ("nope", QUESTION, ROUTE_AGENT),
+    ("sure", OFFER, ROUTE_AGENT),
+    ("ok", CLOSED, ROUTE_AGENT),
+    ("cool", QUESTION, ROUTE_AGENT),
+    ("thanks", OFFER, ROUTE_AGENT),
+    # Mood statements are a cue for recommendations
+    ("I'm feeling sad tonight", None, ROUTE_AGENT),
+    ("i had a rough day", CLOSED, ROUTE_AGENT),
+    # Self-contained recommendation requests
+    ("suggest a feel-good comedy", None, ROUTE_RECOMMEND),
+    ("what should I watch tonight, something funny", None, ROUTE_RECOMMEND),
+    # Fresh facts, links and follow-ups
+    ("recommend the latest horror movies", None, ROUTE_AGENT),
+    ("where can I watch Inception?", None, ROUTE_AGENT),
+    ("recommend more movies like that", QUESTION, ROUTE_AGENT),
+    ("tell me about the plot of Heat", None, ROUTE_AGENT),
+])
+def test_classify(message, chat_history, route):
+    assert classify(message, chat_history) == route
@@ -0,0 +1,34 @@
+import time
+
+from Backend import security
+
+
+def login(user_id: int = 1) -> str:
+    return security.create_access_token(user_id=user_id, username="a", email="a@example.com")
+
+
+def test_revoking_a_user_rejects_tokens_from_the_same_second(monkeypatch):
+    second = float(int(time.time()))
+    clock = [second + 0.25]
+    monkeypatch.setattr(security.time, "time", lambda: clock[0])
+    before = login()
+    other_user = login(user_id=2)
+    assert security.verify_access_token(before) is not None
+
+    clock[0] = second + 0.5  # password reset, within the same second
+    security.revoke_user_tokens(1)
+    clock[0] = second + 0.75  # logging in again right after
+    after = login()
+
+    assert security.verify_access_token(before) is None
+    assert security.verify_access_token(after) is not None
+    assert security.verify_access_token(other_user) is not None
+
+
+def test_logout_revokes_only_that_token():
+    first, second = login(user_id=3), login(user_id=3)
+
+    security.revoke_access_token(first)
+
+    assert security.verify_access_token(first) is None
+    assert security.verify_access_token(second) is not None
@@ -0,0 +1,101 @@
+import io
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from Backend.uploads import (S3_MULTIPART_THRESHOLD, UPLOAD_MAX_BYTES, CheckedUpload, LocalStorage, S3Storage,
+                             UnsupportedUploadType, UploadRejected, UploadTooLarge)
+
+MIB = 1024 * 1024
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+BUCKET = "cineverse-test"
+REGION = "us-east-1"
+
+
+def png(size: int) -> bytes:
+    return PNG_HEADER + os.urandom(size - len(PNG_HEADER))
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        client = boto3.client("s3", region_name=REGION)
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def test_default_multipart_threshold_is_below_the_upload_cap():
+    assert S3_MULTIPART_THRESHOLD < UPLOAD_MAX_BYTES
+
+
+def test_rejects_unsupported_type_with_415():
+    with pytest.raises(UnsupportedUploadType) as excinfo:
+        CheckedUpload(io.BytesIO(b"%PDF-1.7 not an image"))
+    assert excinfo.value.status_code == 415
+
+
+def test_rejects_empty_upload_with_400():
+    with pytest.raises(UploadRejected) as excinfo:
+        CheckedUpload(io.BytesIO(b""))
+    assert excinfo.value.status_code == 400
+
+
+def test_rejects_oversized_upload_with_413_and_leaves_no_file(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    upload = CheckedUpload(io.BytesIO(png(3 * MIB)), max_bytes=2 * MIB, chunk_size=MIB)
+    assert upload.content_type == "image/png"
+
+    with pytest.raises(UploadTooLarge) as excinfo:
+        storage.put("avatars/big.png", upload.chunks(), upload.content_type)
+    assert excinfo.value.status_code == 413
+    assert not storage.exists("avatars/big.png")
+    assert os.listdir(tmp_path / "avatars") == []
+
+
+def test_local_storage_round_trip(tmp_path):
+    data = png(MIB + 123)
+    storage = LocalStorage(str(tmp_path))
+    upload = CheckedUpload(io.BytesIO(data), chunk_size=64 * 1024)
+
+    url = storage.put("avatars/a.png", upload.chunks(), upload.content_type)
+    assert url == "/uploads/avatars/a.png"
+    assert (tmp_path / "avatars" / "a.png").read_bytes() == data
+    assert upload.size == len(data)
+
+
+def test_s3_small_upload_uses_a_single_put(s3):
+    data = png(MIB)
+    storage = S3Storage(BUCKET, REGION, multipart_threshold=4 * MIB)
+    upload = CheckedUpload(io.BytesIO(data), chunk_size=256 * 1024)
+
+    storage.put("small.png", upload.chunks(), upload.content_type)
+    obj = s3.get_object(Bucket=BUCKET, Key="small.png")
+    assert obj["Body"].read() == data
+    assert "-" not in obj["ETag"]
+
+
+def test_s3_multipart_round_trip(s3):
+    data = png(11 * MIB)
+    storage = S3Storage(BUCKET, REGION, multipart_threshold=4 * MIB, part_bytes=5 * MIB)
+    upload = CheckedUpload(io.BytesIO(data), max_bytes=12 * MIB)
+
+    assert storage.put("big.png", upload.chunks(), upload.content_type).endswith("/big.png")
+    obj = s3.get_object(Bucket=BUCKET, Key="big.png")
+    assert obj["Body"].read() == data
+    assert obj["ETag"].strip('"').endswith("-3")  # 5 + 5 + 1 MiB parts
+    assert obj["ContentType"] == "image/png"
+    assert storage.exists("big.png")
+
+
+def test_s3_multipart_is_aborted_when_the_cap_is_hit(s3):
+    storage = S3Storage(BUCKET, REGION, multipart_threshold=MIB, part_bytes=5 * MIB)
+    upload = CheckedUpload(io.BytesIO(png(7 * MIB)), max_bytes=6 * MIB)
+
+    with pytest.raises(UploadTooLarge):
+        storage.put("too-big.png", upload.chunks(), upload.content_type)
+    assert not storage.exists("too-big.png")
+    assert s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads", []) == []
@@ -0,0 +1,180 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from Backend.web_scraper import HttpCache, WebScraper
+
+LOOPBACK = ["127.0.0.0/8"]  # the test site; real scrapers refuse it
+
+ARTICLE = "<html><head><title>Review</title></head><body><nav>Home | Films</nav>" \
+          "<article><p>A quiet, patient film about memory.</p></article></body></html>"
+
+
+class SiteState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []  # (path, If-None-Match) per request
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+
+def make_handler(state: SiteState):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send_body(self, body: bytes, headers=None):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            with state.lock:
+                state.requests.append((self.path, self.headers.get("If-None-Match")))
+                state.in_flight += 1
+                state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            try:
+                if self.path == "/etag":
+                    if self.headers.get("If-None-Match") == '"v1"':
+                        self.send_response(304)
+                        self.send_header("ETag", '"v1"')
+                        self.end_headers()
+                    else:
+                        self.send_body(ARTICLE.encode(), {"ETag": '"v1"', "Cache-Control": "no-cache"})
+                elif self.path.startswith("/slow"):
+                    time.sleep(0.2)
+                    self.send_body(ARTICLE.encode())
+                elif self.path == "/metadata":
+                    self.send_response(302)
+                    self.send_header("Location", "http://169.254.169.254/latest/meta-data/")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                elif self.path == "/long":
+                    paragraphs = "".join(f"<p>Sentence number {i} about the film. </p>" for i in range(500))
+                    self.send_body(f"<html><body><article>{paragraphs}</article></body></html>".encode())
+                else:
+                    self.send_error(404)
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+    return Handler
+
+
+@pytest.fixture
+def site():
+    state = SiteState()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(state))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    state.base = f"http://127.0.0.1:{server.server_address[1]}"
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def run(scraper: WebScraper, *urls: str) -> list:
+    async def main():
+        try:
+            return await asyncio.gather(*(scraper.scrape(url) for url in urls))
+        finally:
+            await scraper.aclose()
+    return asyncio.run(main())
+
+
+def test_revalidates_with_etag_and_reuses_body_on_304(site, tmp_path):
+    scraper = WebScraper(cache=HttpCache(str(tmp_path)), allowed_networks=LOOPBACK)
+
+    first, = run(scraper, f"{site.base}/etag")
+    second, = run(scraper, f"{site.base}/etag")
+
+    assert site.requests == [("/etag", None), ("/etag", '"v1"')]
+    assert second == first
+    assert "A quiet, patient film about memory." in first
+    assert "Home | Films" not in first
+
+
+def test_per_host_limit_caps_concurrent_requests(site):
+    scraper = WebScraper(per_host_limit=2, allowed_networks=LOOPBACK)
+
+    results = run(scraper, *(f"{site.base}/slow?page={i}" for i in range(5)))
+
+    assert all("Title: Review" in result for result in results)
+    assert len(site.requests) == 5
+    assert site.max_in_flight == 2
+
+
+def test_host_limits_are_capped_and_keep_busy_hosts():
+    scraper = WebScraper(max_hosts=2)
+
+    async def main():
+        async with scraper._host_limit("a.example"):
+            for host in ("b.example", "c.example", "d.example"):
+                async with scraper._host_limit(host):
+                    pass
+            return list(scraper._hosts)
+
+    assert asyncio.run(main()) == ["a.example", "d.example"]
+
+
+def test_truncates_long_pages_to_the_token_budget(site):
+    scraper = WebScraper(token_budget=100, allowed_networks=LOOPBACK)
+
+    result, = run(scraper, f"{site.base}/long")
+
+    body = result.split("\n\n", 1)[1]
+    assert body.endswith("\n[truncated]")
+    assert len(body) <= 100 * 4 + len("\n[truncated]")
+    assert body[:-len("\n[truncated]")].endswith("about the film.")
+
+
+def test_stops_reading_at_max_bytes(site):
+    scraper = WebScraper(max_bytes=1024, token_budget=10_000, allowed_networks=LOOPBACK)
+
+    result, = run(scraper, f"{site.base}/long")
+
+    assert "Sentence number 0 " in result
+    assert "Sentence number 499" not in result
+
+
+def test_unexpected_errors_come_back_as_text(site, tmp_path):
+    class BrokenCache(HttpCache):
+        def put(self, page):
+            raise OSError("disk full")
+
+    scraper = WebScraper(cache=BrokenCache(str(tmp_path)), allowed_networks=LOOPBACK)
+
+    result, = run(scraper, f"{site.base}/etag")
+
+    assert result == "Error scraping website: disk full"
+
+
+def test_refuses_internal_addresses_by_default(site):
+    results = run(WebScraper(), f"{site.base}/etag", "http://169.254.169.254/latest/meta-data/", "http://[::1]/")
+
+    assert all(result.startswith("Error scraping website: refusing to fetch") for result in results)
+    assert site.requests == []
+
+
+def test_refuses_redirects_to_internal_addresses(site):
+    result, = run(WebScraper(allowed_networks=LOOPBACK), f"{site.base}/metadata")
+
+    assert result.startswith("Error scraping website: refusing to fetch 169.254.169.254")
+    assert site.requests == [("/metadata", None)]
+
+
+def test_cache_directory_is_created_on_first_write(site, tmp_path):
+    root = tmp_path / "cache"
+    scraper = WebScraper(cache=HttpCache(str(root)), allowed_networks=LOOPBACK)
+    assert not root.exists()
+
+    run(scraper, f"{site.base}/etag")
+
+    assert len(list(root.glob("*.json"))) == 1
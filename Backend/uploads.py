@@ -0,0 +1,225 @@
+# backend/uploads.py
+"""Profile picture uploads: validation and storage.
+
+Uploads are read in UPLOAD_CHUNK_BYTES chunks, so memory use does not grow
+with the file size (Starlette has already spooled large request bodies to a
+temp file). The first chunk decides the content type from its magic bytes,
+whatever the client claimed, and the copy stops with ``UploadTooLarge`` as
+soon as UPLOAD_MAX_BYTES is exceeded.
+
+Storage is S3 when AWS_S3_BUCKET and AWS_S3_REGION are set, otherwise the
+local uploads directory; both write objects from an iterator of chunks. The
+S3 client is created once per process and reused; its connection pool is
+sized by AWS_S3_MAX_CONNECTIONS. Objects above S3_MULTIPART_THRESHOLD go up
+as a multipart upload in S3_PART_BYTES parts, so the threshold has to stay
+below UPLOAD_MAX_BYTES for that path to be used. AWS_S3_ENDPOINT_URL points
+the client at an S3-compatible stand-in such as MinIO.
+"""
+import os
+import tempfile
+import threading
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(5 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# S3 parts must be at least 5 MiB (except the last one)
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(4 * 1024 * 1024)))
+S3_PART_BYTES = max(5 * 1024 * 1024, int(os.getenv("S3_PART_BYTES", str(5 * 1024 * 1024))))
+
+# (magic prefix, offset, content type, extension)
+_SIGNATURES = (
+    (b"\xff\xd8\xff", 0, "image/jpeg", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", 0, "image/png", "png"),
+    (b"GIF87a", 0, "image/gif", "gif"),
+    (b"GIF89a", 0, "image/gif", "gif"),
+    (b"WEBP", 8, "image/webp", "webp"),
+)
+
+
+class UploadRejected(Exception):
+    status_code = 400
+
+    def __init__(self, detail: str):
+        super().__init__(detail)
+        self.detail = detail
+
+
+class UploadTooLarge(UploadRejected):
+    status_code = 413
+
+
+class UnsupportedUploadType(UploadRejected):
+    status_code = 415
+
+
+def sniff_image_type(head: bytes) -> Optional[tuple]:
+    """``(content_type, extension)`` from the file's magic bytes, or None."""
+    for magic, offset, content_type, ext in _SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            if content_type == "image/webp" and not head.startswith(b"RIFF"):
+                continue
+            return content_type, ext
+    return None
+
+
+class CheckedUpload:
+    """Wraps an upload stream: sniffs its type up front and enforces the size cap while reading."""
+
+    def __init__(self, fileobj: BinaryIO, max_bytes: int = UPLOAD_MAX_BYTES, chunk_size: int = UPLOAD_CHUNK_BYTES):
+        self.fileobj = fileobj
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.size = 0
+        self._head = fileobj.read(chunk_size)
+        if not self._head:
+            raise UploadRejected("The uploaded file is empty.")
+        kind = sniff_image_type(self._head)
+        if kind is None:
+            raise UnsupportedUploadType("Only JPEG, PNG, GIF and WebP images are supported.")
+        self.content_type, self.extension = kind
+
+    def chunks(self) -> Iterator[bytes]:
+        chunk, self._head = self._head, None
+        while chunk:
+            self.size += len(chunk)
+            if self.size > self.max_bytes:
+                raise UploadTooLarge(f"Images must be at most {self.max_bytes // (1024 * 1024)} MB.")
+            yield chunk
+            chunk = self.fileobj.read(self.chunk_size)
+
+
+# --- Storage backends ---
+# Both backends take an iterator of byte chunks, so callers never hold a whole
+# file in memory. Stored objects are written once and never modified.
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def iter_file(path: str, chunk_size: int = UPLOAD_CHUNK_BYTES) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class LocalStorage:
+    def __init__(self, root: str, url_prefix: str = "/uploads"):
+        self.root = root
+        self.url_prefix = url_prefix
+        os.makedirs(root, exist_ok=True)
+
+    def url(self, key: str) -> str:
+        return f"{self.url_prefix}/{key}"
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.root, key))
+
+    def put(self, key: str, chunks: Iterable[bytes], content_type: str) -> str:
+        dest_path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp_path, dest_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return self.url(key)
+
+
+class S3Storage:
+    def __init__(self, bucket: str, region: str, endpoint_url: Optional[str] = None,
+                 multipart_threshold: int = S3_MULTIPART_THRESHOLD, part_bytes: int = S3_PART_BYTES):
+        self.bucket = bucket
+        self.region = region
+        self.endpoint_url = endpoint_url
+        self.multipart_threshold = multipart_threshold
+        self.part_bytes = part_bytes
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # boto3 clients are thread-safe; one per process keeps its connection pool warm
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = boto3.client(
+                        "s3",
+                        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+                        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+                        region_name=self.region,
+                        endpoint_url=self.endpoint_url,
+                        config=Config(max_pool_connections=int(os.getenv("AWS_S3_MAX_CONNECTIONS", "20"))),
+                    )
+        return self._client
+
+    def url(self, key: str) -> str:
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{self.bucket}/{key}"
+        return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{key}"
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def put(self, key: str, chunks: Iterable[bytes], content_type: str) -> str:
+        extra = {"ACL": "public-read", "ContentType": content_type, "CacheControl": IMMUTABLE_CACHE_CONTROL}
+        chunks = iter(chunks)
+        buffer = bytearray()
+        for chunk in chunks:
+            buffer += chunk
+            if len(buffer) >= self.multipart_threshold:
+                self._put_multipart(key, buffer, chunks, extra)
+                return self.url(key)
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=bytes(buffer), **extra)
+        return self.url(key)
+
+    def _put_multipart(self, key: str, buffer: bytearray, chunks: Iterator[bytes], extra: dict) -> None:
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key, **extra)["UploadId"]
+        parts = []
+
+        def send(data: bytes) -> None:
+            number = len(parts) + 1
+            etag = self.client.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data)["ETag"]
+            parts.append({"ETag": etag, "PartNumber": number})
+
+        try:
+            for chunk in chunks:
+                buffer += chunk
+                while len(buffer) >= self.part_bytes:
+                    send(bytes(buffer[:self.part_bytes]))
+                    del buffer[:self.part_bytes]
+            if buffer:
+                send(bytes(buffer))
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            )
+        except BaseException:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+
+
+def build_storage(upload_dir: str):
+    bucket = os.getenv("AWS_S3_BUCKET")
+    region = os.getenv("AWS_S3_REGION")
+    if bucket and region:
+        if S3_MULTIPART_THRESHOLD >= UPLOAD_MAX_BYTES:
+            print(f"S3_MULTIPART_THRESHOLD ({S3_MULTIPART_THRESHOLD} bytes) is not below UPLOAD_MAX_BYTES "
+                  f"({UPLOAD_MAX_BYTES} bytes); uploads will never use multipart.")
+        return S3Storage(bucket, region, endpoint_url=os.getenv("AWS_S3_ENDPOINT_URL") or None)
+    return LocalStorage(upload_dir)
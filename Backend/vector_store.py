@@ -0,0 +1,479 @@
+# backend/vector_store.py
+"""Vector store backends for the movie retriever.
+
+The backend is picked with the VECTOR_STORE_BACKEND environment variable:
+
+* ``pinecone`` (default) - the hosted Pinecone index used in production.
+* ``numpy``  - an in-process index stored on disk as a memory-mapped float32
+  matrix plus a JSON-lines sidecar holding the documents. Searches are exact
+  top-k over vectorized dot products, and because the files are mapped
+  read-only, every uvicorn worker shares one copy through the page cache.
+* ``ivf``    - an approximate index built from the numpy one at ingest time:
+  vectors are partitioned with k-means and stored as int8 residuals against
+  their centroid, and a query only scans the VECTOR_STORE_NPROBE closest
+  partitions. Resident memory is roughly a quarter of the float32 matrix.
+
+The flat files are append-only. Deleting or replacing a document records its
+row in ``deleted.i64`` and searches skip those rows; ``compact_flat_index``
+rewrites the files without them once enough have piled up.
+"""
+import asyncio
+import json
+import mmap
+import os
+import shutil
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INDEX_DIR = os.path.join(BACKEND_DIR, "vector_index")
+
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.f32"
+DOCS_FILE = "docs.jsonl"
+OFFSETS_FILE = "offsets.i64"
+DELETED_FILE = "deleted.i64"
+
+IVF_MANIFEST_FILE = "ivf.json"
+IVF_CENTROIDS_FILE = "ivf_centroids.f32"
+IVF_CODES_FILE = "ivf_codes.i8"
+IVF_SCALES_FILE = "ivf_scales.f32"
+IVF_ROWS_FILE = "ivf_rows.i64"
+IVF_LISTS_FILE = "ivf_lists.i64"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalizes rows so a dot product is a cosine similarity."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Returns the indices of the k highest scores, best first."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+# --- On-disk layout ---
+
+class FlatIndexWriter:
+    """Appends normalized vectors and their documents to an index directory.
+
+    Rows are written to ``vectors.f32`` (raw row-major float32), the documents
+    to ``docs.jsonl`` and the byte offset of each document line to
+    ``offsets.i64``, so readers can map all three files without parsing them.
+    Deleted row numbers are appended to ``deleted.i64``.
+    """
+
+    def __init__(self, path: str, dim: Optional[int] = None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                existing = json.load(f)
+            if dim is not None and existing["dim"] != dim:
+                raise ValueError(f"Index at {path} has dim {existing['dim']}, got {dim}")
+            dim = existing["dim"]
+        elif dim is None:
+            raise ValueError(f"No index at {path}; the first write needs a dim")
+        else:
+            with open(manifest_path, "w") as f:
+                json.dump({"format": "flat-v1", "dim": dim, "metric": "cosine"}, f)
+        self.dim = dim
+        self._vectors = open(os.path.join(path, VECTORS_FILE), "ab")
+        self._docs = open(os.path.join(path, DOCS_FILE), "ab")
+        self._offsets = open(os.path.join(path, OFFSETS_FILE), "ab")
+        self._deleted = open(os.path.join(path, DELETED_FILE), "ab")
+
+    @property
+    def count(self) -> int:
+        """Rows written so far, deleted ones included; the next row's number."""
+        return self._offsets.tell() // 8
+
+    def add(self, vectors, documents: List[Document], ids: List[str]) -> None:
+        vectors = _normalize(vectors)
+        if vectors.shape != (len(documents), self.dim):
+            raise ValueError(f"Expected vectors of shape ({len(documents)}, {self.dim}), got {vectors.shape}")
+        offsets = np.empty(len(documents), dtype=np.int64)
+        for i, (doc_id, doc) in enumerate(zip(ids, documents)):
+            offsets[i] = self._docs.tell()
+            line = json.dumps({"id": doc_id, "page_content": doc.page_content, "metadata": doc.metadata})
+            self._docs.write(line.encode("utf-8") + b"\n")
+        self._vectors.write(vectors.tobytes())
+        self._offsets.write(offsets.tobytes())
+
+    def delete_rows(self, rows: Iterable[int]) -> None:
+        self._deleted.write(np.asarray(list(rows), dtype=np.int64).tobytes())
+
+    def _files(self):
+        return ((DOCS_FILE, self._docs), (VECTORS_FILE, self._vectors), (OFFSETS_FILE, self._offsets), (DELETED_FILE, self._deleted))
+
+    def sync(self) -> dict:
+        """Flushes to disk and returns the file sizes, a consistent point to resume from."""
+        for _, f in self._files():
+            f.flush()
+            os.fsync(f.fileno())
+        return {name: f.tell() for name, f in self._files()}
+
+    @staticmethod
+    def truncate(path: str, sizes: dict) -> None:
+        """Drops anything written after the point ``sync`` returned (e.g. a half-written batch)."""
+        for name, size in sizes.items():
+            with open(os.path.join(path, name), "r+b") as f:
+                f.truncate(size)
+
+    def close(self) -> None:
+        self.sync()
+        for _, f in self._files():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _DocStore:
+    """Read-only, memory-mapped access to the documents of an index."""
+
+    def __init__(self, path: str):
+        offsets_path = os.path.join(path, OFFSETS_FILE)
+        count = os.path.getsize(offsets_path) // 8
+        self.offsets = np.memmap(offsets_path, dtype=np.int64, mode="r", shape=(count,)) if count else np.empty(0, dtype=np.int64)
+        self._file = open(os.path.join(path, DOCS_FILE), "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if count else None
+
+    def __len__(self) -> int:
+        return self.offsets.shape[0]
+
+    def get(self, row: int) -> Tuple[str, Document]:
+        start = int(self.offsets[row])
+        end = self._mm.find(b"\n", start)
+        record = json.loads(self._mm[start:end])
+        return record["id"], Document(page_content=record["page_content"], metadata=record["metadata"])
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+        self._file.close()
+
+
+def load_deleted(path: str, count: int) -> np.ndarray:
+    """Boolean mask of the deleted rows among the first ``count``."""
+    mask = np.zeros(count, dtype=bool)
+    deleted_path = os.path.join(path, DELETED_FILE)
+    if os.path.exists(deleted_path):
+        rows = np.fromfile(deleted_path, dtype=np.int64)
+        mask[rows[rows < count]] = True
+    return mask
+
+
+def live_row_ids(path: str) -> Dict[str, int]:
+    """Document id -> row for every row of a flat index that is not deleted."""
+    if not os.path.exists(os.path.join(path, OFFSETS_FILE)):
+        return {}
+    docs = _DocStore(path)
+    try:
+        deleted = load_deleted(path, len(docs))
+        rows = {}
+        for row in range(len(docs)):
+            if not deleted[row]:
+                start = int(docs.offsets[row])
+                rows[json.loads(docs._mm[start:docs._mm.find(b"\n", start)])["id"]] = row
+        return rows
+    finally:
+        docs.close()
+
+
+def compact_flat_index(path: str, chunk_size: int = 65536) -> int:
+    """Rewrites a flat index without its deleted rows; returns how many rows were dropped."""
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        dim = json.load(f)["dim"]
+    docs = _DocStore(path)
+    count = len(docs)
+    deleted = load_deleted(path, count)
+    if not deleted.any():
+        docs.close()
+        return 0
+    vectors = np.memmap(os.path.join(path, VECTORS_FILE), dtype=np.float32, mode="r", shape=(count, dim))
+    live = np.flatnonzero(~deleted)
+    tmp_path = f"{path}.compact"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    try:
+        with FlatIndexWriter(tmp_path, dim) as writer:
+            for start in range(0, live.shape[0], chunk_size):
+                rows = live[start:start + chunk_size]
+                records = [docs.get(int(row)) for row in rows]
+                writer.add(vectors[rows], [doc for _, doc in records], [doc_id for doc_id, _ in records])
+    finally:
+        docs.close()
+        del vectors
+    # Swap directories; anything else in the old one (e.g. IVF files) is rebuilt by the caller
+    old_path = f"{path}.old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path)
+    return int(deleted.sum())
+
+
+# --- Vector stores ---
+
+class NumpyVectorStore(VectorStore):
+    """Exact cosine-similarity search over a memory-mapped float32 matrix."""
+
+    def __init__(self, embedding: Embeddings, path: str = DEFAULT_INDEX_DIR):
+        self._embedding = embedding
+        self.path = path
+        self._load()
+
+    def _load(self) -> None:
+        with open(os.path.join(self.path, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        self.dim = self.manifest["dim"]
+        self._open_docs()
+        count = len(self.docs)
+        if count:
+            self._vectors = np.memmap(os.path.join(self.path, VECTORS_FILE), dtype=np.float32, mode="r", shape=(count, self.dim))
+        else:
+            self._vectors = np.empty((0, self.dim), dtype=np.float32)
+        deleted = load_deleted(self.path, count)
+        self._deleted_rows = np.flatnonzero(deleted)
+        self.count = count - self._deleted_rows.shape[0]
+
+    def _open_docs(self) -> None:
+        # Reloads after a write; release the previous file handle and mapping
+        previous = getattr(self, "docs", None)
+        self.docs = _DocStore(self.path)
+        if previous is not None:
+            previous.close()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, *, ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = self._embedding.embed_documents(texts)
+        documents = [Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas)]
+        with FlatIndexWriter(self.path, self.dim) as writer:
+            writer.add(vectors, documents, ids)
+        self._load()
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        rows = live_row_ids(self.path)
+        with FlatIndexWriter(self.path) as writer:
+            writer.delete_rows(rows[i] for i in ids or [] if i in rows)
+        self._load()
+        return True
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        query = _normalize(embedding)
+        scores = self._vectors @ query
+        scores[self._deleted_rows] = -np.inf
+        return [(self.docs.get(int(i))[1], float(scores[i])) for i in _top_k(scores, min(k, self.count))]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        # aembed_query lets a CoalescingEmbeddings batch concurrent queries
+        vector = await self._embedding.aembed_query(query)
+        return await asyncio.to_thread(self.similarity_search_by_vector_with_score, vector, k)
+
+    async def asimilarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in await self.asimilarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        # Cosine similarity in [-1, 1] -> relevance in [0, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, *, ids: Optional[List[str]] = None, path: str = DEFAULT_INDEX_DIR, **kwargs: Any) -> "NumpyVectorStore":
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = np.asarray(embedding.embed_documents(texts), dtype=np.float32)
+        documents = [Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas)]
+        with FlatIndexWriter(path, vectors.shape[1]) as writer:
+            writer.add(vectors, documents, ids)
+        return cls(embedding, path=path)
+
+
+# --- IVF / int8 index ---
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+    """Returns the closest (highest dot product) centroid for every row."""
+    out = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], chunk_size):
+        chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+        out[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+    return out
+
+
+def _train_centroids(vectors: np.ndarray, nlist: int, iterations: int, sample_size: int, seed: int,
+                     rows: Optional[np.ndarray] = None) -> np.ndarray:
+    """Spherical k-means over a random sample of the (normalized) vectors, or of ``rows`` of them.
+
+    Trains at most one centroid per sampled vector, so ``nlist`` is clamped to the sample size.
+    """
+    rng = np.random.default_rng(seed)
+    if rows is None:
+        rows = np.arange(vectors.shape[0])
+    n = rows.shape[0]
+    sample_idx = rows[np.sort(rng.choice(n, size=min(n, sample_size), replace=False))]
+    sample = np.asarray(vectors[sample_idx], dtype=np.float32)
+    nlist = min(nlist, sample.shape[0])
+    centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        empty = np.bincount(labels, minlength=nlist) == 0
+        # Re-seed empty partitions from random sample points
+        sums[empty] = sample[rng.choice(sample.shape[0], size=int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def build_ivf_index(path: str = DEFAULT_INDEX_DIR, nlist: Optional[int] = None, iterations: int = 20,
+                    sample_size: int = 200_000, chunk_size: int = 65536, seed: int = 0) -> dict:
+    """Builds the IVF/int8 files next to an existing flat index in ``path``.
+
+    Each vector is stored as ``centroid + scale * codes`` where ``codes`` is an
+    int8 vector and ``scale`` a per-row float32, grouped by partition so a
+    probe reads one contiguous slice.
+    """
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        dim = json.load(f)["dim"]
+    rows = os.path.getsize(os.path.join(path, OFFSETS_FILE)) // 8
+    live = np.flatnonzero(~load_deleted(path, rows))
+    count = live.shape[0]
+    if count == 0:
+        raise ValueError(f"Flat index at {path} is empty")
+    vectors = np.memmap(os.path.join(path, VECTORS_FILE), dtype=np.float32, mode="r", shape=(rows, dim))
+    nlist = min(nlist or max(1, int(4 * np.sqrt(count))), count, sample_size)
+
+    centroids = _train_centroids(vectors, nlist, iterations, sample_size, seed, rows=live)
+    nlist = centroids.shape[0]
+    # Deleted rows get a label too, but are left out of the lists
+    labels = _assign(vectors, centroids, chunk_size)
+    order = live[np.argsort(labels[live], kind="stable")]
+    lists = np.zeros(nlist + 1, dtype=np.int64)
+    lists[1:] = np.cumsum(np.bincount(labels[live], minlength=nlist))
+
+    with open(os.path.join(path, IVF_CODES_FILE), "wb") as codes_f, open(os.path.join(path, IVF_SCALES_FILE), "wb") as scales_f:
+        for start in range(0, count, chunk_size):
+            chunk_rows = order[start:start + chunk_size]
+            residuals = np.asarray(vectors[chunk_rows], dtype=np.float32) - centroids[labels[chunk_rows]]
+            scales = np.abs(residuals).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            codes = np.clip(np.rint(residuals / scales[:, None]), -127, 127).astype(np.int8)
+            codes_f.write(codes.tobytes())
+            scales_f.write(scales.astype(np.float32).tobytes())
+    centroids.astype(np.float32).tofile(os.path.join(path, IVF_CENTROIDS_FILE))
+    order.astype(np.int64).tofile(os.path.join(path, IVF_ROWS_FILE))
+    lists.tofile(os.path.join(path, IVF_LISTS_FILE))
+
+    manifest = {"format": "ivf-int8-v1", "dim": dim, "count": int(count), "nlist": int(nlist)}
+    with open(os.path.join(path, IVF_MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+class ReadOnlyIndexError(RuntimeError):
+    """Raised on writes to an index that is only ever rebuilt, never updated in place."""
+
+
+IVF_READ_ONLY_MESSAGE = ("The IVF index is read-only: it is rebuilt from the flat index by create_vectorstore.py "
+                         "(VECTOR_STORE_BACKEND=ivf), so change the catalogue and re-run it instead.")
+
+
+class IVFVectorStore(NumpyVectorStore):
+    """Approximate search over the int8 IVF files produced by build_ivf_index."""
+
+    def __init__(self, embedding: Embeddings, path: str = DEFAULT_INDEX_DIR, nprobe: int = 8):
+        self.nprobe = nprobe
+        super().__init__(embedding, path=path)
+
+    def _load(self) -> None:
+        with open(os.path.join(self.path, IVF_MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        self.dim = self.manifest["dim"]
+        count, nlist = self.manifest["count"], self.manifest["nlist"]
+        self._open_docs()
+        self._centroids = np.fromfile(os.path.join(self.path, IVF_CENTROIDS_FILE), dtype=np.float32).reshape(nlist, self.dim)
+        self._lists = np.fromfile(os.path.join(self.path, IVF_LISTS_FILE), dtype=np.int64)
+        self._codes = np.memmap(os.path.join(self.path, IVF_CODES_FILE), dtype=np.int8, mode="r", shape=(count, self.dim))
+        self._scales = np.memmap(os.path.join(self.path, IVF_SCALES_FILE), dtype=np.float32, mode="r", shape=(count,))
+        self._rows = np.memmap(os.path.join(self.path, IVF_ROWS_FILE), dtype=np.int64, mode="r", shape=(count,))
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        raise ReadOnlyIndexError(IVF_READ_ONLY_MESSAGE)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        raise ReadOnlyIndexError(IVF_READ_ONLY_MESSAGE)
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        query = _normalize(embedding)
+        centroid_scores = self._centroids @ query
+        probes = _top_k(centroid_scores, self.nprobe)
+        candidates, scores = [], []
+        for p in probes:
+            start, end = self._lists[p], self._lists[p + 1]
+            if start == end:
+                continue
+            # q . (c + s * codes) == q . c + s * (codes @ q)
+            residual = self._codes[start:end].astype(np.float32) @ query
+            scores.append(centroid_scores[p] + self._scales[start:end] * residual)
+            candidates.append(np.arange(start, end))
+        if not candidates:
+            return []
+        candidates, scores = np.concatenate(candidates), np.concatenate(scores)
+        best = _top_k(scores, k)
+        return [(self.docs.get(int(self._rows[candidates[i]]))[1], float(scores[i])) for i in best]
+
+
+# --- Backend selection ---
+
+def load_vector_store(embeddings: Embeddings, index_name: str, namespace: str) -> VectorStore:
+    """Opens the vector store selected by VECTOR_STORE_BACKEND."""
+    backend = os.getenv("VECTOR_STORE_BACKEND", "pinecone").lower()
+    if backend == "pinecone":
+        from langchain_pinecone import PineconeVectorStore
+        print(f"Connecting to Pinecone index '{index_name}'...")
+        store = PineconeVectorStore.from_existing_index(index_name=index_name, embedding=embeddings, namespace=namespace)
+        print(f"Successfully connected to Pinecone, using namespace '{namespace}'.")
+        return store
+    path = os.getenv("VECTOR_STORE_PATH", DEFAULT_INDEX_DIR)
+    if backend == "numpy":
+        store = NumpyVectorStore(embeddings, path=path)
+        print(f"Loaded local vector index from '{path}' ({store.count} documents).")
+        return store
+    if backend == "ivf":
+        nprobe = int(os.getenv("VECTOR_STORE_NPROBE", "8"))
+        store = IVFVectorStore(embeddings, path=path, nprobe=nprobe)
+        print(f"Loaded IVF vector index from '{path}' ({store.manifest['count']} documents, {store.manifest['nlist']} lists, nprobe={nprobe}).")
+        return store
+    raise ValueError(f"Unknown VECTOR_STORE_BACKEND '{backend}'")
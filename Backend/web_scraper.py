@@ -0,0 +1,415 @@
+# backend/web_scraper.py
+"""Web page scraping for the agent's ``web_scraper_tool``.
+
+``WebScraper.scrape`` is async and shares one pooled ``httpx.AsyncClient``
+per process (SCRAPER_MAX_CONNECTIONS in total), with at most
+SCRAPER_PER_HOST_LIMIT requests in flight to any one host. Bodies are read
+up to SCRAPER_MAX_BYTES and only HTML or plain text is accepted. The per-host
+limits are kept for the SCRAPER_MAX_HOSTS most recently used hosts.
+
+URLs come from the LLM, so before every request (redirects included) the
+host is resolved and refused unless all of its addresses are public:
+loopback, private, link-local (e.g. the 169.254.169.254 metadata endpoint)
+and other reserved ranges are never fetched.
+
+Responses are kept in an on-disk HTTP cache (``HttpCache``). A cached page
+is reused without a request while it is fresh (Cache-Control max-age, or
+SCRAPER_CACHE_TTL when the server sends none); after that it is revalidated
+with If-None-Match / If-Modified-Since and a 304 reuses the stored body.
+``no-store`` responses are never written.
+
+Only the main content of a page goes back to the agent: scripts, navigation,
+headers, footers and similar boilerplate are dropped, the densest block of
+paragraphs is kept, and the text is cut to SCRAPER_TOKEN_BUDGET tokens
+(estimated at four characters per token) at a paragraph or sentence
+boundary.
+"""
+import asyncio
+import contextlib
+import hashlib
+import ipaddress
+import json
+import os
+import re
+import socket
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from bs4 import BeautifulSoup
+
+from . import metrics
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_DIR = os.path.join(BACKEND_DIR, ".scrape_cache")
+
+SCRAPER_MAX_CONNECTIONS = int(os.getenv("SCRAPER_MAX_CONNECTIONS", "20"))
+SCRAPER_PER_HOST_LIMIT = int(os.getenv("SCRAPER_PER_HOST_LIMIT", "2"))
+SCRAPER_MAX_HOSTS = int(os.getenv("SCRAPER_MAX_HOSTS", "256"))
+SCRAPER_TIMEOUT_SECONDS = float(os.getenv("SCRAPER_TIMEOUT_SECONDS", "10"))
+SCRAPER_MAX_BYTES = int(os.getenv("SCRAPER_MAX_BYTES", str(2 * 1024 * 1024)))
+SCRAPER_TOKEN_BUDGET = int(os.getenv("SCRAPER_TOKEN_BUDGET", "1500"))
+SCRAPER_CACHE_TTL = int(os.getenv("SCRAPER_CACHE_TTL", "300"))
+SCRAPER_CACHE_MAX_TTL = int(os.getenv("SCRAPER_CACHE_MAX_TTL", "86400"))
+SCRAPER_CACHE_MAX_ENTRIES = int(os.getenv("SCRAPER_CACHE_MAX_ENTRIES", "2000"))
+CHARS_PER_TOKEN = 4
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+SCRAPE_REQUESTS = metrics.counter("scraper_requests_total", "Web scraper fetches by cache result")
+SCRAPE_SECONDS = metrics.histogram("scraper_fetch_seconds", "Web scraper time per page, including the cache")
+
+_BOILERPLATE_TAGS = ("script", "style", "noscript", "template", "svg", "iframe", "form", "button",
+                     "nav", "header", "footer", "aside")
+_BOILERPLATE_HINT = re.compile(r"\b(nav|menu|footer|header|sidebar|cookie|banner|share|social|comment|promo|advert|related)", re.I)
+_TEXT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+
+
+class ScrapeError(Exception):
+    pass
+
+
+# --- Disk cache ---
+
+@dataclass
+class CachedPage:
+    url: str
+    body: bytes
+    content_type: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+    max_age: int
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.stored_at + self.max_age
+
+
+def _max_age(headers: httpx.Headers) -> Optional[int]:
+    """Seconds the response may be reused without revalidation, or None for ``no-store``."""
+    directives = [d.strip().lower() for d in headers.get("cache-control", "").split(",")]
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0
+    for d in directives:
+        if d.startswith("max-age="):
+            try:
+                return min(int(d[len("max-age="):]), SCRAPER_CACHE_MAX_TTL)
+            except ValueError:
+                break
+    return SCRAPER_CACHE_TTL
+
+
+class HttpCache:
+    """Response bodies plus their validators, one ``<sha256>.json``/``.body`` pair per URL."""
+
+    def __init__(self, root: str = DEFAULT_CACHE_DIR, max_entries: int = SCRAPER_CACHE_MAX_ENTRIES):
+        self.root = root
+        self.max_entries = max_entries
+        self._entries: Optional[int] = None  # counted on the first write, which also creates the directory
+
+    def _paths(self, url: str):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, f"{key}.json"), os.path.join(self.root, f"{key}.body")
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url:
+            return None
+        return CachedPage(url=url, body=body, content_type=meta["content_type"], etag=meta.get("etag"),
+                          last_modified=meta.get("last_modified"), stored_at=meta["stored_at"], max_age=meta["max_age"])
+
+    def put(self, page: CachedPage) -> None:
+        if self._entries is None:
+            os.makedirs(self.root, exist_ok=True)
+            self._entries = sum(1 for name in os.listdir(self.root) if name.endswith(".json"))
+        meta_path, body_path = self._paths(page.url)
+        is_new = not os.path.exists(meta_path)
+        # Body first, then the metadata that points at it; both replaced atomically
+        self._write(body_path, page.body)
+        meta = {"url": page.url, "content_type": page.content_type, "etag": page.etag,
+                "last_modified": page.last_modified, "stored_at": page.stored_at, "max_age": page.max_age}
+        self._write(meta_path, json.dumps(meta).encode("utf-8"))
+        if is_new:
+            self._entries += 1
+            if self._entries > self.max_entries:
+                self._evict()
+
+    def _write(self, path: str, data: bytes) -> None:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _evict(self) -> None:
+        """Drops the least recently stored entries down to 90% of ``max_entries``."""
+        metas = []
+        for name in os.listdir(self.root):
+            if name.endswith(".json"):
+                path = os.path.join(self.root, name)
+                try:
+                    metas.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+        metas.sort()
+        excess = len(metas) - int(self.max_entries * 0.9)
+        for _, meta_path in metas[:max(0, excess)]:
+            for path in (meta_path, meta_path[:-len(".json")] + ".body"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self._entries = len(metas) - max(0, excess)
+
+
+# --- Main-content extraction ---
+
+def _text_length(tag) -> int:
+    return len(tag.get_text(" ", strip=True))
+
+
+def extract_main_text(html: str) -> tuple:
+    """``(title, text)`` of the page's main content."""
+    soup = BeautifulSoup(html, "html.parser")
+    title = soup.title.get_text(strip=True) if soup.title else ""
+    for tag in soup(_BOILERPLATE_TAGS):
+        tag.decompose()
+    for tag in soup.find_all(attrs={"role": ["navigation", "banner", "contentinfo", "complementary"]}):
+        tag.decompose()
+    for tag in soup.find_all(["div", "section", "ul"]):
+        if tag.decomposed:
+            continue
+        hints = " ".join(tag.get("class", [])) + " " + (tag.get("id") or "")
+        # A wrapper that happens to be called "page-header" may still hold the article
+        if _BOILERPLATE_HINT.search(hints) and len(tag.find_all("p")) < 3:
+            tag.decompose()
+
+    root = soup.find("main") or soup.find("article") or soup.find(attrs={"role": "main"})
+    if root is None:
+        # The element whose own paragraphs hold the most text
+        scores: Dict[int, list] = {}
+        for p in soup.find_all("p"):
+            parent = p.parent
+            entry = scores.setdefault(id(parent), [parent, 0])
+            entry[1] += _text_length(p)
+        best = max(scores.values(), key=lambda entry: entry[1], default=None)
+        root = best[0] if best and best[1] > 0 else (soup.body or soup)
+
+    lines = [re.sub(r"\s+", " ", line).strip() for line in root.get_text("\n").splitlines()]
+    return title, "\n".join(line for line in lines if line)
+
+
+def truncate_to_tokens(text: str, budget: int = SCRAPER_TOKEN_BUDGET) -> str:
+    """Cuts ``text`` to about ``budget`` tokens, at a paragraph or sentence boundary when one is close."""
+    limit = budget * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    boundary = max(cut.rfind("\n"), cut.rfind(". "))
+    if boundary > limit * 0.7:
+        cut = cut[:boundary + 1]
+    return cut.rstrip() + "\n[truncated]"
+
+
+# --- Destination check ---
+
+async def _resolve(host: str, port: int) -> list:
+    try:
+        return [ipaddress.ip_address(host)]
+    except ValueError:
+        pass
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise ScrapeError(f"cannot resolve {host}: {e}") from e
+    # Drop any IPv6 zone suffix ("fe80::1%eth0")
+    return [ipaddress.ip_address(info[4][0].split("%")[0]) for info in infos]
+
+
+# --- Scraper ---
+
+class WebScraper:
+    def __init__(self, cache: Optional[HttpCache] = None, max_connections: int = SCRAPER_MAX_CONNECTIONS,
+                 per_host_limit: int = SCRAPER_PER_HOST_LIMIT, timeout: float = SCRAPER_TIMEOUT_SECONDS,
+                 max_bytes: int = SCRAPER_MAX_BYTES, token_budget: int = SCRAPER_TOKEN_BUDGET,
+                 max_hosts: int = SCRAPER_MAX_HOSTS, allowed_networks: Iterable = ()):
+        self.cache = cache
+        self.max_connections = max_connections
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.token_budget = token_budget
+        self.max_hosts = max_hosts
+        # Non-public networks that may still be fetched (tests use loopback)
+        self.allowed_networks = [ipaddress.ip_network(n) for n in allowed_networks]
+        self._client: Optional[httpx.AsyncClient] = None
+        # host -> [semaphore, requests holding or waiting on it], least recently used first
+        self._hosts: "OrderedDict[str, list]" = OrderedDict()
+
+    def _new_client(self, max_connections: int) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            headers={"User-Agent": USER_AGENT, "Accept": "text/html,application/xhtml+xml,text/plain;q=0.9"},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=self.timeout,
+            follow_redirects=True,
+            # Runs for the first request and for every redirect it follows
+            event_hooks={"request": [self._check_destination]},
+        )
+
+    def _address_allowed(self, address) -> bool:
+        if getattr(address, "ipv4_mapped", None) is not None:
+            address = address.ipv4_mapped
+        if any(address in network for network in self.allowed_networks):
+            return True
+        return address.is_global and not address.is_multicast
+
+    async def _check_destination(self, request: httpx.Request) -> None:
+        """Refuses hosts that resolve to loopback, private, link-local or otherwise reserved addresses."""
+        url = request.url
+        if url.scheme not in ("http", "https") or not url.host:
+            raise ScrapeError("only http(s) URLs can be scraped")
+        port = url.port or (443 if url.scheme == "https" else 80)
+        # httpx resolves the name again to connect; this does not cover a resolver that changes its answer
+        addresses = await _resolve(url.host, port)
+        blocked = [str(a) for a in addresses if not self._address_allowed(a)]
+        if blocked or not addresses:
+            raise ScrapeError(f"refusing to fetch {url.host}: it resolves to a non-public address ({', '.join(blocked)})")
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created on first use, inside the server's event loop
+        if self._client is None:
+            self._client = self._new_client(self.max_connections)
+        return self._client
+
+    @contextlib.asynccontextmanager
+    async def _host_limit(self, host: str):
+        entry = self._hosts.get(host)
+        if entry is None:
+            entry = self._hosts[host] = [asyncio.Semaphore(self.per_host_limit), 0]
+        self._hosts.move_to_end(host)
+        entry[1] += 1
+        self._evict_hosts()
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+
+    def _evict_hosts(self) -> None:
+        """Forgets the least recently used idle hosts beyond ``max_hosts``."""
+        excess = len(self._hosts) - self.max_hosts
+        if excess <= 0:
+            return
+        # A host with requests in flight keeps its semaphore, or a new one would let more through
+        for host in [host for host, (_, users) in self._hosts.items() if users == 0][:excess]:
+            del self._hosts[host]
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _download(self, client: httpx.AsyncClient, url: str, cached: Optional[CachedPage]) -> CachedPage:
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+        async with client.stream("GET", url, headers=headers) as response:
+            if response.status_code == 304 and cached is not None:
+                SCRAPE_REQUESTS.inc(result="revalidated")
+                max_age = _max_age(response.headers)
+                cached.stored_at = time.time()
+                cached.max_age = cached.max_age if max_age is None else max_age
+                cached.etag = response.headers.get("etag", cached.etag)
+                cached.last_modified = response.headers.get("last-modified", cached.last_modified)
+                if self.cache is not None:
+                    await asyncio.to_thread(self.cache.put, cached)
+                return cached
+            if response.status_code >= 400:
+                raise ScrapeError(f"HTTP {response.status_code}")
+            content_type = response.headers.get("content-type", "text/html").split(";")[0].strip().lower()
+            if content_type not in _TEXT_TYPES:
+                raise ScrapeError(f"unsupported content type {content_type}")
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body += chunk
+                if len(body) >= self.max_bytes:
+                    # Enough to find the main content; the rest is not read
+                    del body[self.max_bytes:]
+                    break
+            SCRAPE_REQUESTS.inc(result="miss")
+            max_age = _max_age(response.headers)
+            page = CachedPage(url=url, body=bytes(body), content_type=content_type,
+                              etag=response.headers.get("etag"), last_modified=response.headers.get("last-modified"),
+                              stored_at=time.time(), max_age=max_age or 0)
+            if self.cache is not None and max_age is not None:
+                await asyncio.to_thread(self.cache.put, page)
+            return page
+
+    async def fetch(self, url: str, client: Optional[httpx.AsyncClient] = None) -> CachedPage:
+        """The page body, from the cache while fresh, otherwise (re)fetched."""
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ScrapeError("only http(s) URLs can be scraped")
+        cached = await asyncio.to_thread(self.cache.get, url) if self.cache is not None else None
+        if cached is not None and cached.fresh:
+            SCRAPE_REQUESTS.inc(result="hit")
+            return cached
+        if client is not None:
+            return await self._download(client, url, cached)
+        async with self._host_limit(parts.hostname.lower()):
+            return await self._download(self.client, url, cached)
+
+    def _render(self, page: CachedPage) -> str:
+        text = page.body.decode("utf-8", errors="replace")
+        if page.content_type == "text/plain":
+            title = ""
+        else:
+            title, text = extract_main_text(text)
+        header = f"Title: {title}\nSource: {page.url}\n\n" if title else f"Source: {page.url}\n\n"
+        return header + truncate_to_tokens(text, self.token_budget)
+
+    async def scrape(self, url: str) -> str:
+        """Main text of ``url`` for the agent; errors come back as text, like other tool output."""
+        url = url.strip().strip("'\"")
+        started = time.monotonic()
+        try:
+            page = await self.fetch(url)
+            # Parsing is CPU-bound; keep it off the event loop
+            return await asyncio.to_thread(self._render, page)
+        except Exception as e:
+            # Anything that escapes here would fail the whole agent turn
+            SCRAPE_REQUESTS.inc(result="error")
+            return f"Error scraping website: {e}"
+        finally:
+            SCRAPE_SECONDS.observe(time.monotonic() - started)
+
+    def scrape_sync(self, url: str) -> str:
+        """Blocking variant for sync agent runs; uses a short-lived client and event loop."""
+        async def run() -> str:
+            async with self._new_client(self.per_host_limit) as client:
+                url_ = url.strip().strip("'\"")
+                try:
+                    return self._render(await self.fetch(url_, client=client))
+                except Exception as e:
+                    SCRAPE_REQUESTS.inc(result="error")
+                    return f"Error scraping website: {e}"
+        return asyncio.run(run())
+
+
+web_scraper = WebScraper(cache=HttpCache(os.getenv("SCRAPER_CACHE_DIR", DEFAULT_CACHE_DIR)))
@@ -113,7 +113,11 @@ export default function AccountPage() {
             });
             const data = await response.json();
             if (!response.ok) throw new Error(data.detail || "Failed to update password.");
-            
+
+            // Older tokens are revoked by a password change; keep the fresh one
+            if (data.access_token) {
+                login({ ...user, access_token: data.access_token });
+            }
             setMessage(data.message);
             setOldPassword('');
             setNewPassword('');
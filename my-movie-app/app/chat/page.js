@@ -1,6 +1,6 @@
 "use client";
 
-import { useEffect, useState, useRef } from "react";
+import { useCallback, useEffect, useState, useRef } from "react";
 import { useAuth } from "../context/AuthContext";
 import { useRouter } from "next/navigation";
 import Navbar from "../components/Navbar";
@@ -17,6 +17,12 @@ export default function ChatPage() {
   const [messages, setMessages] = useState([
     { sender: "bot", text: "Welcome! How are you feeling today?" },
   ]);
+  // Cursor for the page before the oldest loaded message; null once the start is reached
+  const [olderCursor, setOlderCursor] = useState(null);
+  const [historyKey, setHistoryKey] = useState(0);
+  const loadingOlder = useRef(false);
+  const loadedSessionId = useRef("");
+  const scrollRef = useRef(null);
   const [input, setInput] = useState("");
   const [isLoading, setIsLoading] = useState(false);
   const [context, setContext] = useState({
@@ -88,9 +94,18 @@ export default function ChatPage() {
     }
   }, [activeSessionId]);
 
+  const mapMessages = (rows) =>
+    rows.map((m) => ({
+      id: m.id,
+      sender: m.sender === "bot" ? "bot" : "user",
+      text: m.message,
+    }));
+
   // Load messages for the active session
   useEffect(() => {
     const loadMessages = async () => {
+      setOlderCursor(null);
+      loadedSessionId.current = activeSessionId;
       if (!user?.access_token || !activeSessionId) return;
       const res = await fetch(
         `${process.env.NEXT_PUBLIC_API_URL}/chat/messages?session_id=${encodeURIComponent(
@@ -100,15 +115,15 @@ export default function ChatPage() {
       );
       if (res.ok) {
         const data = await res.json();
-        const mapped = data.map((m) => ({
-          sender: m.sender === "bot" ? "bot" : "user",
-          text: m.message,
-        }));
+        // Latest page of the session; older pages are fetched on scroll-back via `data.before`
+        const mapped = mapMessages(data.messages);
         setMessages(
           mapped.length
             ? mapped
             : [{ sender: "bot", text: "New chat started. How is your day going?" }]
         );
+        setOlderCursor(data.before);
+        setHistoryKey((k) => k + 1);
       } else {
         setMessages([
           { sender: "bot", text: "New chat started. How is your day going?" },
@@ -118,6 +133,32 @@ export default function ChatPage() {
     loadMessages();
   }, [user?.access_token, activeSessionId]);
 
+  // Prepend the page before the oldest loaded message; resolves to the number of messages added
+  const loadOlderMessages = useCallback(async () => {
+    if (!user?.access_token || !activeSessionId || !olderCursor || loadingOlder.current) return 0;
+    loadingOlder.current = true;
+    try {
+      const res = await fetch(
+        `${process.env.NEXT_PUBLIC_API_URL}/chat/messages?session_id=${encodeURIComponent(
+          activeSessionId
+        )}&before=${encodeURIComponent(olderCursor)}`,
+        { headers: { Authorization: `Bearer ${user.access_token}` } }
+      );
+      if (!res.ok) return 0;
+      const data = await res.json();
+      // The user may have switched chats while this page was loading
+      if (loadedSessionId.current !== activeSessionId) return 0;
+      const older = mapMessages(data.messages);
+      setMessages((prev) => [...older, ...prev]);
+      setOlderCursor(data.before);
+      return older.length;
+    } catch {
+      return 0;
+    } finally {
+      loadingOlder.current = false;
+    }
+  }, [user?.access_token, activeSessionId, olderCursor]);
+
   const handleSendMessage = async (e) => {
     e.preventDefault();
     if (!user?.access_token) return;
@@ -356,8 +397,14 @@ export default function ChatPage() {
 
           {/* Chat area + input stacked */}
           <div className="flex flex-col flex-grow bg-chat-area dotted-texture rounded-2xl min-h-0 max-h-full w-full">
-            <div className="flex-grow overflow-y-auto">
-              <MessageList messages={messages} />
+            <div ref={scrollRef} className="flex-grow overflow-y-auto">
+              <MessageList
+                messages={messages}
+                scrollRef={scrollRef}
+                hasOlder={Boolean(olderCursor)}
+                onLoadOlder={loadOlderMessages}
+                resetKey={historyKey}
+              />
             </div>
             {isLoading && (
               <div className="p-2 text-sm text-pink-300 animate-pulse bg-chat-area text-center rounded-t-lg">
@@ -1,11 +1,54 @@
+import { useEffect, useLayoutEffect, useRef } from 'react';
 import Message from './Message';
 
-export default function MessageList({ messages }) {
+// `scrollRef` is the scrolling container around the list. When `hasOlder` is
+// set, reaching the top of the list calls `onLoadOlder` to prepend the previous
+// page; `resetKey` changes whenever a fresh page replaces the list.
+export default function MessageList({ messages, scrollRef, hasOlder = false, onLoadOlder, resetKey }) {
+  const topRef = useRef(null);
+  const heightBeforeLoad = useRef(null);
+
+  // A freshly loaded session starts at its latest message
+  useLayoutEffect(() => {
+    const scroller = scrollRef?.current;
+    if (scroller) scroller.scrollTop = scroller.scrollHeight;
+    heightBeforeLoad.current = null;
+  }, [resetKey, scrollRef]);
+
+  // Keep the same message in view after older ones are prepended
+  useLayoutEffect(() => {
+    const scroller = scrollRef?.current;
+    if (scroller && heightBeforeLoad.current !== null) {
+      scroller.scrollTop += scroller.scrollHeight - heightBeforeLoad.current;
+      heightBeforeLoad.current = null;
+    }
+  }, [messages, scrollRef]);
+
+  useEffect(() => {
+    if (!hasOlder || !onLoadOlder || !topRef.current) return;
+    const observer = new IntersectionObserver(
+      (entries) => {
+        if (!entries[0].isIntersecting) return;
+        heightBeforeLoad.current = scrollRef?.current?.scrollHeight ?? null;
+        Promise.resolve(onLoadOlder()).then((added) => {
+          if (!added) heightBeforeLoad.current = null;
+        });
+      },
+      { root: scrollRef?.current || null }
+    );
+    observer.observe(topRef.current);
+    return () => observer.disconnect();
+  }, [hasOlder, onLoadOlder, scrollRef]);
+
   return (
     <div className="flex-grow p-4 overflow-y-auto">
+      <div ref={topRef} />
+      {hasOlder && (
+        <div className="text-center text-xs text-gray-400 mb-4">Loading earlier messages…</div>
+      )}
       {messages.map((msg, index) => (
-        <Message key={index} sender={msg.sender} text={msg.text} />
+        <Message key={msg.id ?? `local-${index}`} sender={msg.sender} text={msg.text} />
       ))}
     </div>
   );
-}
\ No newline at end of file
+}
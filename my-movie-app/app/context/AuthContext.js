@@ -27,6 +27,14 @@ export function AuthProvider({ children }) {
 
   // Logout function
   const logout = () => {
+    // Revoke the token server-side; the local session is cleared regardless
+    if (user?.access_token) {
+      fetch(`${process.env.NEXT_PUBLIC_API_URL}/logout`, {
+        method: 'POST',
+        headers: { Authorization: `Bearer ${user.access_token}` },
+        keepalive: true,
+      }).catch(() => {});
+    }
     localStorage.removeItem('cineverse_user');
     setUser(null);
   };